@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Color managed previews without Ghostscript.
+
+A grayscale image has just 256 values and each value is printed with one
+mix of inks. So the color of each value can be calculated in advance,
+with an ICC profile of the press, and the preview is a lookup of each
+pixel in that table.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+import numpy as np
+import PIL.Image as Image
+try:
+    from PIL import ImageCms
+except ImportError:
+    # PIL without littleCMS, only the naive conversion is available
+    ImageCms = None
+
+from epstool import get_device_n_table, get_cmyk
+from compatibility import tobytes
+
+__all__ = ['ColorManagementError', 'intents', 'mix_cmyk', 'cmyk_to_rgb',
+           'ColorTransform']
+
+
+class ColorManagementError(Exception):
+    pass
+
+
+# the rendering intents of ICC
+intents = {
+    'perceptual': 0,
+    'relative': 1,
+    'saturation': 2,
+    'absolute': 3
+}
+
+
+def mix_cmyk(amounts, *inks):
+    """ Mix inks like the fallback to DeviceCMYK in the eps does it: the
+    CMYK values of the inks, multiplied by their amounts, are added.
+    
+    amounts: a numpy array of uint8, the last axis has the amount of each
+             of inks, like get_device_n_table returns
+    Return an array of floats from 0 to 1 with the CMYK value for each
+    of amounts in the last axis.
+    """
+    cmyk = np.array([get_cmyk(ink) for ink in inks], dtype=float).reshape(-1, 4)
+    return np.minimum(1, (amounts / 255).dot(cmyk))
+
+
+def cmyk_to_rgb(cmyk):
+    """ Convert CMYK from 0 to 1 to RGB from 0 to 1 with
+    R = 1 - min(1, C + K) etc. This is close to what Ghostscript does
+    without color management.
+    """
+    return 1 - np.minimum(1, cmyk[..., :3] + cmyk[..., 3:])
+
+
+class ColorTransform(object):
+    """ Make the lookup tables that convert the pixel values of a grayscale
+    image to the colors of a set of inks.
+    
+    cmyk_profile: the filename of an ICC profile of the press, which is used
+                  to convert the mixed CMYK values of the inks to RGB. If
+                  None the naive conversion of cmyk_to_rgb is used.
+    rgb_profile: the filename of an ICC profile of the display, by default
+                 sRGB
+    intent: a key of intents
+    
+    The tables of the most recently used sets of inks are cached.
+    """
+    max_tables = 64
+    
+    def __init__(self, cmyk_profile=None, rgb_profile=None, intent='perceptual'):
+        self._transform = None
+        if cmyk_profile is not None:
+            if ImageCms is None:
+                raise ColorManagementError('PIL has no support for ICC profiles (ImageCms).')
+            try:
+                source = ImageCms.getOpenProfile(cmyk_profile)
+                if rgb_profile is None:
+                    target = ImageCms.createProfile('sRGB')
+                else:
+                    target = ImageCms.getOpenProfile(rgb_profile)
+                self._transform = ImageCms.buildTransform(source, target,
+                                        'CMYK', 'RGB', intents[intent])
+            except (IOError, ImageCms.PyCMSError) as e:
+                raise ColorManagementError('Can\'t use the ICC profile: {0}'.format(e))
+        # key => table, the least recently used first
+        self._tables = OrderedDict()
+    
+    @property
+    def is_color_managed(self):
+        return self._transform is not None
+    
+    def get_rgb(self, amounts, *inks):
+        """ Return the colors of amounts, a numpy array like
+        get_device_n_table returns, as array of uint8 with the same shape
+        but 3 values, R G and B, in the last axis.
+        """
+        cmyk = mix_cmyk(amounts, *inks)
+        if self._transform is None:
+            return np.rint(cmyk_to_rgb(cmyk) * 255).astype(np.uint8)
+        shape = cmyk.shape[:-1]
+        cmyk = np.rint(cmyk * 255).astype(np.uint8).reshape(1, -1, 4)
+        im = Image.frombuffer('CMYK', (cmyk.shape[1], 1), tobytes(cmyk),
+                              'raw', 'CMYK', 0, 1)
+        rgb = ImageCms.applyTransform(im, self._transform)
+        return np.asarray(rgb, dtype=np.uint8).reshape(shape + (3, ))
+    
+    @staticmethod
+    def _get_key(*inks):
+        # repr is a string, no matter which types the args have
+        return repr([(ink.get_args(), get_cmyk(ink)) for ink in inks])
+    
+    def get_table(self, *inks):
+        """ Return a numpy array of uint8 with the shape (256, 4): the color
+        for each pixel value of a grayscale image, in the pixel format of
+        cairo.FORMAT_RGB24, B G R and unused.
+        """
+        key = self._get_key(*inks)
+        table = self._tables.pop(key, None)
+        if table is None:
+            rgb = self.get_rgb(get_device_n_table(*inks), *inks)
+            table = np.zeros((256, 4), dtype=np.uint8)
+            table[:, :3] = rgb[:, ::-1]
+            if len(self._tables) >= self.max_tables:
+                self._tables.popitem(last=False)
+        # the most recently used tables are at the end
+        self._tables[key] = table
+        return table
+    
+    @staticmethod
+    def apply(table, pixels):
+        """ Return the colors of pixels, a numpy array of uint8 with the shape
+        (height, width), as array with the shape (height, width, 4).
+        """
+        return table[pixels]
@@ -22,7 +22,8 @@ from __future__ import division, print_function, unicode_literals
 
 import sys
 
-__all__ = ['repair_gsignals', 'range', 'encode', 'decode']
+__all__ = ['repair_gsignals', 'range', 'encode', 'decode', 'string_types',
+           'tobytes']
 
 if sys.version_info < (3,0):
     # Had following error with Python 2.7.4 and GTK 3.6.4 when using
@@ -36,6 +37,8 @@ if sys.version_info < (3,0):
     
     range = xrange
     
+    string_types = (basestring, )
+    
     def encode(unicodestring):
         """ unicode to string """
         return unicodestring.encode('utf-8')
@@ -49,8 +52,22 @@ else:
     
     range = range
     
+    string_types = (str, bytes)
+    
     def _unit(arg):
         return arg
     
     encode = _unit
     decode = _unit
+
+
+def tobytes(array):
+    """ Return the data of a numpy array or of a PIL image as bytes.
+    
+    tostring was renamed to tobytes in newer versions of numpy and PIL
+    and is gone in numpy 2.
+    """
+    tobytes = getattr(array, 'tobytes', None)
+    if tobytes is None:
+        return array.tostring()
+    return tobytes()
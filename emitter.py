@@ -20,15 +20,93 @@
 
 from __future__ import division
 
-from weakref import WeakSet
+from weakref import WeakKeyDictionary, ref as weakref
+from collections import OrderedDict
 
-__all__ = ['Emitter']
+__all__ = ['Emitter', 'set_scheduler', 'flush_deferred']
+
+
+# pending deliveries of deferred subscriptions, see Emitter.add
+# key: (subscriber ref, callback, args) or a unique object if these
+#      can't be hashed
+# value: (emitter ref, subscriber ref, callback, args)
+_deferred = OrderedDict()
+_scheduler = None
+_scheduled = False
+
+
+def set_scheduler(schedule):
+    """ Set the function that is used to deliver deferred events.
+    
+    schedule is called with flush_deferred as argument and must call it
+    once in the next iteration of the main loop. With Gtk this is:
+    >>>
+    set_scheduler(lambda flush: GObject.idle_add(flush,
+                                    priority=GObject.PRIORITY_HIGH_IDLE))
+    <<<
+    As long as no scheduler is set (None) deferred subscriptions are
+    delivered immediately.
+    """
+    global _scheduler
+    _scheduler = schedule
+
+
+def _defer(emitter, thing, callback, args):
+    global _scheduled
+    thing_ref = weakref(thing)
+    key = (thing_ref, callback, args)
+    try:
+        hash(key)
+    except TypeError:
+        # unhashable arguments can't be collapsed, keep them all
+        key = object()
+    # a duplicate is moved to the end, so the order of the deliveries is
+    # the order of the latest events
+    _deferred.pop(key, None)
+    _deferred[key] = (weakref(emitter), thing_ref, callback, args)
+    if not _scheduled:
+        _scheduled = True
+        _scheduler(flush_deferred)
+
+
+def flush_deferred():
+    """ Deliver all pending events of deferred subscriptions.
+    
+    Events emitted meanwhile are delivered with the next flush.
+    Returns False, so it can be used directly as a Gtk idle callback
+    that runs once.
+    """
+    global _scheduled
+    _scheduled = False
+    pending = list(_deferred.values())
+    _deferred.clear()
+    for emitter_ref, thing_ref, callback, args in pending:
+        thing = thing_ref()
+        emitter = emitter_ref()
+        if thing is None or emitter is None \
+                or thing not in emitter._subscriptions:
+            # unsubscribed meanwhile
+            continue
+        getattr(thing, callback)(*args)
+    return False
+
+
+class _Subscription(object):
+    """ How a subscriber wants to receive the events, see Emitter.add """
+    __slots__ = ('events', 'deferred')
+    
+    def __init__(self, events, deferred):
+        self.events = frozenset(events) if events is not None else None
+        self.deferred = deferred
+    
+    def wants(self, names):
+        return self.events is None or not self.events.isdisjoint(names)
 
 
 class Emitter(object):
     """Simple events.
     
-    The subscribers are stored in a weakref.WeakSet, so:
+    The subscribers are stored in a weakref.WeakKeyDictionary, so:
         - Deleting all references to a subscriberend will end the subscription.
         - There will never be more than one subscription per object, no
           matter how often it was subscribed via add()
@@ -45,22 +123,30 @@ class Emitter(object):
     @property
     def _subscriptions(self):
         if not hasattr(self, '_Emitter__subscriptions'):
-            self.__subscriptions = WeakSet()
+            self.__subscriptions = WeakKeyDictionary()
         return self.__subscriptions
     
-    def add(self, thing):
+    def add(self, thing, events=None, deferred=False):
         """ Subscribe to this emmiter.
         
         Be warned that the Emitter expects certain callback methods to exist
         in the subscribing object. The name of the methods and the behavior
         depends on the concrete implementation of the emitter.
         
+        events: None to receive all events or an iterable of the names
+                of the events thing is interested in. The names depend
+                on the concrete implementation of the emitter.
+        deferred: if True the events are queued and delivered once per
+                  iteration of the main loop, the same event with the same
+                  arguments is delivered only once. See set_scheduler.
+        
+        Subscribing thing again replaces its former events and deferred.
         """
-        self._subscriptions.add(thing)
+        self._subscriptions[thing] = _Subscription(events, deferred)
     
     def discard(self, thing):
         """ Remove thing from the set of subscribers if present. """
-        self._subscriptions.discard(thing)
+        self._subscriptions.pop(thing, None)
     
     def remove(self, thing):
         """ Remove thing from the set of subscribers.
@@ -68,15 +154,31 @@ class Emitter(object):
         raises KeyError if thing is not present
         
         """
-        self._subscriptions.remove(thing)
+        del self._subscriptions[thing]
+    
+    def _emit(self, callback, args, names=()):
+        """ Call the method callback with args of each subscriber that
+        wants to receive one of the event names.
+        
+        Subscribers that are not filtering by event names receive all
+        events, also those without names.
+        """
+        # a copy, subscribers may subscribe or unsubscribe meanwhile
+        for thing, subscription in list(self._subscriptions.items()):
+            if not subscription.wants(names):
+                continue
+            if subscription.deferred and _scheduler is not None:
+                _defer(self, thing, callback, args)
+            else:
+                getattr(thing, callback)(*args)
     
     @classmethod
     def _cleanstate(Cls, state):
-        """ pickle protocol: Remove the weakset when pickling. """
+        """ pickle protocol: Remove the subscriptions when pickling. """
         # this is what the __ makes with atrribute names:
         #    _{0}{1}.format(ClassName, MethodName)
         if '_Emitter__subscriptions' in state:
-            del state['_Emitter__subscriptions'] # remove the WeakSet
+            del state['_Emitter__subscriptions'] # remove the WeakKeyDictionary
     
     def __getstate__(self):
         state = self.__dict__.copy() # copy the dict since we change it
@@ -27,7 +27,7 @@ from datetime import datetime
 import numpy as np
 
 from interpolation import interpolation_strategies_dict
-from compatibility import decode
+from compatibility import decode, range, tobytes
 __all__ = ['EPSTool', 'EPSToolException']
 
 DIRECTORY = decode(os.path.dirname(os.path.realpath(__file__)))
@@ -117,8 +117,7 @@ $DuotoneNames
 $DuotoneCMYKValues
 
 %note: this is the duotoneColorspace with a fallback to DeviceCMYK
-[
-  /Indexed
+/DuotoneDeviceN
   [
     /DeviceN
     DuotoneNames
@@ -160,12 +159,9 @@ $DuotoneCMYKValues
       %stack: C M Y K
     }
   ]
-  255
-  %note: < > delimits a hexadecimal string
-  <
-  $deviceNLUT
-  >
-]
+def
+
+$colorSpace
 setcolorspace
 
 
@@ -216,7 +212,7 @@ setcolorspace
 %%+ coding,” below. The length of the array must be twice the number of color
 %%+ coponents in the current color space. In an image dictionary used with
 %%+ imagemask, the value of this entry must be either [0 1] or [1 0].
-/Decode [0 255] def  % this is typical for the INDEXED color space 
+/Decode $decode def
 /DataSource {picstr1 readdata} def
 currentdict end
 %note: inject the beginimage procedure here
@@ -230,6 +226,21 @@ grestore % matches EPS gsave
 )
 
 
+indexed_color_space = Template("""%note: the image data are indexes of the lookup table
+[
+  /Indexed
+  DuotoneDeviceN
+  255
+  %note: < > delimits a hexadecimal string
+  <
+  $deviceNLUT
+  >
+]""")
+
+device_n_color_space = """%note: the image data has one byte for each ink per pixel
+DuotoneDeviceN"""
+
+
 def junked(string, chunkLen):
     return [string[i:i+chunkLen] for i in range(0, len(string), chunkLen)]
 
@@ -254,33 +265,48 @@ def junked(string, chunkLen):
 #     length = len(string)
 #     return '%%BeginBinary: {0}{1}\n%%EndBinary'.format(len(string), string)
 
-def get_image_binary(binary):
-    ascii = binascii.hexlify(binary)
-    del binary
-    if bytes is not str:
-        ascii = ascii.decode('utf-8')
-    ascii = junked(ascii, 65)
-    ascii = '\n'.join(ascii)
+# bytes of image data that are encoded at once, the hex encoding of 65
+# bytes are exactly two lines
+image_chunk_size = 65 * 1024
+
+def iter_image_binary(binary):
+    """ Yield the pieces of get_image_binary(binary). The image data is
+    encoded piece by piece, so it is never copied as a whole.
+    
+    binary: str or bytes or a numpy array of uint8, i.e. a numpy.memmap
+    """
+    if isinstance(binary, np.ndarray):
+        data = binary.reshape(-1)
+    else:
+        data = np.frombuffer(binary, dtype=np.uint8)
+    hex_length = len(data) * 2
+    lines = -(-hex_length // 65)
     # the beginimage must be within the begin binary, so a document manager can
     # skip this part. the beginimage counts into the part that can be skipped
-    ascii = ('\nbeginimage\n{0}>'.format(ascii))
-    length = len(ascii)
-    return '%%BeginData: {0} Hex Bytes{1}\n%%EndData'.format(len(ascii), ascii)
+    head = '\nbeginimage\n'
+    length = len(head) + hex_length + max(0, lines - 1) + len('>')
+    yield '%%BeginData: {0} Hex Bytes{1}'.format(length, head)
+    for start in range(0, len(data), image_chunk_size):
+        ascii = binascii.hexlify(tobytes(data[start:start + image_chunk_size]))
+        if bytes is not str:
+            ascii = ascii.decode('utf-8')
+        if start:
+            yield '\n'
+        yield '\n'.join(junked(ascii, 65))
+    yield '>\n%%EndData'
 
-def get_device_n_lut(*inks):
-    """
-    This table has 256 indexes. For two used colors the first index
-    points to two bytes (in the hex representation 4 bytes, 2 bytes
-    are used for one binary byte) The first byte is for the first
-    color the seccond is for the seccond color. These values are an
-    representation of the curves defined in the editor as Loockup Table.
-    It describes how much of the ink should be printed for whatever
-    color value (between 0 and 255, like in the grayscale image)
+def get_image_binary(binary):
+    return ''.join(iter_image_binary(binary))
+
+def get_device_n_table(*inks):
+    """ Return a numpy array of uint8 with 256 rows and a column for each of
+    inks. Each row is the amount of each ink to print for the color value
+    of the row, 0 is black, 255 white.
     """
     table = []
     xs = np.linspace(1.0, 0.0, 256)
     for ink in inks:
-        ip = interpolation_strategies_dict[ink.interpolation](ink.points_value)
+        ip = interpolation_strategies_dict[ink.interpolation](ink.points_array)
         vals = ip(xs)
         vals = np.nan_to_num(vals)
         # no pos will be smaller than 0 or bigger than 1
@@ -289,10 +315,33 @@ def get_device_n_lut(*inks):
         table.append(vals)
     # round to int, make bytes, transpose so that all first bytes are first,
     # its like zip()
-    table = np.rint(np.array(table) * 255) \
-        .astype(np.uint8) \
-        .T \
-        .tostring()
+    return np.rint(np.array(table) * 255).astype(np.uint8).T
+
+def get_gradients_table(*inks):
+    """ Return a numpy array of uint8 with the shape (len(inks) + 1, 256,
+    len(inks)): a row for each ink with just the amounts of that ink,
+    followed by a row with the amounts of all visible inks. Each row has
+    256 pixels, from black to white, with the amount of each ink.
+    """
+    table = get_device_n_table(*inks)
+    rows = np.zeros((len(inks) + 1, 256, len(inks)), dtype=np.uint8)
+    for i, ink in enumerate(inks):
+        rows[i, :, i] = table[:, i]
+        if ink.visible:
+            rows[-1, :, i] = table[:, i]
+    return rows
+
+def get_device_n_lut(*inks):
+    """
+    This table has 256 indexes. For two used colors the first index
+    points to two bytes (in the hex representation 4 bytes, 2 bytes
+    are used for one binary byte) The first byte is for the first
+    color the seccond is for the seccond color. These values are an
+    representation of the curves defined in the editor as Loockup Table.
+    It describes how much of the ink should be printed for whatever
+    color value (between 0 and 255, like in the grayscale image)
+    """
+    table = tobytes(get_device_n_table(*inks))
     table = binascii.hexlify(table).upper()
     if bytes is not str:
         table = table.decode('utf-8')
@@ -309,6 +358,10 @@ process_colors = {
 def is_process_color(ink):
     return ink.name in process_colors
 
+def get_cmyk(ink):
+    """ The CMYK values used for ink when DeviceN is not available """
+    return process_colors[ink.name] if is_process_color(ink) else ink.cmyk
+
 def escape_string(string):
     name = string.replace('\\', '\\\\')
     name = name.replace(')', '\\)')
@@ -399,12 +452,16 @@ def get_duotone_cmyk_values(*inks):
 
     CMYKValues = '\n'.join([
         cmyk_values_format.format(
-            *(process_colors[ink.name] if is_process_color(ink) else ink.cmyk),
+            *get_cmyk(ink),
             name=escape_string(ink.name)
         ) for ink in inks
     ])
     return '/DuotoneCMYKValues [\n{0}\n] def'.format(CMYKValues)
 
+# the template around the image data, see EPSTool.write
+eps_template_head, eps_template_tail = [Template(part) for part
+                                in eps_template.template.split('$ImageBinary')]
+
 class EPSToolException(Exception):
     pass
 
@@ -424,6 +481,9 @@ class EPSTool(object):
         
         self._has_color = False
         self._has_image = False
+        self._image_data = None
+        # the encoded image data, made on demand by create
+        self._image_binary = None
     
     def set_color_data(self, *curves):
         """ Set the colors of the eps.
@@ -431,28 +491,51 @@ class EPSTool(object):
         curves: instances of CurvesModel
         """
         self._has_color = True
-        self._mapping['deviceNLUT'] = get_device_n_lut(*curves)
+        self._mapping['colorSpace'] = indexed_color_space.substitute(
+            deviceNLUT=get_device_n_lut(*curves))
+        self._mapping['decode'] = '[0 255]'
         self._mapping['initColors'] = get_init_colors(*curves)
         self._mapping['DSCColors'] = get_dsc_colors(*curves)
         self._mapping['DuotoneNames'] = get_duotone_names(*curves)
         self._mapping['DuotoneCMYKValues'] = get_duotone_cmyk_values(*curves)
     
+    def set_gradients_data(self, *curves):
+        """ Set the colors and the image to show the gradient of each of
+        curves alone, one row each, followed by a row with the gradient of
+        all visible curves together. The gradients go from black to white
+        and are 256 pixels wide.
+        
+        This sets the image data, too. The image uses the DeviceN color
+        space directly instead of the lookup table, so each row can use
+        other inks.
+        
+        curves: instances of CurvesModel
+        """
+        self.set_color_data(*curves)
+        rows = get_gradients_table(*curves)
+        self._mapping['colorSpace'] = device_n_color_space
+        self._mapping['decode'] = '[{0}]'.format(' '.join(['0 1'] * len(curves)))
+        self.set_image_data(tobytes(rows), (256, len(curves) + 1))
+    
     def set_image_data(self, image_bin, size):
         """Set the pixel data of the image to show in the eps document.
         
         image_bin: str or bytes, the pixel values of a grayscale image each
                    pixel should be one byte from 0 (black) to 255 (white)
+                   Or a numpy array of uint8 with these values, which is
+                   not copied, i.e. a numpy.memmap of a huge image.
         size: tuple of integers: (width, height)
               width * height should be the same as len(image_bin)
         
         """
-        self._mapping['ImageBinary'] = get_image_binary(image_bin)
+        self._image_data = image_bin
+        self._image_binary = None
         self._mapping['width'], self._mapping['height'] = size
         self._has_image = True
     
-    def create(self):
-        """ Return a utf-8 encoded string/bytes with the EPS-data
-        or raise EPSToolException if data is missing.
+    def _get_mapping(self):
+        """ Return the values for the template, without ImageBinary, or
+        raise EPSToolException if data is missing.
         """
         if not self._has_color:
             raise EPSToolException('Color information is missing, use set_color_data')
@@ -460,8 +543,35 @@ class EPSTool(object):
         if not self._has_image:
             raise EPSToolException('Image data is missing, use set_image_data')
         
-        self._mapping['CreationDate'] = datetime.now().ctime()
-        return eps_template.substitute(self._mapping).encode('utf-8')
+        mapping = dict(self._mapping)
+        mapping['CreationDate'] = datetime.now().ctime()
+        return mapping
+    
+    def create(self):
+        """ Return a utf-8 encoded string/bytes with the EPS-data
+        or raise EPSToolException if data is missing.
+        
+        The encoded image data is kept for the next call, when just the
+        color data changes in between.
+        """
+        mapping = self._get_mapping()
+        if self._image_binary is None:
+            self._image_binary = get_image_binary(self._image_data)
+        mapping['ImageBinary'] = self._image_binary
+        return eps_template.substitute(mapping).encode('utf-8')
+    
+    def write(self, f):
+        """ Write the same data as create returns to the binary file object f
+        or raise EPSToolException if data is missing.
+        
+        The image data is encoded piece by piece while writing, so there
+        is never a complete copy of it in memory.
+        """
+        mapping = self._get_mapping()
+        f.write(eps_template_head.substitute(mapping).encode('utf-8'))
+        for piece in iter_image_binary(self._image_data):
+            f.write(piece.encode('utf-8'))
+        f.write(eps_template_tail.substitute(mapping).encode('utf-8'))
 
 if __name__== '__main__':
     import sys
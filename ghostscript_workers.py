@@ -20,18 +20,19 @@
 
 from __future__ import division, print_function, unicode_literals
 
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 import ctypes as c
-from array import array
 from functools import wraps
-import PIL.Image as Image
+from io import BytesIO
+import numpy as np
 
-from epstool import EPSTool
-from mtt2eps import open_image
+from epstool import EPSTool, get_gradients_table
+from image_cache import ImageCache
+from color_management import ColorTransform, mix_cmyk, cmyk_to_rgb
 from ghostscript_runner import GhostScriptRunner, GhostscriptError
-from compatibility import range, encode
+from compatibility import range, tobytes
 
-__all__ = ['PreviewWorker', 'GradientWorker', 'factory']
+__all__ = ['PreviewWorker', 'GradientWorker', 'GridWorker', 'factory']
 
 # just a preparation for i18n
 def _(string):
@@ -88,21 +89,81 @@ def work(eps):
         result = ('result', r[0], r[1], r[2], r[-1].raw)
     return result
 
+def render_gradients(*inks):
+    """ Render the gradients of EPSTool.set_gradients_data with numpy, in
+    this process. Return a result like work.
+    
+    The inks are mixed like the fallback to DeviceCMYK in the eps does, then
+    converted to RGB with R = 1 - min(1, C + K) etc. This is close to what
+    Ghostscript renders, but not exactly the same.
+    """
+    amounts = get_gradients_table(*inks)
+    rgb = cmyk_to_rgb(mix_cmyk(amounts, *inks))
+    height, width = amounts.shape[:2]
+    # the pixel format of cairo.FORMAT_RGB24: B G R unused, in little endian
+    data = np.zeros((height, width, 4), dtype=np.uint8)
+    data[..., :3] = np.rint(rgb[..., ::-1] * 255)
+    return ('result', width, height, width * 4, tobytes(data))
+
+@_catch_all
+def work_cached(eps_tool, image):
+    """ Render eps_tool with the pixels of image, an instance of CachedImage,
+    in a worker process. Return a result like work.
+    """
+    eps_tool.set_image_data(image.map(), image.size)
+    eps = BytesIO()
+    eps_tool.write(eps)
+    return work(eps.getvalue())
+
+@_catch_all
+def work_table(table, image):
+    """ Render the pixels of image, an instance of CachedImage, with table
+    as made by ColorTransform.get_table, in a worker process. Return a
+    result like work.
+    """
+    pixels = image.map()
+    height, width = pixels.shape
+    data = ColorTransform.apply(table, pixels)
+    return ('result', width, height, width * 4, tobytes(data))
+
+@_catch_all
+def work_tables(tables, image):
+    """ Like work_table for many tables, an array of the shape (n, 256, 4).
+    Return ('result', n, width, height, bytes image data) with the n images
+    one after another.
+    """
+    pixels = image.map()
+    height, width = pixels.shape
+    return ('result', len(tables), width, height, tobytes(tables[:, pixels]))
+
 def no_work(result):
     """ Stick to the asynchronous paradigma but do nothing. Return the argument. """
     return result
 
 # end in the process
 class PreviewWorker(object):
-    """ Worker ro render eps images asynchronously """
-    def __init__(self, pool):
+    """ Worker ro render eps images asynchronously
+    
+    The images are loaded just once into image_cache, which is shared by
+    all clients. The worker processes read the pixels from there.
+    
+    color_transform: if not None an instance of ColorTransform, then the
+                     previews are not rendered by Ghostscript but with the
+                     lookup tables of color_transform, which is faster and
+                     can be color managed.
+    """
+    def __init__(self, pool, image_cache=None, color_transform=None):
         self.pool = pool
+        if image_cache is None:
+            image_cache = ImageCache()
+        self.image_cache = image_cache
+        self.color_transform = color_transform
         self._data = {}
     
     @classmethod
-    def new_with_pool(Cls, processes=None):
+    def new_with_pool(Cls, processes=None, color_transform=None):
         pool = Pool(initializer=initializer, processes=processes)
-        return Cls(pool)
+        return Cls(pool, color_transform=color_transform)
     
     def remove_client(self, client_id):
         """ remove the cached data for client_id """
@@ -126,45 +187,73 @@ class PreviewWorker(object):
         if client_id not in self._data:
             self._data[client_id] = {
                 'image_name': None,
-                'eps_tool': None
+                'show_notice': False
             }
         client_data = self._data[client_id]
         if client_data['image_name'] != image_name:
-            eps_tool, notice, error = open_image(image_name)
             client_data['image_name'] = image_name
-            client_data['eps_tool'] = eps_tool
-        else:
-            error = notice = None
-            eps_tool = client_data['eps_tool']
-        return eps_tool, notice, error
+            # the notice of the image is delivered just once, with the next job
+            client_data['show_notice'] = True
+        return client_data
+    
+    def get_image_size(self, client_id, image_name):
+        """ Return the size (width, height) of the image at image_name or None
+        if it can't be opened. The error is reported with the next job.
+        """
+        image, error = self.image_cache.get(image_name)
+        if error is not None:
+            return None
+        return image.size
     
     def add_job(self, client_id, callback_data, image_name, *inks):
+        self.add_scaled_job(client_id, callback_data, image_name, 1, *inks)
+    
+    def add_scaled_job(self, client_id, callback_data, image_name, scale, *inks):
+        """ Like add_job but render the image resized by scale, i.e. a scale
+        of 0.25 renders a preview a quarter as wide and as high as the
+        image, which is a lot faster.
+        """
+        client_data = self._get_client_data(client_id, image_name)
+        image, error = self.image_cache.get(image_name, scale)
         # 'notice' will be used in the cb closure
-        eps_tool, notice, error = self._get_client_data(client_id, image_name)
+        notice = None
         
         if error is not None:
             args = (error, )
             worker = no_work
         else:
-            eps_tool.set_color_data(*inks)
-            eps = eps_tool.create()
-            args = (eps, )
-            worker = work
+            if client_data['show_notice']:
+                notice = image.notice
+                client_data['show_notice'] = False
+            if self.color_transform is not None:
+                # 256 colors, looked up for each pixel by the worker
+                args = (self.color_transform.get_table(*inks), image)
+                worker = work_table
+            else:
+                eps_tool = EPSTool()
+                eps_tool.set_color_data(*inks)
+                # the pixels are not sent to the worker, just where to find them
+                args = (eps_tool, image)
+                worker = work_cached
+            # the worker maps the file of image, it must not be removed before
+            self.image_cache.acquire(image)
         def cb(result):
+            if error is None:
+                self.image_cache.release(image)
             self._callback(callback_data[0], callback_data[1:], result, notice)
         
         self.pool.apply_async(worker, args=args, callback=cb)
     
 class GradientWorker(object):
-    """ Worker to render the gradient of one ore more instances of ModelCurve """
-    def __init__(self, pool):
+    """ Worker to render the gradient of one ore more instances of ModelCurve
+    
+    exact: if True add_gradients_job renders with Ghostscript in the pool,
+           otherwise with render_gradients in this process, which is a lot
+           faster but may differ slightly in color.
+    """
+    def __init__(self, pool, exact=False):
         self.pool = pool
-        
-        self._eps_tool = EPSTool()
-        gradient_bin = array(encode('B'), range(0, 256))
-        # the input gradient is 256 pixels wide and 1 pixel height
-        # we don't need more data and scale this on display
-        self._eps_tool.set_image_data(gradient_bin.tostring(), (256, 1))
+        self.exact = exact
     
     @classmethod
     def new_with_pool(Cls):
@@ -180,20 +269,117 @@ class GradientWorker(object):
         args = user_data + result_data + (buf, )
         callback(*args)
     
-    def add_job(self, callback, *inks):
-        self._eps_tool.set_color_data(*inks)
-        eps = self._eps_tool.create()
+    def add_gradients_job(self, callback, *inks):
+        """ Render the gradients of all inks in one job. The resulting image
+        has a row for the gradient of each of inks alone, in the same order,
+        and as last row the gradient of all visible inks together.
+        See EPSTool.set_gradients_data
+        
+        Unless self.exact is True the callback is called immediately.
+        """
+        if not self.exact:
+            self._callback(callback[0], callback[1:], render_gradients(*inks))
+            return
+        eps_tool = EPSTool()
+        eps_tool.set_gradients_data(*inks)
+        eps = eps_tool.create()
         def cb(result):
             self._callback(callback[0], callback[1:], result)
         self.pool.apply_async(work, args=(eps, ), callback=cb)
     
-def factory():
+class GridWorker(object):
+    """ Worker to render a grid of thumbnails of one image, each with other
+    inks, see variants.make_grid.
+    
+    The image is resized once for all thumbnails and the lookup tables of
+    color_transform are used, the thumbnails are spread across the pool.
+    
+    image_cache: shared with a PreviewWorker, the resized image is likely
+                 there already
+    color_transform: an instance of ColorTransform, by default without
+                     color management
+    """
+    def __init__(self, pool, image_cache, color_transform=None):
+        self.pool = pool
+        self.image_cache = image_cache
+        if color_transform is None:
+            color_transform = ColorTransform()
+        self.color_transform = color_transform
+    
+    def add_grid_job(self, callback, image_name, size, grid, gap=4):
+        """ Render grid, a list of rows, each a list of tuples of inks.
+        
+        size: the longest side of a thumbnail in pixels, not bigger than
+              the image
+        gap: pixels between the thumbnails
+        
+        The callback receives ('result', *user_data, width, height,
+        rowstride, buffer) with the grid in the pixel format of
+        cairo.FORMAT_RGB24 or ('error', *user_data, message, more info).
+        The thumbnails are (width + gap) / columns - gap pixels wide, the
+        same for the height and the rows.
+        """
+        callback, user_data = callback[0], tuple(callback[1:])
+        image, error = self.image_cache.get(image_name)
+        if error is None:
+            scale = min(1, size / max(image.size))
+            image, error = self.image_cache.get(image_name, scale)
+        if error is None and not any(grid):
+            error = ('error', _('There are no thumbnails to render.'), None)
+        if error is not None:
+            callback(*(error[:1] + user_data + error[1:]))
+            return
+        tables = np.array([self.color_transform.get_table(*inks)
+                                        for row in grid for inks in row])
+        # one job per process, each with a part of the thumbnails
+        chunks = np.array_split(np.arange(len(tables)), min(len(tables), cpu_count()))
+        results = [None] * len(chunks)
+        def cb(index, result):
+            self.image_cache.release(image)
+            results[index] = result
+            if any(result is None for result in results):
+                return
+            self._callback(callback, user_data, grid, gap, results)
+        for index, chunk in enumerate(chunks):
+            self.image_cache.acquire(image)
+            self.pool.apply_async(work_tables, args=(tables[chunk], image),
+                callback=lambda result, index=index: cb(index, result))
+    
+    def _callback(self, callback, user_data, grid, gap, results):
+        """ Put the thumbnails of results together and run the callback """
+        for result in results:
+            if result[0] != 'result':
+                callback(*(result[:1] + user_data + result[1:]))
+                return
+        width, height = results[0][2:4]
+        thumbnails = np.concatenate([np.frombuffer(result[-1], dtype=np.uint8)
+                            .reshape(result[1], height, width, 4)
+                            for result in results])
+        rows, columns = len(grid), max(len(row) for row in grid)
+        grid_width = columns * (width + gap) - gap
+        grid_height = rows * (height + gap) - gap
+        # the gaps are white
+        data = np.empty((grid_height, grid_width, 4), dtype=np.uint8)
+        data.fill(255)
+        index = 0
+        for row_index, row in enumerate(grid):
+            top = row_index * (height + gap)
+            for column_index in range(len(row)):
+                left = column_index * (width + gap)
+                data[top:top + height, left:left + width] = thumbnails[index]
+                index += 1
+        buf = c.create_string_buffer(tobytes(data))
+        callback(*(('result', ) + user_data
+                   + (grid_width, grid_height, grid_width * 4, buf)))
+    
+def factory(color_transform=None):
     """ Create a GradientWorker and a PreviewWorker both sharing the same
     worker pool. Return (instance of GradientWorker, instance of PreviewWorker).
     
+    color_transform: see PreviewWorker
     """
     processes = None
     pool = Pool(initializer=initializer, processes=processes)
     gradient_worker = GradientWorker(pool)
-    preview_worker = PreviewWorker(pool)
+    preview_worker = PreviewWorker(pool, color_transform=color_transform)
     return gradient_worker, preview_worker
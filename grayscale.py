@@ -0,0 +1,234 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import struct
+import tempfile
+
+import numpy as np
+import PIL.Image as Image
+from PIL import ExifTags
+
+__all__ = ['ImageManipulation', 'luminance_weights', 'normalize',
+           'get_cache_filename', 'read_cache', 'write_cache']
+
+
+class ImageManipulation(object):
+    # see rectify_rotation
+    for _exif_orientation_tag, search in ExifTags.TAGS.items():
+        if search == 'Orientation':
+            del search
+            break
+    # see rectify_rotation
+    _orientation_transpose_methods = {
+          3: Image.ROTATE_180
+        , 6: Image.ROTATE_270
+        , 8: Image.ROTATE_90
+        }
+    # the same as _orientation_transpose_methods for numpy.rot90
+    _orientation_rotations = {
+          3: 2
+        , 6: 3
+        , 8: 1
+        }
+    
+    @classmethod
+    def get_orientation(cls, image):
+        """ Return the value of the exif tag for orientation of image or None
+        """
+        # only present in JPEGs
+        if not hasattr(image, '_getexif'):
+            return None
+        
+        exif = image._getexif()
+        # has no exif tags
+        if exif is None:
+            return None
+        return exif.get(cls._exif_orientation_tag, None) # 1, 3, 6, 8
+    
+    @classmethod
+    def rectify_rotation(cls, image):
+        """
+        Rotate the image physically to the orientation the exif tag for
+        orientation suggest. Return the original image if no rotation was
+        performed, otherwise return a rotated copy of image.
+        
+        A JPEG image might have an exif tag that tells the viewer how it
+        should be rotatet. Usually the camera writes that tag depending
+        on how it was held when taking the photo.
+        
+        from http://stackoverflow.com/a/11543365/1315369
+        """
+        orientation = cls.get_orientation(image)
+        if orientation in cls._orientation_transpose_methods:
+            transpose_method = cls._orientation_transpose_methods[orientation]
+            return image.transpose(transpose_method)
+        return image
+    
+    @classmethod
+    def rectify_rotation_array(cls, image, pixels):
+        """ Like rectify_rotation but rotate the numpy array pixels, which
+        has the pixels of image. The result is a view of pixels.
+        """
+        orientation = cls.get_orientation(image)
+        if orientation in cls._orientation_rotations:
+            return np.rot90(pixels, cls._orientation_rotations[orientation])
+        return pixels
+
+
+# weights of red, green and blue to calculate the luminance
+luminance_weights = {
+    # ITU-R 601-2, like PIL uses for im.convert('L')
+    'rec601': (0.299, 0.587, 0.114),
+    # ITU-R BT.709, for sRGB
+    'rec709': (0.2126, 0.7152, 0.0722)
+}
+
+# PIL modes with one channel of 16 bit
+_modes_16_bit = frozenset(['I;16', 'I;16L', 'I;16B', 'I'])
+
+
+def normalize(im, weights='rec601', depth=8):
+    """ Return the pixels of the PIL image im rotated like its exif tag
+    for orientation says and converted to grayscale, as numpy array of the
+    shape (height, width) and of uint8 for a depth of 8 or uint16 for a
+    depth of 16.
+    
+    weights: a key of luminance_weights, used to convert colors. With
+             'rec601' an 8 bit result is exactly what im.convert('L') makes.
+    """
+    if im.mode not in _modes_16_bit and im.mode not in ('L', 'RGB'):
+        im = im.convert('L' if im.mode in ('1', 'LA') else 'RGB')
+    pixels = np.asarray(im)
+    if im.mode in _modes_16_bit:
+        pixels = np.clip(pixels, 0, 0xFFFF).astype(np.uint32)
+        source_depth = 16
+    else:
+        pixels = pixels.astype(np.uint32)
+        source_depth = 8
+    
+    if pixels.ndim == 3:
+        # fixed point arithmetic with 16 bits, like PIL does it
+        fixed = [int(round(weight * 0x10000)) for weight in luminance_weights[weights]]
+        pixels = (pixels[..., 0] * fixed[0] + pixels[..., 1] * fixed[1]
+                  + pixels[..., 2] * fixed[2] + 0x8000) >> 16
+    
+    if depth == 16:
+        if source_depth == 8:
+            pixels = pixels * 0x101
+        pixels = pixels.astype(np.uint16)
+    elif source_depth == 16:
+        pixels = ((pixels * 0xFF + 0x7FFF) // 0xFFFF).astype(np.uint8)
+    else:
+        pixels = pixels.astype(np.uint8)
+    return ImageManipulation.rectify_rotation_array(im, pixels)
+
+
+# magic, format version, depth, the mode of the source image, mtime and
+# size of the source file, width, height
+_cache_head = struct.Struct(str('<4sBB8sdQII'))
+_cache_magic = b'MTGR'
+_cache_version = 2
+
+
+def get_cache_filename(filename, weights='rec601', depth=8):
+    """ The file next to filename with the result of normalize """
+    return '{0}.{1}-{2}.gray'.format(filename, weights, depth)
+
+
+def _map(cache_filename, depth, width, height):
+    dtype = np.uint8 if depth == 8 else np.dtype(str('<u2'))
+    return np.memmap(cache_filename, dtype=dtype, mode='r',
+                     offset=_cache_head.size, shape=(height, width))
+
+
+def read_cache(filename, weights='rec601', depth=8):
+    """ Return (pixels, mode) or None if there is no valid cache.
+    
+    pixels: the result of normalize for the image at filename, memory mapped
+            from the cache file
+    mode: the PIL mode of the image at filename
+    
+    The cache is valid if the modification time and the size of filename
+    did not change since it was made, like ImageCache.get_key. A copy of
+    the image has no cache, it is made again for the copy.
+    An edit that keeps the size of the file is not noticed if it is within
+    the resolution of the modification time of the file system, i.e. in
+    the same two seconds on FAT or the same second on ext3 and HFS+. Then
+    the stale cache is used until the file changes again.
+    """
+    cache_filename = get_cache_filename(filename, weights, depth)
+    try:
+        stat = os.stat(filename)
+        with open(cache_filename, 'rb') as f:
+            head = f.read(_cache_head.size)
+    except EnvironmentError:
+        return None
+    if len(head) != _cache_head.size:
+        return None
+    magic, version, cache_depth, mode, mtime, size, width, height \
+                                                = _cache_head.unpack(head)
+    if magic != _cache_magic or version != _cache_version \
+            or cache_depth != depth \
+            or (mtime, size) != (stat.st_mtime, stat.st_size):
+        return None
+    try:
+        pixels = _map(cache_filename, depth, width, height)
+    except (ValueError, EnvironmentError):
+        # i.e. a truncated file
+        return None
+    return pixels, mode.rstrip(b'\0').decode('ascii')
+
+
+def write_cache(filename, pixels, mode, weights='rec601', depth=8):
+    """ Write pixels, the result of normalize for the image at filename,
+    to the cache file. Return pixels memory mapped from the cache file or
+    None if it can't be written, i.e. because the directory is read only.
+    
+    mode: the PIL mode of the image at filename
+    """
+    cache_filename = get_cache_filename(filename, weights, depth)
+    height, width = pixels.shape
+    temp_filename = None
+    try:
+        stat = os.stat(filename)
+        head = _cache_head.pack(_cache_magic, _cache_version, depth,
+                                mode.encode('ascii'), stat.st_mtime,
+                                stat.st_size, width, height)
+        # written to another file first, so no one reads an incomplete cache,
+        # the name is unique for each call, threads write the same cache
+        # at once, see mtt2eps.iter_gray_images
+        directory, name = os.path.split(os.path.abspath(cache_filename))
+        fd, temp_filename = tempfile.mkstemp(dir=directory, prefix=name + '.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head)
+            np.ascontiguousarray(pixels, dtype=pixels.dtype.newbyteorder(str('<')))\
+                                                                .tofile(f)
+        os.rename(temp_filename, cache_filename)
+        return _map(cache_filename, depth, width, height)
+    except EnvironmentError:
+        if temp_filename is not None:
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+        return None
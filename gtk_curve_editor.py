@@ -59,8 +59,7 @@ class Scale(Emitter):
     
     def trigger_on_change(self):
         """ Inform all subscribers when the screen dimensions changed. """
-        for item in self._subscriptions:
-            item.on_scale_change(self)
+        self._emit('on_scale_change', (self, ))
     
     def to_screen(self, point):
         """ Transform point coordinates betewwen 0 and 1 to screen coordinates """
@@ -90,12 +89,106 @@ def in_circle(center_x, center_y, radius, x, y):
     return square_dist < radius ** 2
 
 
+# Rectangles are tuples (x0, y0, x1, y1) in screen coordinates where y = 0
+# is the bottom of the widget, None is an empty rectangle.
+
+def union_rect(*rects):
+    """ Return the smallest rectangle containing all rects """
+    rects = [rect for rect in rects if rect is not None]
+    if not rects:
+        return None
+    x0s, y0s, x1s, y1s = zip(*rects)
+    return (min(x0s), min(y0s), max(x1s), max(y1s))
+
+
+def intersects_rect(a, b):
+    """ Test if the rectangles a and b overlap, None is treated as everything """
+    if a is None or b is None:
+        return True
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class ControlPointIndex(object):
+    """ A grid of the screen coordinates of ControlPoints, so finding the
+    ControlPoints at a position needs to look only at the few ControlPoints
+    in the cells around it.
+    
+    The ControlPoints update their entries when they move, the whole index
+    is updated when the scale changes.
+    """
+    def __init__(self, scale, cell_size):
+        self.scale = scale
+        scale.add(self)
+        self.cell_size = cell_size
+        # (column, row) => set of ControlPoints
+        self._cells = {}
+        # ControlPoint => (owner, screen coordinates, (column, row))
+        self._entries = {}
+    
+    def _get_cell(self, xy):
+        return (int(xy[0] // self.cell_size), int(xy[1] // self.cell_size))
+    
+    def _put(self, ctrl, owner):
+        xy = self.scale.to_screen(ctrl.xy)
+        cell = self._get_cell(xy)
+        self._entries[ctrl] = (owner, xy, cell)
+        self._cells.setdefault(cell, set()).add(ctrl)
+    
+    def add(self, ctrl, owner):
+        """ Add ctrl, owner is returned by find along with ctrl """
+        self.remove(ctrl)
+        self._put(ctrl, owner)
+    
+    def remove(self, ctrl):
+        """ Remove ctrl if present """
+        entry = self._entries.pop(ctrl, None)
+        if entry is None:
+            return
+        cell = entry[2]
+        self._cells[cell].discard(ctrl)
+        if not self._cells[cell]:
+            del self._cells[cell]
+    
+    def update(self, ctrl):
+        """ Update the coordinates of ctrl if present, i.e. after it moved """
+        entry = self._entries.get(ctrl, None)
+        if entry is not None:
+            self.add(ctrl, entry[0])
+    
+    def clear(self):
+        self._cells = {}
+        self._entries = {}
+    
+    def on_scale_change(self, scale):
+        entries = self._entries
+        self.clear()
+        for ctrl, entry in entries.items():
+            self._put(ctrl, entry[0])
+    
+    def find(self, x, y, radius):
+        """ Return a list of (ControlPoint, owner) for each ControlPoint
+        whose screen coordinates are within radius of (x, y)
+        """
+        col0, row0 = self._get_cell((x - radius, y - radius))
+        col1, row1 = self._get_cell((x + radius, y + radius))
+        result = []
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                for ctrl in self._cells.get((col, row), ()):
+                    owner, (ctrl_x, ctrl_y), _ = self._entries[ctrl]
+                    if in_circle(ctrl_x, ctrl_y, radius, x, y):
+                        result.append((ctrl, owner))
+        return result
+
+
 class ControlPoint(Emitter):
     """ A ControlPoint of a Curve in CurveEditor. Will Modify its
     according ModelControlPoint.
     
     Subscribers must implement on_point_delete which is called with a
-    single argument, the instance of ControlPoint
+    single argument, the instance of ControlPoint and on_damage which is
+    called with the instance of ControlPoint and the rectangle that needs
+    to be drawn again.
     
     """
     display_radius = 2
@@ -105,11 +198,13 @@ class ControlPoint(Emitter):
     alt_cursor_type = Gdk.CursorType.PIRATE
     # this is needed for the cairo context arc method, its enough to calculate this once
     end_angle = 2*pi
-    def __init__(self, model, scale):
+    def __init__(self, model, scale, index=None):
         super(ControlPoint, self).__init__()
         self._screen_xy = None
         self.scale = scale
         scale.add(self)
+        # a ControlPointIndex or None
+        self.index = index
         self.model = model
         model.add(self)
         self.active = False
@@ -122,11 +217,17 @@ class ControlPoint(Emitter):
         return self.xy < other.xy
     
     def trigger_on_point_delete(self):
-        for item in self._subscriptions:
-            item.on_point_delete(self)
+        self._emit('on_point_delete', (self, ))
     
-    def on_model_updated(self, model):
+    def trigger_on_damage(self, rect):
+        self._emit('on_damage', (self, rect))
+    
+    def on_model_updated(self, model, *args):
+        old_rect = self.get_extents() if self._screen_xy is not None else None
         self._invalidate()
+        if self.index is not None:
+            self.index.update(self)
+        self.trigger_on_damage(union_rect(old_rect, self.get_extents()))
     
     def _set_coordinates(self, xy):
         self.model.xy = xy
@@ -142,6 +243,13 @@ class ControlPoint(Emitter):
             self._screen_xy = self.scale.to_screen(self.xy)
         return self._screen_xy
     
+    def get_extents(self):
+        """ Return the rectangle covered by draw """
+        x, y = self._get_screen_coordinates()
+        # one more pixel for antialiasing
+        radius = self.display_radius + 1
+        return (x - radius, y - radius, x + radius, y + radius)
+    
     def draw(self, cr):
         """ draw the control point to the cairo context """
         cr.set_source_rgb(*self.color)
@@ -171,29 +279,53 @@ class ControlPoint(Emitter):
         self._set_coordinates(self.scale.to_unit((x_in, y_in)))
 
 
-class Curve(object):
-    """ A Curve in CurveEditor. Will Modify its according ModelCurve """
+class Curve(Emitter):
+    """ A Curve in CurveEditor. Will Modify its according ModelCurve
+    
+    Subscribers must implement on_damage which is called with the instance
+    of Curve and the rectangle that needs to be drawn again, because the
+    curve or one of its control points changed.
+    
+    """
     control_radius = 5
     line_width = 1
     cursor_type = Gdk.CursorType.PLUS
-    def __init__(self, model, scale):
+    # the curve is sampled at least at these many segments and at the
+    # x positions of the control points, see _get_curve_points
+    initial_segments = 16
+    # maximum distance in pixels between the drawn lines and the curve
+    flatness = 0.25
+    def __init__(self, model, scale, index=None):
         super(Curve, self).__init__()
         # active is used by CurveEditor
         self.active = False
         self.scale = scale
         scale.add(self)
+        # a ControlPointIndex or None, the control points are added with
+        # this curve as owner
+        self.index = index
+        self._controls = []
         self.model = model
         model.add(self)
+        # the _curve_points of the last time the curve was drawn
+        self._drawn_points = None
         self._invalidate()
         self._set_points()
     
     def _invalidate(self):
         # the actual points that will be drawn
         self._curve_points = None
+        # the cairo path made of _curve_points
+        self._path = None
         self._interpolation_strategy = None
     
+    def trigger_on_damage(self, rect):
+        if rect is not None:
+            self._emit('on_damage', (self, rect))
+    
     def _set_points(self):
         """ Remove all control points and build them again from self.model """
+        self.detach()
         self._controls = []
         for cp_model in self.model.points:
             self._add_control_point(cp_model)
@@ -208,41 +340,141 @@ class Curve(object):
         """
         if self._interpolation_strategy is None:
             IS = interpolation_strategies_dict[self.model.interpolation]
-            self._interpolation_strategy = IS(self.model.points_value)
+            self._interpolation_strategy = IS(self.model.points_array)
         return self._interpolation_strategy
     
+    def _sample(self, xs):
+        """ Return the ys of the curve at xs, all values between 0 and 1 """
+        ys = np.asarray(self.get_ys(xs), dtype=float)
+        
+        # Returns an array or scalar replacing Not a Number (NaN) with zero,
+        # (positive) infinity with a very large number and negative infinity
+        # with a very small (or negative) number
+        ys = np.nan_to_num(ys)
+        
+        # no y will be smaller than 0 or bigger than 1
+        ys[ys < 0] = 0 # max(0, y)
+        ys[ys > 1] = 1 # min(1, y)
+        return ys
+    
     def _get_curve_points(self):
+        """ Return a tuple of two arrays (xs, ys), the points of the curve
+        in screen coordinates.
+        
+        Only as many points as needed at the current scale are made: each
+        segment is divided at its middle as long as the curve is further
+        than flatness pixels away from the straight line and the segment
+        is wider than a pixel.
+        """
         if self._curve_points is None:
             width, height = self.scale()
-            # this should look smooth enough
-            amount = max(width, height)
-            xs = np.linspace(0, 1, amount)
-            ys = self.get_ys(xs)
-            
-            # Returns an array or scalar replacing Not a Number (NaN) with zero,
-            # (positive) infinity with a very large number and negative infinity
-            # with a very small (or negative) number
-            ys = np.nan_to_num(ys)
+            xs = np.union1d(np.linspace(0, 1, self.initial_segments + 1),
+                            np.clip(self.model.points_array[:, 0], 0, 1))
+            ys = self._sample(xs)
+            min_width = 1 / max(width, 1)
             
-            # no y will be smaller than 0 or bigger than 1
-            ys[ys < 0] = 0 # max(0, y)
-            ys[ys > 1] = 1 # min(1, y)
+            # the segments that may need to be divided
+            candidates = np.diff(xs) > min_width
+            while candidates.any():
+                segments = np.flatnonzero(candidates)
+                mid_xs = (xs[segments] + xs[segments + 1]) / 2
+                mid_ys = self._sample(mid_xs)
+                errors = np.abs(mid_ys - (ys[segments] + ys[segments + 1]) / 2)
+                divide = errors * height > self.flatness
+                if not divide.any():
+                    break
+                segments = segments[divide]
+                xs = np.insert(xs, segments + 1, mid_xs[divide])
+                ys = np.insert(ys, segments + 1, mid_ys[divide])
+                # the first halves of the divided segments, the second
+                # halves follow directly
+                halves = segments + np.arange(len(segments))
+                candidates = np.zeros(len(xs) - 1, dtype=bool)
+                candidates[halves] = True
+                candidates[halves + 1] = True
+                candidates &= np.diff(xs) > min_width
             
-            self._curve_points = zip(xs, ys)
+            self._curve_points = (xs * width, ys * height)
         return self._curve_points
 
+    def _pad_rect(self, rect):
+        # the line width and one more pixel for antialiasing
+        pad = self.line_width + 1
+        return (rect[0] - pad, rect[1] - pad, rect[2] + pad, rect[3] + pad)
+    
+    def get_extents(self):
+        """ Return the rectangle covered by draw """
+        xs, ys = self._get_curve_points()
+        return self._pad_rect((xs[0], ys.min(), xs[-1], ys.max()))
+    
+    def get_controls_extents(self):
+        """ Return the rectangle covered by draw_controls """
+        return union_rect(*[ctrl.get_extents() for ctrl in self._controls])
+    
+    def _update_curve(self):
+        """ Invalidate the curve and return the rectangle where the new
+        curve differs from the curve that was drawn last.
+        """
+        self._invalidate()
+        if self._drawn_points is None:
+            # was not drawn since the last scale change
+            return None
+        old_xs, old_ys = self._drawn_points
+        new_xs, new_ys = self._get_curve_points()
+        # both are polylines, so comparing them at all their points is exact
+        xs = np.union1d(old_xs, new_xs)
+        old_ys = np.interp(xs, old_xs, old_ys)
+        new_ys = np.interp(xs, new_xs, new_ys)
+        changed = np.flatnonzero(new_ys != old_ys)
+        if not len(changed):
+            return None
+        # the neighbors are connected by lines to the changed points
+        start = max(0, changed[0] - 1)
+        stop = min(len(xs), changed[-1] + 2)
+        ys = np.concatenate((new_ys[start:stop], old_ys[start:stop]))
+        return self._pad_rect((xs[start], ys.min(), xs[stop - 1], ys.max()))
+    
     def on_scale_change(self, scale):
-        pass
+        # the CurveEditor draws everything after a scale change
+        self._drawn_points = None
+        self._invalidate()
     
     def _add_control_point(self, cp_model):
-        ctrl = ControlPoint(cp_model, self.scale)
+        ctrl = ControlPoint(cp_model, self.scale, self.index)
         ctrl.add(self) # subscribe
         self._controls.append(ctrl)
+        if self.index is not None:
+            self.index.add(ctrl, self)
+        return ctrl
     
     def _remove_control_point(self, cp_model):
         for ctrl in self._controls:
             if ctrl.model is cp_model:
                 self._controls.remove(ctrl)
+                if self.index is not None:
+                    self.index.remove(ctrl)
+                return ctrl
+        return None
+    
+    def detach(self):
+        """ Remove the control points from the index, when this curve is not
+        used anymore.
+        """
+        if self.index is None:
+            return
+        for ctrl in self._controls:
+            self.index.remove(ctrl)
+    
+    def get_control_position(self, ctrl):
+        """ Return the position of ctrl in the order get_control tests the
+        control points.
+        """
+        return self._controls.index(ctrl)
+    
+    def on_damage(self, ctrl, rect):
+        """ relay the damage of a ControlPoint """
+        if self.model.visible and not self.model.locked:
+            self.trigger_on_damage(rect)
     
     def on_model_updated(self, model, event=None, *args):
         """
@@ -255,24 +487,58 @@ class Curve(object):
             pointUpdate (this is triggered by a child model of this, this
                          model is just a relay)
             
-            All but displayColorChanged require that _curve_points are reset
-            but addPoint, removePoint, setPoints need actions regarding
-            the controlPoints.
+            lockedChanged
+            visibleChanged
+            
+            transaction (the events of Model.transaction, these are
+                         handled one by one)
+            
+            All but displayColorChanged, lockedChanged and visibleChanged
+            require that _curve_points are reset but addPoint, removePoint,
+            setPoints need actions regarding the controlPoints.
+            
+            The rectangle that needs to be drawn again is published via
+            on_damage.
         """
-        if event != 'displayColorChanged':
-            self._invalidate()
+        if event == 'transaction':
+            for relayed in model.get_transaction_events(args[0]):
+                self.on_model_updated(model, *relayed)
+            return
+        if event == 'displayColorChanged':
+            self.trigger_on_damage(self.get_extents())
+            return
+        if event == 'lockedChanged':
+            self.trigger_on_damage(self.get_controls_extents())
+            return
+        if event == 'visibleChanged':
+            self.trigger_on_damage(union_rect(self.get_extents(),
+                                              self.get_controls_extents()))
+            return
         
+        damage = []
         if event == 'addPoint':
             # add a new CP
             cp_model = args[0]
-            self._add_control_point(cp_model)
+            damage.append(self._add_control_point(cp_model).get_extents())
         elif event == 'removePoint':
             # remove the CP
             cp_model = args[0]
-            self._remove_control_point(cp_model)
+            ctrl = self._remove_control_point(cp_model)
+            if ctrl is not None:
+                damage.append(ctrl.get_extents())
         elif event == 'setPoints':
             # remove all CPs and build all CPs again
+            damage.append(self.get_controls_extents())
             self._set_points()
+            damage.append(self.get_controls_extents())
+        
+        damage.append(self._update_curve())
+        if not self.model.visible:
+            return
+        if self.model.locked:
+            # the control points are not drawn
+            damage = damage[-1:]
+        self.trigger_on_damage(union_rect(*damage))
     
     def on_point_delete(self, ctrl):
         self.model.remove_point(ctrl.model)
@@ -297,30 +563,37 @@ class Curve(object):
     def on_button_release(self, button, x_in, y_in, alternate=False):
         pass
     
-    def draw(self, cr):
+    def draw(self, cr, damage=None):
+        """ draw the curve to the cairo context
+        
+        damage: None or the rectangle that needs to be drawn, the curve is
+                only drawn when it covers a part of it.
+        """
         if not self.model.visible:
             return
+        if not intersects_rect(damage, self.get_extents()):
+            return
         
-        ctm = cr.get_matrix()
-        self.scale.transform_cairo(cr)
         cr.set_source_rgb(*self.model.display_color)
-        
-        # draw interpolated curve
-        points = self._get_curve_points()
-        for point in points:
-            cr.line_to(*point)
-        
-        # reset ctm to have proper controll over the line width
-        # and also because everything else that is drawing expects it
-        cr.set_matrix(ctm)
+        cr.new_path()
+        if self._path is None:
+            # draw interpolated curve and keep it until it changes
+            xs, ys = self._get_curve_points()
+            for point in zip(xs, ys):
+                cr.line_to(*point)
+            self._path = cr.copy_path()
+            self._drawn_points = self._curve_points
+        else:
+            cr.append_path(self._path)
         cr.set_line_width(self.line_width)
         cr.stroke()
     
-    def draw_controls(self, cr):
+    def draw_controls(self, cr, damage=None):
         if self.model.locked or not self.model.visible:
             return
         for ctrl in self._controls:
-            ctrl.draw(cr)
+            if intersects_rect(damage, ctrl.get_extents()):
+                ctrl.draw(cr)
     
     def is_control(self, x_in, y_in):
         if self.model.locked or not self.model.visible:
@@ -357,14 +630,20 @@ class CurveEditor(Gtk.DrawingArea):
                  ' and Click</b> on a control point to delete it.')
     _help_pixbuf = Gtk.IconTheme.get_default().load_icon(Gtk.STOCK_HELP, 25, 0)
     _help_pixbuf_offset = 5
+    # the events of ModelCurves that need a draw of the whole widget, the
+    # changes of the curves themselves are received via on_damage
+    _model_events = frozenset(['insertCurve', 'removeCurve', 'setCurves',
+                               'reorderedCurves'])
     def __init__(self, model):
         Gtk.DrawingArea.__init__(self)
         
         self.cursor_type = None
         self._ctrl = None
         self.scale = Scale()
+        self._control_index = ControlPointIndex(self.scale,
+                                                ControlPoint.control_radius * 2)
         self.model = model
-        model.add(self) # subscribe
+        model.add(self, events=self._model_events) # subscribe
         self._set_curves()
         
         
@@ -399,7 +678,8 @@ class CurveEditor(Gtk.DrawingArea):
     def _insert_curve(self, position, curve_model):
         if position < 0:
             position = len(self._curves)
-        curve = Curve(curve_model, self.scale)
+        curve = Curve(curve_model, self.scale, self._control_index)
+        curve.add(self) # subscribe
         self._curves.insert(position, curve)
     
     def _append_curve(self, curve_model):
@@ -409,8 +689,10 @@ class CurveEditor(Gtk.DrawingArea):
         for curve in self._curves:
             if curve.model is curve_model:
                 self._curves.remove(curve)
+                curve.detach()
     
     def _set_curves(self):
+        self._control_index.clear()
         self._curves = []
         for curve_model in self.model.curves:
             self._append_curve(curve_model)
@@ -440,18 +722,34 @@ class CurveEditor(Gtk.DrawingArea):
             # the mouse is not even in the widget
             pass
         else:
-            for level in range(0, 2):
+            # all ControlPoints are 'over' all Curves, see Curve.get_control
+            ctrl = self._find_control_point(x, y)
+            if ctrl is None:
                 for curve in self._curves:
-                    ctrl = curve.get_control(x, y, level)
+                    ctrl = curve.get_control(x, y, 1)
                     if ctrl is not None:
-                        self._ctrl = weakref(ctrl)
                         break
-                if ctrl is not None:
-                    break
+            if ctrl is not None:
+                self._ctrl = weakref(ctrl)
         if ctrl is None:
             self._ctrl = None
         return ctrl
     
+    def _find_control_point(self, x, y):
+        """ Return the ControlPoint at x, y or None.
+        
+        Like asking each curve with get_control(x, y, 0) in the order of
+        self._curves, but only the ControlPoints near x, y are tested.
+        """
+        hits = [(ctrl, curve) for ctrl, curve
+                    in self._control_index.find(x, y, ControlPoint.control_radius)
+                    if not curve.model.locked]
+        if not hits:
+            return None
+        ctrl, curve = min(hits, key=lambda hit: (self._curves.index(hit[1]),
+                                            hit[1].get_control_position(hit[0])))
+        return ctrl
+    
     def _set_cursor(self, ctrl=None, alternate=False):
         #default
         cursor_type = Gdk.CursorType.ARROW
@@ -483,12 +781,11 @@ class CurveEditor(Gtk.DrawingArea):
                 alternate)
     
     def on_model_updated(self, model, event=None, *args):
-        # especially cmykChanged can happen very often and needs no
-        # draw of this widget
-        if event == 'curveUpdate' and (args[1] == 'cmykChanged' \
-                or args[1] == 'nameChanged'):
+        if event == 'transaction':
+            for relayed in model.get_transaction_events(args[0],
+                                                        self._model_events):
+                self.on_model_updated(model, *relayed)
             return
-        
         if event == 'insertCurve':
             # add a curve
             curve_model = args[0]
@@ -506,6 +803,15 @@ class CurveEditor(Gtk.DrawingArea):
         
         self.queue_draw()
     
+    def on_damage(self, curve, rect):
+        """ Draw only the rectangle rect again, not the whole widget. """
+        x0, y0, x1, y1 = rect
+        height = self.scale()[1]
+        # rect has y = 0 at the bottom, gtk at the top
+        x, y = int(np.floor(x0)), int(np.floor(height - y1))
+        self.queue_draw_area(x, y, int(np.ceil(x1)) - x,
+                             int(np.ceil(height - y0)) - y)
+    
     @classmethod
     def query_tooltip_handler(cls, widget, x, y, keyboard_mode, tooltip):
         """ Draws a tooltip when the mouse is over the tooltip icon and if
@@ -525,9 +831,11 @@ class CurveEditor(Gtk.DrawingArea):
     def draw_handler(self, widget, cr):
         # y = 0 is the bottom of the widget
         width, height = self.scale()
+        # gtk clips cr to the region that needs to be drawn, see on_damage
+        clip_x0, clip_y0, clip_x1, clip_y1 = cr.clip_extents()
         
         cr.set_source_rgb(*self.background_color)
-        cr.rectangle(0, 0, width, height)
+        cr.rectangle(clip_x0, clip_y0, clip_x1 - clip_x0, clip_y1 - clip_y0)
         cr.fill()
         
         # This indicates the region where the tooltip of the editor is shown.
@@ -541,10 +849,11 @@ class CurveEditor(Gtk.DrawingArea):
         cr.translate(0, height)
         cr.scale(1, -1)
         
+        damage = (clip_x0, height - clip_y1, clip_x1, height - clip_y0)
         for curve in reversed(self._curves):
-            curve.draw(cr)
+            curve.draw(cr, damage)
         for curve in self._curves:
-            curve.draw_controls(cr)
+            curve.draw_controls(cr, damage)
         
     
     def button_press_handler(self, widget, event):
@@ -619,8 +928,9 @@ if __name__ == '__main__':
     
     m = ModelCurves()
     points = [(0.0,0.0), (0.1, 0.4), (0.2, 0.6), (0.5, 0.2), (0.4, 0.3), (1.0,1.0)]
-    for interpolation, _ in interpolation_strategies:
-        m.append_curve({'points':points, 'interpolation': interpolation})
+    with m.transaction():
+        for interpolation, _ in interpolation_strategies:
+            m.append_curve({'points':points, 'interpolation': interpolation})
     
     a = CurveEditor(m)
     w.add(a)
@@ -22,7 +22,6 @@ from __future__ import division, print_function, unicode_literals
 
 
 import os
-import json
 
 from gi.repository import Gtk, GObject
 
@@ -30,6 +29,8 @@ from gtk_inks_editor import InksEditor
 from gtk_preview import PreviewWindow
 from model import ModelCurves, ModelInk
 from history import History
+from journal import DocumentJournal
+import mttfile
 from emitter import Emitter
 from compatibility import repair_gsignals
 
@@ -92,11 +93,16 @@ class Document(Emitter):
     """
     file_extension = '.mtt' # .m(ulti)t(oner)t(ool)
     untitled_name = _('untitled')
-    def __init__(self, gradient_worker, preview_worker, filename=None, data=None):
+    def __init__(self, gradient_worker, preview_worker, filename=None, data=None,
+                 journal=None):
         if data is None:
             data = {}
+        if journal is None:
+            journal = DocumentJournal(filename, data)
         self._gradient_worker = gradient_worker
         self._preview_worker = preview_worker
+        self._journal = journal
+        self._journal_timeout = None
         
         model = ModelCurves(ChildModel=ModelInk, **data)
         model.add(self)
@@ -117,13 +123,46 @@ class Document(Emitter):
     
     @classmethod
     def new_from_file(Cls, gradient_worker, preview_worker, filename):
-        with open(filename, 'r') as f:
-            data = json.load(f)
-        return Cls(gradient_worker, preview_worker, filename, data)
+        data = mttfile.load(filename)
+        journal = DocumentJournal(filename, data)
+        # data is the last state of the journal if there are changes
+        # that where not saved
+        data, recovered = journal.recover()
+        doc = Cls(gradient_worker, preview_worker, filename, data, journal)
+        journal.add_history(doc.model)
+        if recovered:
+            doc.has_changes = True
+        return doc
+    
+    def _request_journal_write(self):
+        """ this will be called very frequently, so this waits until the last
+        call to this method was 300 millisecconds ago and then appends the
+        state of the model to the journal
+        """
+        if self.filename is None:
+            return
+        # reset the timeout
+        if self._journal_timeout is not None:
+            GObject.source_remove(self._journal_timeout)
+        # schedule a new execution
+        self._journal_timeout = GObject.timeout_add(300, self._write_journal)
+    
+    def _cancel_journal_write(self):
+        """ Return True if a write was requested """
+        if self._journal_timeout is None:
+            return False
+        GObject.source_remove(self._journal_timeout)
+        self._journal_timeout = None
+        return True
+    
+    def _write_journal(self):
+        self._cancel_journal_write()
+        self._journal.append(self.model.get_args())
+        # this timout shall not be executed repeatedly, thus returning false
+        return False
     
     def trigger_on_document_state_update(self, *args):
-        for item in self._subscriptions:
-            item.on_document_state_update(self, *args)
+        self._emit('on_document_state_update', (self, ) + args)
     
     @property
     def has_changes(self):
@@ -142,6 +181,7 @@ class Document(Emitter):
         model updates are used as indicator that the history changed as well
         """
         self.has_changes = True
+        self._request_journal_write()
     
     @property
     def filename(self):
@@ -158,10 +198,11 @@ class Document(Emitter):
         self.label.set_tooltip_text(self._filename or '')
     
     def _save(self, filename):
-        data = self.model.get_args()
-        data = json.dumps(data, sort_keys=True, indent=2, separators=(',', ': '))
-        with open(filename, 'w') as f:
-            f.write(data)
+        state = self.model.get_args()
+        mttfile.save(filename, state)
+        # the saved state is written instead
+        self._cancel_journal_write()
+        self._journal.save(state, filename)
         self.has_changes = False
     
     def save(self):
@@ -172,10 +213,13 @@ class Document(Emitter):
         self.filename = filename
     
     def destroy(self):
-        """ Closes Resources. Only Preview Windows right now. """
+        """ Closes Resources. Preview Windows and the journal. """
         previews = tuple(self._preview_windows)
         for preview in previews:
             preview.destroy()
+        if self._cancel_journal_write():
+            self._write_journal()
+        self._journal.close(discard_changes=self.has_changes)
     
     def destroy_preview_handler(self, widget):
         try:
@@ -29,6 +29,7 @@ import cairo
 from gtk_curve_editor import CurveEditor
 from interpolation import interpolation_strategies, interpolation_strategies_dict
 from emitter import Emitter
+from rate_controller import RateController
 from compatibility import repair_gsignals, encode, decode, range
 
 __all__ = ['InksEditor']
@@ -40,134 +41,170 @@ def _(string):
     return string
 
 
-class CellRendererInk (Gtk.CellRendererText):
-    """Display a preview gradient for just one color in the TreeView
+class InkGradients(Emitter):
+    """ Render the gradient of each ink of model and the gradient of all
+    visible inks together, all with one job of gradient_worker.
     
-    Inheriting from CellRendererText has one advantage: The other GtkTreeWidget
-    (the InkControlPanel) is rendered with CellRendererText, so this widget
-    uses the right height automatically
-       
-    For anything else, this could be a Gtk.GtkCellRenderer without objections
+    Subscribers must implement on_gradients_changed which is called with
+    one argument, the instance of InkGradients. Then get_surface returns
+    the new surfaces.
     """
-    __gsignals__ = repair_gsignals({
-        'received-surface': (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE,
-                             (GObject.TYPE_INT, ))
-    })
+    # whitelist, needs probbaly an update when more relevant events occur
+    _model_events = frozenset(['setCurves', 'insertCurve', 'removeCurve',
+        'reorderedCurves', 'curveUpdate.pointUpdate', 'curveUpdate.addPoint',
+        'curveUpdate.removePoint', 'curveUpdate.setPoints',
+        'curveUpdate.interpolationChanged', 'curveUpdate.visibleChanged',
+        'curveUpdate.cmykChanged', 'curveUpdate.nameChanged'])
     
-    identifier = GObject.property(type=str, default='')
-    
-    def __init__(self, model, gradient_worker, width=-1, height=-1):
-        Gtk.CellRendererText.__init__(self)
-        model.add(self) #subscribe
+    def __init__(self, model, gradient_worker):
+        Emitter.__init__(self)
+        # the surfaces are rendered delayed anyways, so the events can
+        # be deferred
+        model.add(self, events=self._model_events, deferred=True) #subscribe
         self._gradient_worker = gradient_worker
-        self.width = width
-        self.height = height
-        self.state = {}
-        self._set_curves(model)
-    
-    def _init_ink(self, iid):
-        """ init the state for a ink_model"""
-        self.state[iid] = {
-            'surface':None,
-            'timeout':None,
-            'waiting': False,
-            'update_needed': None
-        }
+        # ink id => cairo surface, None => the surface of all visible inks
+        self._surfaces = {}
+        self._timeout = None
+        self._rate = RateController()
+        self._update_needed = None
+        self._no_inks = False
+        self._request_new_surfaces(model)
     
-    def _set_curves(self, model):
-        inks = model.curves
-        ids = model.ids
-        # remove all missing inks
-        for iid in self.state.keys():
-            if iid not in ids:
-                del self.state[iid]
-        # add all new inks
-        for iid, ink_model in zip(ids, inks):
-            if iid not in self.state:
-                self._init_ink(iid)
-                self._request_new_surface(ink_model)
+    def trigger_on_gradients_changed(self):
+        self._emit('on_gradients_changed', (self, ))
+    
+    def get_surface(self, ink_id=None):
+        """ Return a cairo surface, 256 pixels wide and 1 pixel high, with the
+        gradient of the ink with ink_id or of all visible inks together if
+        ink_id is None. Return None if there is no such gradient (yet).
+        """
+        return self._surfaces.get(ink_id, None)
+    
+    @property
+    def ids(self):
+        """ The ids of the inks that have a gradient """
+        return [iid for iid in self._surfaces if iid is not None]
     
     def on_model_updated(self, model, event, *args):
-        if event == 'curveUpdate':
-            ink_model = args[0]
-            ink_event = args[1]
-            # whitelist, needs probbaly an update when more relevant events occur
-            if ink_event in ('pointUpdate', 'addPoint', 'removePoint',
-                            'setPoints', 'interpolationChanged',
-                            'cmykChanged', 'nameChanged'):
-                self._request_new_surface(ink_model)
-        elif event == 'setCurves':
-            self._set_curves(model)
-        elif event == 'insertCurve':
-            ink_model = args[0]
-            iid = ink_model.id
-            self._init_ink(iid)
-            self._request_new_surface(ink_model)
-        elif event == 'removeCurve':
-            ink_model = args[0]
-            iid = ink_model.id
-            if iid in self.state:
-                del self.state[iid]
+        if not model.curves:
+            self._surfaces = {}
+            self._no_inks = True
+            self.trigger_on_gradients_changed()
+            return
+        self._no_inks = False
+        self._request_new_surfaces(model)
     
-    def _request_new_surface(self, ink_model):
+    def _request_new_surfaces(self, model):
         """ this will be called very frequently, because generating the
         gradients can take a moment this waits until the last call to this
-        method was 300 millisecconds ago and then let the rendering start
+        method was a moment ago and then let the rendering start. How long
+        that is depends on how long the rendering took before, see
+        RateController.
         """
         
-        iid = ink_model.id
-        state = self.state[iid]
-        
         # reset the timeout
-        if state['timeout'] is not None:
-            GObject.source_remove(state['timeout'])
+        if self._timeout is not None:
+            GObject.source_remove(self._timeout)
         # schedule a new execution
-        state['timeout'] = GObject.timeout_add(
-            300, self._update_surface, weakref(ink_model))
+        self._timeout = GObject.timeout_add(
+            self._rate.get_delay_ms(), self._update_surfaces, weakref(model))
     
-    def _update_surface(self, weakref_model):
-        ink_model = weakref_model()
+    def _update_surfaces(self, weakref_model):
+        self._timeout = None
+        model = weakref_model()
         # see if the model still exists
-        if ink_model is None:
+        if model is None or not model.curves:
             # need to return False, to cancel the timeout
             return False
-        iid = ink_model.id
-        state = self.state[iid]
-        if state['waiting']:
-            # we are waiting for a job to finish, so we don't put another
-            # job on the queue right now
-            state['update_needed'] = weakref_model
+        
+        if not self._rate.can_start():
+            if self._rate.is_busy():
+                # we are waiting for jobs to finish, so we don't put another
+                # job on the queue right now
+                self._update_needed = weakref_model
+            else:
+                # the last job started just now, try again in a moment
+                self._timeout = GObject.timeout_add(self._rate.get_wait_ms(),
+                                        self._update_surfaces, weakref_model)
             return False
-        state['waiting'] = True
-        callback = (self._worker_callback, iid)
-        self._gradient_worker.add_job(callback, ink_model)
+        
+        token = self._rate.start()
+        callback = (self._worker_callback, token, weakref_model,
+                    tuple(model.ids), bool(model.visible_curves))
+        self._gradient_worker.add_gradients_job(callback, *model.curves)
         
         # this timout shall not be executed repeatedly, thus returning false
         return False
     
     def _worker_callback(self, *args):
-        GLib.idle_add(self._receive_surface, *args)
+        GLib.idle_add(self._receive_surfaces, *args)
     
-    def _receive_surface(self, iid, w, h, rowstride, buf):
-        if iid not in self.state:
+    @staticmethod
+    def _get_row(surface, row):
+        """ Return a copy of one row of surface as new surface """
+        width = surface.get_width()
+        row_surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, 1)
+        cr = cairo.Context(row_surface)
+        cr.set_source_surface(surface, 0, -row)
+        cr.paint()
+        return row_surface
+    
+    def _receive_surfaces(self, token, weakref_model, ids, has_visible,
+                          w, h, rowstride, buf):
+        is_newest = self._rate.finish(token)
+        if self._update_needed is not None:
+            # while we where waiting another update became due
+            model = self._update_needed() # its a weakref
+            self._update_needed = None
+            if model is not None:
+                self._request_new_surfaces(model)
+        model = weakref_model()
+        if not is_newest or self._no_inks or model is None:
+            # a job started later finished already or this received
+            # surfaces after all inks were removed
             return
-        state = self.state[iid]
         
-        cairo_surface = cairo.ImageSurface.create_for_data(
+        surface = cairo.ImageSurface.create_for_data(
             buf, cairo.FORMAT_RGB24, w, h, rowstride
         )
-        state['__keep'] = buf # so the garbage collection doesn't delete it wrongly
-        state['surface'] = cairo_surface
-        state['waiting'] = False
-        if state['update_needed'] is not None:
-            # while we where waiting another update became due
-            ink_model = state['update_needed']() # its a weakref
-            state['update_needed'] = None
-            if ink_model is not None:
-                self._request_new_surface(ink_model)
-        
+        # the rows are copied, so buf can be garbage collected
+        rows = [self._get_row(surface, row) for row in range(h)]
+        current_ids = set(model.ids)
+        surfaces = dict((iid, row) for iid, row in zip(ids, rows)
+                        if iid in current_ids)
+        if has_visible:
+            surfaces[None] = rows[-1]
+        self._surfaces = surfaces
+        self.trigger_on_gradients_changed()
+
+
+class CellRendererInk (Gtk.CellRendererText):
+    """Display a preview gradient for just one color in the TreeView
+    
+    Inheriting from CellRendererText has one advantage: The other GtkTreeWidget
+    (the InkControlPanel) is rendered with CellRendererText, so this widget
+    uses the right height automatically
+       
+    For anything else, this could be a Gtk.GtkCellRenderer without objections
+    """
+    __gsignals__ = repair_gsignals({
+        'received-surface': (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE,
+                             (GObject.TYPE_INT, ))
+    })
+    
+    identifier = GObject.property(type=str, default='')
+    
+    def __init__(self, gradients, width=-1, height=-1):
+        Gtk.CellRendererText.__init__(self)
+        gradients.add(self) #subscribe
+        self._gradients = gradients
+        self.width = width
+        self.height = height
+    
+    def on_gradients_changed(self, gradients):
         #schedule a redraw
-        self.emit('received-surface', iid)
+        for iid in gradients.ids:
+            self.emit('received-surface', iid)
     
     def do_render(self, cr, widget, background_area, cell_area, flags):
         """
@@ -181,9 +218,7 @@ class CellRendererInk (Gtk.CellRendererText):
         """
         # print ('cellRendererInk', cell_area.width, cell_area.height, cell_area.x, cell_area.y)
         iid = int(self.get_property('identifier'))
-        cairo_surface = None
-        if iid in self.state:
-            cairo_surface = self.state[iid]['surface']
+        cairo_surface = self._gradients.get_surface(iid)
         
         width, height = (self.width, cell_area.height)
         
@@ -204,96 +239,19 @@ class CellRendererInk (Gtk.CellRendererText):
 
 class ColorPreviewWidget(Gtk.DrawingArea):
     """ Display a preview gradient of all visible colors in model. """
-    def __init__(self, model, gradient_worker):
+    def __init__(self, gradients):
         Gtk.DrawingArea.__init__(self)
-        model.add(self) #subscribe
-        self._gradient_worker = gradient_worker
-        self._surface = None
-        self._timeout = None
-        self._waiting = False
-        self._update_needed = None
-        self._no_inks = False
+        gradients.add(self) #subscribe
+        self._gradients = gradients
         self.connect('draw' , self.draw_handler)
-        self._request_new_surface(model)
     
-    def on_model_updated(self, inks_model, event, *args):
-        if not inks_model.visible_curves:
-            self._surface = None
-            self.queue_draw()
-            self._no_inks = True
-            return
-        self._no_inks = False
-        if event == 'curveUpdate':
-            # whitelist, needs probbaly an update when more relevant events occur
-            ink_event = args[1]
-            if ink_event not in ('pointUpdate', 'addPoint', 'removePoint',
-                                'setPoints', 'interpolationChanged',
-                                'visibleChanged', 'cmykChanged',
-                                'nameChanged'):
-                return
-        self._request_new_surface(inks_model)
-    
-    def _request_new_surface(self, inks_model):
-        """ this will be called very frequently, because generating the
-        gradients can take a moment this waits until the last call to this
-        method was 300 millisecconds ago and then let the rendering start
-        """
-        
-        # reset the timeout
-        if self._timeout is not None:
-            GObject.source_remove(self._timeout)
-        # schedule a new execution
-        self._timeout = GObject.timeout_add(
-            300, self._update_surface, weakref(inks_model))
-    
-    def _update_surface(self, weakref_model):
-        inks_model = weakref_model()
-        # see if the model still exists
-        if inks_model is None or  not inks_model.visible_curves:
-            # need to return False, to cancel the timeout
-            return False
-        
-        if self._waiting:
-            # we are waiting for a job to finish, so we don't put another
-            # job on the queue right now
-            self._update_needed =  weakref_model
-            return False
-        
-        self._waiting = True
-        
-        callback = (self._worker_callback, )
-        self._gradient_worker.add_job(callback, *inks_model.visible_curves)
-        
-        # this timout shall not be executed repeatedly, thus returning false
-        return False
-    
-    def _worker_callback(self, *args):
-        GLib.idle_add(self._receive_surface, *args)
-    
-    def _receive_surface(self, w, h, rowstride, buf):
-        if self._no_inks:
-            # this may receive a surface after all inks are invisible
-            cairo_surface = None
-        else:
-            cairo_surface = cairo.ImageSurface.create_for_data(
-                buf, cairo.FORMAT_RGB24, w, h, rowstride
-            )
-        
-        self._waiting = False
-        if self._update_needed is not None:
-            # while we where waiting another update became due
-            inks_model = self._update_needed() # its a weakref
-            self._update_needed = None
-            if inks_model is not None:
-                self._request_new_surface(inks_model)
-        
-        self._surface = cairo_surface
+    def on_gradients_changed(self, gradients):
         self.queue_draw()
     
     def draw_handler(self, widget, cr):
         width = self.get_allocated_width()
         height = self.get_allocated_height()
-        cairo_surface = self._surface
+        cairo_surface = self._gradients.get_surface()
         if cairo_surface is not None:
             x = 0
             y = 0
@@ -355,8 +313,7 @@ class InkController(Emitter):
         self.inks.add(self) #subscribe
     
     def trigger_on_changed_ink_selection(self, *args):
-        for item in self._subscriptions:
-            item.on_changed_ink_selection(self, *args)
+        self._emit('on_changed_ink_selection', (self, ) + args)
     
     def changed_ink_selection_handler(self, selection):
         model, paths = selection.get_selected_rows()
@@ -450,16 +407,14 @@ class InkController(Emitter):
         ink_control_panel.connect('reorder', self.reorder_handler)
         return ink_control_panel
     
-    def init_gradient_view(self, gradient_worker, scale):
+    def init_gradient_view(self, gradients, scale):
         gradient_view = Gtk.TreeView(model=self.ink_list_store)
         # gradient_view.set_valign(Gtk.Align.END)
         
         # gradient_view.set_property('headers-visible', False)
         # the width value is just initial and will change when the scale of
         # the CurveEditor changes
-        renderer_ink = CellRendererInk(model=self.inks,
-                                       gradient_worker=gradient_worker,
-                                       width=256)
+        renderer_ink = CellRendererInk(gradients=gradients, width=256)
         renderer_ink.connect('received-surface', self.receive_surface_handler)
         
         column_ink = HScalingTreeColumnView(_('Single Ink Gradients'),
@@ -510,7 +465,10 @@ class InkController(Emitter):
             self._append_to_list(curve_model)
     
     def on_model_updated(self, model, event, *args):
-        if event == 'setCurves':
+        if event == 'transaction':
+            for relayed in model.get_transaction_events(args[0]):
+                self.on_model_updated(model, *relayed)
+        elif event == 'setCurves':
             self._set_curves(model)
         elif event == 'reorderedCurves':
             model_order = args[0]
@@ -548,7 +506,7 @@ class AddInkButton(Gtk.Button):
         
         self.model = model
         self.connect('clicked', self.clicked_handler)
-        model.add(self)
+        model.add(self, events=('removeCurve', 'insertCurve', 'setCurves'))
     
     def clicked_handler(self, *args):
         """ add an ink if there is space """
@@ -556,8 +514,6 @@ class AddInkButton(Gtk.Button):
             self.model.append_curve()
     
     def on_model_updated(self, model, event, *args):
-        if event not in ('removeCurve', 'insertCurve', 'setCurves'):
-            return
         active = len(model) < self.max_inks
         self.set_sensitive(active)
 
@@ -885,6 +841,10 @@ class InkSetup(object):
     cmyk)
     """
     
+    _model_events = frozenset(['curveUpdate.nameChanged',
+                               'curveUpdate.cmykChanged',
+                               'curveUpdate.interpolationChanged'])
+    
     _cmyk_tooltip_format = _('<b>{color}</b> color component to approximate'
                              ' the ink color in print preview.')
     _tooltips = {
@@ -903,7 +863,7 @@ class InkSetup(object):
     
     def __init__(self, model):
         self.model = model
-        model.add(self)
+        model.add(self, events=self._model_events)
         
         self.gtk = frame = Gtk.Box()
         self._ink_options_box = Gtk.Grid()
@@ -933,7 +893,10 @@ class InkSetup(object):
         self.show()
     
     def on_model_updated(self, model, event, *args):
-        if event != 'curveUpdate':
+        if event == 'transaction':
+            for relayed in model.get_transaction_events(args[0],
+                                                        self._model_events):
+                self.on_model_updated(model, *relayed)
             return
         ink = args[0]
         ink_event = args[1]
@@ -1104,6 +1067,8 @@ class InksEditor(Gtk.Grid):
         self.set_row_spacing(5)
         
         self.ink_controller = InkController(model)
+        # renders the gradients for gradient_view and color_preview_widget
+        self.gradients = InkGradients(model, gradient_worker)
         
         curve_editor = self._init_curve_editor(model)
         
@@ -1128,10 +1093,9 @@ class InksEditor(Gtk.Grid):
         
         # scales to the width of curve_editor.scale
         gradient_view = self.ink_controller.init_gradient_view(
-            gradient_worker, curve_editor.scale)
+            self.gradients, curve_editor.scale)
         
-        color_preview_widget = self._init_color_preview_widget(model,
-            gradient_worker)
+        color_preview_widget = self._init_color_preview_widget(self.gradients)
         
         color_preview_label = self._init_color_preview_label()
         open_preview_button = self._init_open_preview_button()
@@ -1174,8 +1138,8 @@ class InksEditor(Gtk.Grid):
         ink_setup.gtk.set_vexpand(True) # so this pushes itself to the bottom
         return ink_setup
     
-    def _init_color_preview_widget(self, model, gradient_worker):
-        widget = ColorPreviewWidget(model, gradient_worker)
+    def _init_color_preview_widget(self, gradients):
+        widget = ColorPreviewWidget(gradients)
         widget.set_hexpand(True)
         widget.set_vexpand(False)
         # set min height
@@ -1322,8 +1286,9 @@ if __name__ == '__main__':
         }
     ]
     
-    for t in init_inks:
-        model.append_curve(t)
+    with model.transaction():
+        for t in init_inks:
+            model.append_curve(t)
     
     window.show_all()
     Gtk.main()
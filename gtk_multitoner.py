@@ -33,6 +33,7 @@ from gtk_actiongroup import ActionGroup
 from gtk_dialogs import show_open_image_dialog, show_message, show_save_as_dialog, \
                     show_save_as_eps_dialog, show_about_dialog
 from gtk_document import Document
+from emitter import set_scheduler
 
 from ghostscript_workers import factory as gs_workers_factory
 from mtt2eps import model2eps
@@ -93,9 +94,10 @@ UI_INFO = """
 
 class Multitoner(Gtk.Grid):
     """ Manage multiple Documents and provide gtk menus and accelarators """
-    def __init__(self):
+    def __init__(self, color_transform=None):
         Gtk.Grid.__init__(self)
-        self._gradient_worker, self._preview_worker = gs_workers_factory()
+        self._gradient_worker, self._preview_worker \
+                                    = gs_workers_factory(color_transform)
         
         self._documents = {}
         self._active_document = None
@@ -409,6 +411,8 @@ class Multitoner(Gtk.Grid):
                   'will be lost.')
             )
         if ok:
+            for doc in self._documents.values():
+                doc.destroy()
             Gtk.main_quit()
             return False
         return True
@@ -500,10 +504,24 @@ if __name__ == '__main__':
     """ bootstrap the application """
     import sys
     import os
+    import argparse
     from gi.repository import GObject, GdkPixbuf
+    from color_management import ColorTransform, ColorManagementError
+    from softproof import OverprintTransform
     
     GObject.threads_init()
-    use_gui, __ = Gtk.init_check(sys.argv)
+    use_gui, argv = Gtk.init_check(sys.argv)
+    parser = argparse.ArgumentParser(description=_('Create multitone EPS '
+                                                   'files for printing.'))
+    parser.add_argument('--profile', metavar='ICC-FILE',
+                        help=_('an ICC profile of the press for color '
+                               'managed previews'))
+    parser.add_argument('--overprint', action='store_true',
+                        help=_('simulate overprinting inks in the previews'))
+    options = parser.parse_args(argv[1:])
+    # deliver the events of deferred subscriptions before redrawing
+    set_scheduler(lambda flush: GObject.idle_add(flush,
+                                    priority=GObject.PRIORITY_HIGH_IDLE))
     
     window = Gtk.Window()
     window.set_title(_('Multitoner'))
@@ -527,9 +545,28 @@ if __name__ == '__main__':
     style_context.add_provider_for_screen(screen, css_provider,
         Gtk.STYLE_PROVIDER_PRIORITY_USER)
     
-    multitoner = Multitoner()
+    color_transform = None
+    profile_error = None
+    try:
+        if options.overprint:
+            # simulate overprinting inks in the preview, see softproof
+            color_transform = OverprintTransform(cmyk_profile=options.profile)
+        elif options.profile is not None:
+            color_transform = ColorTransform(options.profile)
+    except ColorManagementError as e:
+        # the previews are made without the profile
+        profile_error = e
+        if options.overprint:
+            color_transform = OverprintTransform()
+    
+    multitoner = Multitoner(color_transform)
     window.connect('delete-event', multitoner.quit_handler)
     
     window.add(multitoner)
     window.show_all()
+    if profile_error is not None:
+        show_message(window, 'error'
+                    , _('Can\'t use the ICC profile {0}, the previews are '
+                        'not color managed.').format(options.profile)
+                    , '{0}'.format(profile_error))
     Gtk.main()
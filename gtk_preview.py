@@ -26,10 +26,13 @@ from gi.repository import Gtk, GObject, Gdk, GLib, GdkPixbuf
 from gtk_actiongroup import ActionGroup
 import cairo
 from weakref import ref as weakref
+from collections import OrderedDict
 import math
 from compatibility import repair_gsignals, decode
 from gtk_dialogs import show_open_image_dialog, show_message, show_save_as_eps_dialog
 from mtt2eps import model2eps
+from gtk_variants import VariantsWindow
+from rate_controller import RateController
 
 __all__ = ['PreviewWindow']
 
@@ -57,6 +60,8 @@ UI_INFO = """
       <separator />
       <menuitem action='RotateRight' />
       <menuitem action='RotateLeft' />
+      <separator />
+      <menuitem action='Variants' />
     </menu>
   </menubar>
   <toolbar name="ToolBar">
@@ -72,26 +77,58 @@ UI_INFO = """
       <toolitem action='RotateRight' />
       <toolitem action='RotateLeft' />
       <separator />
+      <toolitem action='Variants' />
+      <separator />
       <toolitem action='Quit' />
   </toolbar>
 </ui>
 """
 
 class Canvas(Gtk.Viewport):
-    """ Handle the display and transformation of a cairo_surface """
+    """ Handle the display and transformation of a cairo_surface
+    
+    The surface is displayed in tiles of tile_size pixels that are
+    transformed once and cached, so drawing, i.e. when scrolling, just
+    copies the visible tiles. The tiles are made from the level of a
+    mipmap of the surface that is closest to the displayed size, so
+    transforming a tile reads no more pixels than needed.
+    
+    A tile is rotated but not scaled: it has the resolution of its mipmap
+    level and is scaled to the displayed size when it is drawn, by a
+    factor between 0.5 and 1 when zoomed out. So the tiles of a level are
+    used for all scales of that level and zooming does not render the
+    visible tiles again. The tiles of all levels and rotations share the
+    cache, the least recently used are removed first.
+    """
+    tile_size = 256
+    # 256 tiles of 256 x 256 pixels take 64 MiB
+    max_tiles = 256
     
     __gsignals__ = repair_gsignals({
         'scale-to-fit-changed': (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (
                                  # the value of scale_to_fit
-                                 GObject.TYPE_BOOLEAN, ))
+                                 GObject.TYPE_BOOLEAN, )),
+        'scale-changed': (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (
+                                 # the value of scale
+                                 GObject.TYPE_DOUBLE, ))
     })
     
     def __init__(self, *args):
         Gtk.Viewport.__init__(self, *args)
         
-        self._transformed_pattern_cache = (None, None)
+        # the transformed tiles: (level, rotation, column, row) => surface
+        self._tiles = OrderedDict()
+        # the source surface the tiles were made of
+        self._tiles_check = None
+        # (level, rotation) => pattern to paint the tiles of that level
+        self._tile_patterns = {}
+        
+        # the source surface followed by versions of half the size each
+        self._mipmaps = []
         
         self._source_surface = None
+        # the size of _source_surface relative to the image it shows
+        self._source_scale = 1
         
         self._center = None
         self._restoring_center = False
@@ -174,10 +211,12 @@ class Canvas(Gtk.Viewport):
         x1, y1, x2, y2 = 0, 0, surface.get_width(), surface.get_height()
         return self._get_bbox_extents(matrix, x1, y1, x2, y2)
     
-    def _get_rotated_matrix(self):
+    def _get_rotated_matrix(self, rotation=None):
         """ matrix with rotation but without scale"""
+        if rotation is None:
+            rotation = self.rotation
         matrix = cairo.Matrix()
-        matrix.rotate(self.rotation * math.pi)
+        matrix.rotate(rotation * math.pi)
         # rotate?
         return matrix
 
@@ -199,10 +238,17 @@ class Canvas(Gtk.Viewport):
         matrix.scale(self.scale, self.scale)
         return matrix
     
+    def _apply_source_scale(self, matrix):
+        """ Return matrix applied after scaling the pixels of the source
+        surface to the pixels of the image it shows.
+        """
+        matrix.scale(1 / self._source_scale, 1 / self._source_scale)
+        return matrix
+    
     def _resize(self):
         # needs bounding box width and height after all transformations
         if self._source_surface is not None:
-            matrix = self._get_scaled_matrix()
+            matrix = self._apply_source_scale(self._get_scaled_matrix())
             w, h, _, _ = self._get_surface_extents(matrix, self._source_surface)
         else:
             w = h = 0
@@ -216,6 +262,7 @@ class Canvas(Gtk.Viewport):
         self._save_center()
         self._resize()
         self.da.queue_draw()
+        self.emit('scale-changed', value)
     
     def _set_fitting_scale(self, available_width, available_height):
         """
@@ -226,7 +273,7 @@ class Canvas(Gtk.Viewport):
             return
         # needs unscaled width and unscaled height, so the matrix must not
         # be scaled, the rotation however is needed
-        matrix = self._get_rotated_matrix()
+        matrix = self._apply_source_scale(self._get_rotated_matrix())
         source_width, source_height, _, _ = self._get_surface_extents(matrix, self._source_surface)
         try:
             aspect_ratio = source_width / source_height
@@ -248,8 +295,17 @@ class Canvas(Gtk.Viewport):
         parent_allocation = parent.get_allocation()
         self._set_fitting_scale(parent_allocation.width, parent_allocation.height)
     
-    def receive_surface(self, surface):
+    def receive_surface(self, surface, source_scale=1):
+        """ Display surface.
+        
+        source_scale: the size of surface relative to the image it shows,
+                      e.g. 0.25 if surface is a preview a quarter as wide
+                      and as high as the image. The image is displayed at
+                      the same size as with the full surface.
+        """
         self._source_surface = surface
+        self._source_scale = source_scale
+        self._mipmaps = [surface] if surface is not None else []
         if not hasattr(self, '_scale') or self.scale_to_fit:
             self.set_fitting_scale()
         else:
@@ -328,23 +384,47 @@ class Canvas(Gtk.Viewport):
         if self._scale_to_fit:
             self.set_fitting_scale()
     
-    def _create_transformed_pattern(self, source_surface, transform_buffer=True):
+    def _get_mipmap(self, level):
+        """ Return the source surface scaled down level times by half """
+        mipmaps = self._mipmaps
+        while len(mipmaps) <= level:
+            source = mipmaps[-1]
+            width = max(1, source.get_width() // 2)
+            height = max(1, source.get_height() // 2)
+            target = cairo.ImageSurface(source.get_format(), width, height)
+            co = cairo.Context(target)
+            co.scale(width / source.get_width(), height / source.get_height())
+            co.set_source_surface(source, 0, 0)
+            co.get_source().set_filter(cairo.FILTER_GOOD)
+            co.paint()
+            mipmaps.append(target)
+        return mipmaps[level]
+    
+    def _get_mipmap_level(self):
+        """ The level of the smallest mipmap that is at least as big as the
+        surface is displayed.
+        """
+        # pixels of the source surface per displayed pixel
+        reduction = self._source_scale / self.scale
+        if reduction <= 2:
+            return 0
+        level = int(math.floor(math.log(reduction, 2)))
+        # don't go below 1 pixel
+        smallest = min(self._source_surface.get_width(),
+                       self._source_surface.get_height())
+        return max(0, min(level, int(math.floor(math.log(smallest, 2)))))
+    
+    def _create_tile_pattern(self, level, rotation):
         """
-        returns cairo pattern to set as source of a cairo context
-        
-        When transform_buffer is False the returned pattern will have all
-        necessary transformations applied to its affine transformation
-        matrix. The source buffer, however will be the original source_surface.
-        So drawing that pattern will apply all transformations life, this
-        can result in a lot of cpu work when the pattern is drawn multiple
-        times.
-        
-        When transform_buffer is True, the returned pattern will be a
-        pattern with no extra transformations applied. Instead its surface
-        will hold the image data after all transformations have been applied.
+        returns cairo pattern to set as source of a cairo context, with
+        all necessary transformations applied to its affine transformation
+        matrix. Its surface is the mipmap of level, which is rotated but
+        keeps its resolution, see _get_tile_scale.
         """
+        source_surface = self._source_surface
         # calculate width and height using the new matrix
-        matrix = self._get_scaled_matrix()
+        matrix = self._get_rotated_matrix(rotation)
+        matrix.scale(2 ** -level, 2 ** -level)
         w, h, offset_x, offset_y = self._get_surface_extents(matrix, source_surface)
         
         # finish the transformation matrix by translating the pattern
@@ -356,56 +436,85 @@ class Canvas(Gtk.Viewport):
         translate_matrix.translate(-offset_x, -offset_y)
         matrix = matrix.multiply(translate_matrix)
         
-        source_pattern = cairo.SurfacePattern(source_surface)
+        mipmap = self._get_mipmap(level)
+        # scale the pixels of the mipmap to the pixels of the source,
+        # before everything else
+        mipmap_matrix = cairo.Matrix(
+            xx=source_surface.get_width() / mipmap.get_width(),
+            yy=source_surface.get_height() / mipmap.get_height())
+        matrix = mipmap_matrix.multiply(matrix)
+        
+        pattern = cairo.SurfacePattern(mipmap)
         # cairo.SurfacePattern uses inverted matrices, see the docs for pattern
         matrix.invert()
-        source_pattern.set_matrix(matrix)
-        if not transform_buffer:
-            return source_pattern
-        # the result of this can be cached and will speedup the display
-        # for large images alot, because all transformations will be applied
-        # just once not on every draw signal
-        target_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
-        # the context to draw on the new surface
-        co = cairo.Context(target_surface)
-        # draw to target_surface
-        co.set_source(source_pattern)
-        co.paint()
-        target_pattern = cairo.SurfacePattern(target_surface)
-        return target_pattern
-    
-    def _get_source_pattern(self):
-        if self._source_surface is None:
-            self._transformed_pattern_cache = (None, None)
-            return None
-        source_surface = self._source_surface
-        
-        new_check = (id(source_surface), self.scale, self.rotation)
-        check, transformed_pattern = self._transformed_pattern_cache
-        # see if the cache is invalid
-        if new_check != check:
-            # seems like a good rule of thumb to transform the buffer and
-            # use the result as surface for scales lower than 1 but for
-            # scales bigger than one the life transformation is fast enough
-            # this is likely not the best behavior in all scenarios
-            transform_buffer = self.scale < 1
-            transformed_pattern = self._create_transformed_pattern(source_surface, transform_buffer)
-            # cache the results
-            self._transformed_pattern_cache = (new_check, transformed_pattern)
-        return transformed_pattern
+        pattern.set_matrix(matrix)
+        return pattern
+    
+    def _get_tile_scale(self, level):
+        """ The factor to scale the tiles of level to the displayed size """
+        return self.scale / self._source_scale * 2 ** level
+    
+    def _validate_tiles(self):
+        """ Remove all tiles if the surface changed """
+        check = (id(self._source_surface), self._source_scale)
+        if check != self._tiles_check:
+            self._tiles_check = check
+            self._tiles.clear()
+            self._tile_patterns = {}
+    
+    def _get_tile(self, level, rotation, column, row):
+        key = (level, rotation, column, row)
+        # the most recently used tiles are at the end
+        tile = self._tiles.pop(key, None)
+        if tile is None:
+            pattern = self._tile_patterns.get((level, rotation), None)
+            if pattern is None:
+                pattern = self._create_tile_pattern(level, rotation)
+                self._tile_patterns[(level, rotation)] = pattern
+            size = self.tile_size
+            tile = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+            co = cairo.Context(tile)
+            co.translate(-column * size, -row * size)
+            co.set_source(pattern)
+            co.paint()
+        self._tiles[key] = tile
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
     
     def draw_handler(self, da, cr):
-        width = self.get_allocated_width()
-        height =  self.get_allocated_height()
-        left = math.floor(self.get_hadjustment().get_value())
-        top = math.floor(self.get_vadjustment().get_value())
-        
-        pattern = self._get_source_pattern()
-        if pattern is not None:
-            cr.set_source(pattern)
-            # draws just the visible area
-            cr.rectangle(left, top, width, height)
-            cr.fill()
+        if self._source_surface is None:
+            return
+        self._validate_tiles()
+        level = self._get_mipmap_level()
+        rotation = self.rotation
+        tile_scale = self._get_tile_scale(level)
+        size = self.tile_size
+        # the size of a tile as displayed
+        scaled_size = size * tile_scale
+        # draws just the visible area
+        x1, y1, x2, y2 = cr.clip_extents()
+        x2 = min(x2, da.get_allocated_width())
+        y2 = min(y2, da.get_allocated_height())
+        for row in range(max(0, int(y1 // scaled_size)),
+                         int(math.ceil(y2 / scaled_size))):
+            # whole pixels, so there are no seams between the tiles
+            top = int(round(row * scaled_size))
+            bottom = int(round((row + 1) * scaled_size))
+            for column in range(max(0, int(x1 // scaled_size)),
+                                int(math.ceil(x2 / scaled_size))):
+                left = int(round(column * scaled_size))
+                right = int(round((column + 1) * scaled_size))
+                tile = self._get_tile(level, rotation, column, row)
+                cr.save()
+                # the rectangle is in display pixels, the tile is scaled
+                cr.rectangle(left, top, right - left, bottom - top)
+                cr.scale(tile_scale, tile_scale)
+                cr.set_source_surface(tile, column * size, row * size)
+                # rounding may show up to half a pixel of the neighbor tile
+                cr.get_source().set_extend(cairo.EXTEND_PAD)
+                cr.fill()
+                cr.restore()
 
 
 class CanvasControls(object):
@@ -515,6 +624,15 @@ class PreviewWindow(Gtk.Window):
     """ Display a preview of an image rendered as eps with inks_model as
     source for the PostScript device deviceN.
     """
+    # whitelist, needs probbaly an update when more relevant events occur
+    _model_events = frozenset(['setCurves', 'insertCurve', 'removeCurve',
+        'reorderedCurves', 'curveUpdate.pointUpdate', 'curveUpdate.addPoint',
+        'curveUpdate.removePoint', 'curveUpdate.setPoints',
+        'curveUpdate.interpolationChanged', 'curveUpdate.visibleChanged',
+        'curveUpdate.cmykChanged', 'curveUpdate.nameChanged'])
+    # the longest side in pixels of the first, fast stage of a preview
+    preview_size = 256
+    
     def __init__(self, preview_worker, inks_model, image_name=None):
         Gtk.Window.__init__(self)
         
@@ -523,7 +641,9 @@ class PreviewWindow(Gtk.Window):
         multitoner_icon = GdkPixbuf.Pixbuf.new_from_file(multitoner_icon_filename)
         self.set_icon(multitoner_icon)
         
-        inks_model.add(self) #subscribe
+        # the preview is rendered delayed anyways, so the events can
+        # be deferred
+        inks_model.add(self, events=self._model_events, deferred=True) #subscribe
         self._preview_worker = preview_worker
         
         def destroy_handler(self):
@@ -549,9 +669,15 @@ class PreviewWindow(Gtk.Window):
         self.set_has_resize_grip(True)
         
         self._timeout = None
-        self._waiting = False
-        self._update_needed = False
+        # the jobs are measured per scale
+        self._rate = RateController()
         self._no_inks = False
+        # each request for a new surface starts a new generation of jobs
+        self._generation = 0
+        # the scales of the current generation that are not rendered yet
+        self._stages = []
+        # the scale of the surface the canvas displays or None
+        self._surface_scale = None
         
         self.grid = Gtk.Grid()
         self.add(self.grid)
@@ -576,6 +702,7 @@ class PreviewWindow(Gtk.Window):
         # synchronize the zoom to fit value
         self._set_zoom_fit_action_active_value(self.canvas.scale_to_fit)
         self.canvas.connect('scale-to-fit-changed', self.scale_to_fit_changed_handler)
+        self.canvas.connect('scale-changed', self.scale_changed_handler)
         
         # self.grid.attach(self.menubar, 0, 0, 1, 1)
         self.grid.attach(self.toolbar, 0, 1, 1, 1)
@@ -629,6 +756,9 @@ class PreviewWindow(Gtk.Window):
                _('Zoom Out'), self.action_zoom_out_handler)
             , ('ZoomUnit', Gtk.STOCK_ZOOM_100, None, '1',
                _('Zoom to normal size.'), self.action_zoom_unit_handler)
+            , ('Variants', Gtk.STOCK_INDEX, _('Variants'), 'V',
+               _('Compare variants of the inks side by side.'),
+               self.action_variants_handler)
             ])
         
         action_group.add_icon_actions([
@@ -674,59 +804,111 @@ class PreviewWindow(Gtk.Window):
     
     def on_model_updated(self, inks_model, event, *args):
         if not inks_model.visible_curves:
+            self._surface_scale = None
             self.canvas.receive_surface(None)
             self._no_inks = True
             return
         self._no_inks = False
-        if event == 'curveUpdate':
-            # whitelist, needs probbaly an update when more relevant events occur
-            ink_event = args[1]
-            if ink_event not in ('pointUpdate', 'addPoint', 'removePoint',
-                                 'setPoints', 'interpolationChanged',
-                                 'visibleChanged', 'cmykChanged',
-                                 'nameChanged'):
-                return
         assert self.inks_model() is inks_model, 'A wrong inks_model instance ' \
                                                 'publishes to this PreviewWindow'
         self._request_new_surface()
     
     def _request_new_surface(self):
-        """ this will be called very frequently, because generating the
-        preview can take a moment this waits until the last call to this
-        method was 300 millisecconds ago and then let the rendering start
+        """ Render the preview progressively: first a small preview that is
+        fast to render, then in the resolution the canvas displays it,
+        which is the full resolution when zoomed in.
+        
+        This will be called very frequently. A new request cancels the
+        stages of the former request that did not start yet, so while
+        the inks are edited mostly small previews are rendered. The
+        rendering starts when the last call to this method was a moment
+        ago, depending on how long rendering the first stage took before,
+        see RateController.
         """
+        self._generation += 1
+        self._stages = self._get_stages()
         # reset the timeout
         if self._timeout is not None:
             GObject.source_remove(self._timeout)
+            self._timeout = None
         # schedule a new execution
-        self._timeout = GObject.timeout_add(300, self._update_surface)
+        self._schedule_next_stage()
     
     def _update_surface(self):
+        self._timeout = None
+        self._render_next_stage()
+        # this timout shall not be executed repeatedly, thus returning false
+        return False
+    
+    @staticmethod
+    def _round_scale(scale, up=True):
+        """ Round scale to a power of two but not bigger than 1. Using only
+        these keeps the number of resized images small.
+        """
+        if scale >= 1:
+            return 1
+        exponent = math.log(scale, 2)
+        exponent = math.ceil(exponent) if up else math.floor(exponent)
+        return 2.0 ** exponent
+    
+    def _get_display_scale(self):
+        """ The scale needed to render the image at the resolution the
+        canvas displays it.
+        """
+        return self._round_scale(self.canvas.scale)
+    
+    def _get_stages(self):
+        if self.image_name is None:
+            return []
+        display_scale = self._get_display_scale()
+        size = self._preview_worker.get_image_size(self.id, self.image_name)
+        if size is None:
+            # can't open the image, the job will report the error
+            return [display_scale]
+        preview_scale = self._round_scale(self.preview_size / max(size),
+                                          up=False)
+        return sorted(set([min(preview_scale, display_scale), display_scale]))
+    
+    def _render_next_stage(self):
         inks_model = self.inks_model()
         # see if the model still exists
         if inks_model is None or not inks_model.visible_curves or self.image_name is None:
-            # need to return False, to cancel the timeout
-            return False
-        
-        if self._waiting:
-            # we are waiting for a job to finish, so we don't put another
-            # job on the queue right now
-            self._update_needed = True
-            return False
-        
-        self._waiting = True
-        
-        callback = (self._worker_callback, self.image_name)
-        self._preview_worker.add_job(self.id, callback, self.image_name, *inks_model.visible_curves)
+            return
         
-        # this timout shall not be executed repeatedly, thus returning false
-        return False
+        while self._stages and self._rate.can_start(self._stages[0]):
+            scale = self._stages.pop(0)
+            token = self._rate.start(scale)
+            callback = (self._worker_callback, self.image_name, self._generation,
+                        scale, token)
+            self._preview_worker.add_scaled_job(self.id, callback, self.image_name,
+                                                scale, *inks_model.visible_curves)
+        if self._stages and not self._rate.is_busy(self._stages[0]):
+            # the last job started just now, try again in a moment
+            if self._timeout is None:
+                self._timeout = GObject.timeout_add(self._rate.get_wait_ms(),
+                                                    self._update_surface)
+        # otherwise we are waiting for jobs to finish, so we don't put
+        # another job on the queue right now. _receive_surface schedules
+        # the next stage.
+    
+    def _schedule_next_stage(self):
+        """ Render the next stage with the same rate controlled timeout as
+        _request_new_surface, so it waits for a moment without changes,
+        unless a timeout is pending already.
+        """
+        if self._timeout is not None or not self._stages:
+            return
+        self._timeout = GObject.timeout_add(
+            self._rate.get_delay_ms(self._stages[0]), self._update_surface)
     
     def _worker_callback(self, *args):
         GLib.idle_add(self._receive_surface, *args)
     
-    def _receive_surface(self, type, image_name, *args):
-        self._waiting = False
+    def _receive_surface(self, type, image_name, generation, scale, token, *args):
+        if not self._rate.finish(token):
+            # a job started later finished already, its result is newer
+            self._schedule_next_stage()
+            return False
         if type == 'result':
             message = args[-1]
             if message is not None:
@@ -735,14 +917,21 @@ class PreviewWindow(Gtk.Window):
         else:
             if type == 'error':
                 self.image_name = None
+                self._stages = []
             GLib.idle_add(self._show_message, type, *args)
             cairo_surface = None
         
         if cairo_surface is not None:
             self._document_actions.set_sensitive(True)
+            self._surface_scale = scale
         else:
             self._document_actions.set_sensitive(False)
-        self.canvas.receive_surface(cairo_surface)
+            self._surface_scale = None
+        # A result of an older generation is shown as well, it is still
+        # newer than the surface the canvas displays.
+        self.canvas.receive_surface(cairo_surface, scale)
+        self._schedule_next_stage()
+        return False
     
     def _make_surface(self, image_name, w, h, rowstride, buf):
         if self._no_inks or self.image_name != image_name:
@@ -753,11 +942,6 @@ class PreviewWindow(Gtk.Window):
             cairo_surface = cairo.ImageSurface.create_for_data(
                 buf, cairo.FORMAT_RGB24, w, h, rowstride
             )
-        
-        if self._update_needed:
-            # while we where waiting another update became due
-            self._update_needed = False
-            self._request_new_surface()
         return cairo_surface
     
     def _open_image(self, image_name):
@@ -793,12 +977,35 @@ class PreviewWindow(Gtk.Window):
     def scale_to_fit_changed_handler(self, widget, scale_to_fit):
         self._set_zoom_fit_action_active_value(scale_to_fit)
     
+    def scale_changed_handler(self, widget, scale):
+        """ Render the resolution the canvas displays now, if not already
+        done or planned.
+        """
+        if self._surface_scale is None:
+            return
+        display_scale = self._get_display_scale()
+        # no need for more than that anymore
+        stages = [stage for stage in self._stages if stage <= display_scale]
+        if display_scale > self._surface_scale and display_scale not in stages:
+            stages.append(display_scale)
+        self._stages = stages
+        self._render_next_stage()
+    
     def action_open_image_handler(self, widget):
         self.ask_for_image()
 
     def action_close_handler(self, widget):
         self.destroy()
     
+    def action_variants_handler(self, widget):
+        inks_model = self.inks_model()
+        if self.image_name is None or inks_model is None:
+            return
+        window = VariantsWindow(self._preview_worker, inks_model, self.image_name)
+        window.set_transient_for(self)
+        window.set_destroy_with_parent(True)
+        window.show_all()
+    
     def action_export_image_handler(self, widget):
         inks_model = self.inks_model()
         image_filename = self.image_name
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, print_function, unicode_literals
+
+from weakref import ref as weakref
+
+from gi.repository import Gtk, Gdk, GObject, GLib
+import cairo
+
+from gtk_dialogs import show_message
+from ghostscript_workers import GridWorker
+from rate_controller import RateController
+from variants import get_value, set_value, apply_value, get_bounds, \
+                     get_sweep_values, get_inks
+
+__all__ = ['VariantsWindow']
+
+# just a preparation for i18n
+def _(string):
+    return string
+
+
+class VariantsWindow(Gtk.Window):
+    """ Display a grid of thumbnails of an image, each printed with another
+    value of one parameter of the inks: the x or y of a point of a curve or
+    a CMYK value of an ink. The values are spread around the current value.
+    Clicking a thumbnail sets its value in inks_model.
+    """
+    _model_events = frozenset(['setCurves', 'insertCurve', 'removeCurve',
+        'reorderedCurves', 'curveUpdate.pointUpdate', 'curveUpdate.addPoint',
+        'curveUpdate.removePoint', 'curveUpdate.setPoints',
+        'curveUpdate.interpolationChanged', 'curveUpdate.visibleChanged',
+        'curveUpdate.cmykChanged', 'curveUpdate.nameChanged'])
+    # pixels between the thumbnails
+    gap = 4
+    _cmyk_labels = (_('Cyan'), _('Magenta'), _('Yellow'), _('Black'))
+    
+    def __init__(self, preview_worker, inks_model, image_name):
+        Gtk.Window.__init__(self)
+        self.set_title(_('Multitoner Variants: {filename}').format(filename=image_name))
+        self.set_default_size(640, 480)
+        
+        self._grid_worker = GridWorker(preview_worker.pool,
+                                       preview_worker.image_cache,
+                                       preview_worker.color_transform)
+        inks_model.add(self, events=self._model_events, deferred=True) #subscribe
+        self.inks_model = weakref(inks_model)
+        self.image_name = image_name
+        
+        self._rate = RateController()
+        self._timeout = None
+        # (parameter, values, columns) of the displayed grid
+        self._displayed = None
+        self._surface = None
+        
+        grid = Gtk.Grid()
+        grid.set_row_spacing(5)
+        grid.set_column_spacing(5)
+        self.add(grid)
+        
+        self._ink_widget = Gtk.ComboBoxText()
+        self._ink_widget.set_tooltip_text(_('The ink to vary.'))
+        self._parameter_widget = Gtk.ComboBoxText()
+        self._parameter_widget.set_tooltip_text(_('The value to vary.'))
+        controls = [
+            (_('Ink'), self._ink_widget),
+            (_('Parameter'), self._parameter_widget)
+        ]
+        self._ink_widget.connect('changed', self.ink_changed_handler)
+        self._parameter_widget.connect('changed', self.settings_changed_handler)
+        
+        self._spin_buttons = {}
+        for name, label, tooltip, value, lower, upper, step, digits in [
+            ('spread', _('Spread'), _('The values go from the current value '
+                                      'minus spread to plus spread.'),
+                                      0.1, 0.001, 0.5, 0.01, 3),
+            ('rows', _('Rows'), None, 3, 1, 10, 1, 0),
+            ('columns', _('Columns'), None, 3, 1, 10, 1, 0),
+            ('size', _('Size'), _('The size of a thumbnail in pixels.'),
+                                      160, 32, 1024, 16, 0)
+            ]:
+            adjustment = Gtk.Adjustment(value, lower, upper, step, step * 10, 0.0)
+            widget = Gtk.SpinButton(digits=digits, adjustment=adjustment)
+            if tooltip is not None:
+                widget.set_tooltip_text(tooltip)
+            widget.connect('value-changed', self.settings_changed_handler)
+            self._spin_buttons[name] = widget
+            controls.append((label, widget))
+        
+        for i, (label, widget) in enumerate(controls):
+            grid.attach(Gtk.Label(label), i * 2, 0, 1, 1)
+            grid.attach(widget, i * 2 + 1, 0, 1, 1)
+        
+        self.da = Gtk.DrawingArea()
+        self.da.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
+        self.da.set_tooltip_text(_('Click a thumbnail to use its value.'))
+        self.da.connect('draw', self.draw_handler)
+        self.da.connect('button-press-event', self.button_press_handler)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add_with_viewport(self.da)
+        scrolled.set_hexpand(True)
+        scrolled.set_vexpand(True)
+        grid.attach(scrolled, 0, 1, len(controls) * 2, 1)
+        
+        self.connect('destroy', self.destroy_handler)
+        self._update_inks()
+    
+    def destroy_handler(self, widget):
+        if self._timeout is not None:
+            GObject.source_remove(self._timeout)
+            self._timeout = None
+        # results that arrive later are not displayed
+        self._surface = self._displayed = None
+        self.image_name = None
+    
+    def _get_spin_value(self, name):
+        return self._spin_buttons[name].get_value()
+    
+    @staticmethod
+    def _set_options(widget, options, handler):
+        """ Replace the options of the Gtk.ComboBoxText widget, keep the
+        active option if possible, otherwise activate the first one.
+        handler is not called meanwhile.
+        """
+        active_id = widget.get_active_id()
+        widget.handler_block_by_func(handler)
+        widget.remove_all()
+        for option_id, text in options:
+            widget.append(option_id, text)
+        if active_id is None or not widget.set_active_id(active_id):
+            widget.set_active(0)
+        widget.handler_unblock_by_func(handler)
+    
+    def _update_inks(self):
+        inks_model = self.inks_model()
+        if inks_model is None:
+            return
+        self._set_options(self._ink_widget, [(str(i), ink.name)
+                                for i, ink in enumerate(inks_model.curves)],
+                          self.ink_changed_handler)
+        self._update_parameters()
+    
+    def _update_parameters(self):
+        inks_model = self.inks_model()
+        ink_id = self._ink_widget.get_active_id()
+        if inks_model is None or ink_id is None:
+            return
+        ink = inks_model.curves[int(ink_id)]
+        options = []
+        for i in range(len(ink.points_value)):
+            options.append(('point-{0}-1'.format(i), _('Point {0} y').format(i + 1)))
+            options.append(('point-{0}-0'.format(i), _('Point {0} x').format(i + 1)))
+        for i, label in enumerate(self._cmyk_labels):
+            options.append(('cmyk-{0}'.format(i), label))
+        self._set_options(self._parameter_widget, options,
+                          self.settings_changed_handler)
+        self._request_grid()
+    
+    def _get_parameter(self):
+        """ Return the parameter for variants.set_value or None """
+        ink_id = self._ink_widget.get_active_id()
+        parameter_id = self._parameter_widget.get_active_id()
+        if ink_id is None or parameter_id is None:
+            return None
+        parts = parameter_id.split('-')
+        return (parts[0], int(ink_id)) + tuple(int(part) for part in parts[1:])
+    
+    def on_model_updated(self, inks_model, event, *args):
+        self._update_inks()
+    
+    def ink_changed_handler(self, widget):
+        self._update_parameters()
+    
+    def settings_changed_handler(self, widget):
+        self._request_grid()
+    
+    def _request_grid(self):
+        """ Render the grid when the settings did not change for a moment,
+        see RateController.
+        """
+        if self._timeout is not None:
+            GObject.source_remove(self._timeout)
+        self._timeout = GObject.timeout_add(self._rate.get_delay_ms(),
+                                            self._render_grid)
+    
+    def _render_grid(self):
+        self._timeout = None
+        inks_model = self.inks_model()
+        parameter = self._get_parameter()
+        if inks_model is None or parameter is None or self.image_name is None:
+            return False
+        if not self._rate.can_start():
+            # a job is running or started just now, try again later
+            self._request_grid()
+            return False
+        args = inks_model.get_args()
+        rows = int(self._get_spin_value('rows'))
+        columns = int(self._get_spin_value('columns'))
+        token = None
+        try:
+            values = get_sweep_values(get_value(args, parameter),
+                                      self._get_spin_value('spread'),
+                                      rows * columns,
+                                      *get_bounds(args, parameter))
+            grid = [[get_inks(set_value(args, parameter, value))
+                     for value in values[row * columns:(row + 1) * columns]]
+                    for row in range(rows)]
+            token = self._rate.start()
+            callback = (self._worker_callback, token, (parameter, values, columns))
+            self._grid_worker.add_grid_job(callback, self.image_name,
+                                           self._get_spin_value('size'), grid,
+                                           self.gap)
+        except ValueError as e:
+            # interpolation.CurveException is a ValueError, i.e. the
+            # interpolation of a curve failed, the window stays usable
+            if token is not None:
+                self._rate.finish(token)
+            show_message(self.get_toplevel(), 'error'
+                        , _('Can\'t render the variants.')
+                        , _('Message: {0} {1}').format(e, type(e)))
+        # this timout shall not be executed repeatedly, thus returning false
+        return False
+    
+    def _worker_callback(self, *args):
+        GLib.idle_add(self._receive_grid, *args)
+    
+    def _receive_grid(self, type, token, displayed, *args):
+        if not self._rate.finish(token) or self.image_name is None:
+            # a job started later finished already or the window is closed
+            return False
+        if type != 'result':
+            show_message(self.get_toplevel(), type, *args)
+            return False
+        w, h, rowstride, buf = args
+        self._surface = cairo.ImageSurface.create_for_data(
+                                        buf, cairo.FORMAT_RGB24, w, h, rowstride)
+        self._displayed = displayed
+        self.da.set_size_request(w, h)
+        self.da.queue_draw()
+        return False
+    
+    def draw_handler(self, da, cr):
+        if self._surface is not None:
+            cr.set_source_surface(self._surface, 0, 0)
+            cr.paint()
+    
+    def button_press_handler(self, da, event):
+        if self._surface is None:
+            return False
+        parameter, values, columns = self._displayed
+        rows = (len(values) + columns - 1) // columns
+        cell_width = (self._surface.get_width() + self.gap) / columns
+        cell_height = (self._surface.get_height() + self.gap) / rows
+        column, row = int(event.x // cell_width), int(event.y // cell_height)
+        index = row * columns + column
+        inks_model = self.inks_model()
+        if inks_model is None or not 0 <= column < columns \
+                              or not 0 <= index < len(values):
+            return False
+        apply_value(inks_model, parameter, values[index])
+        return True
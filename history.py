@@ -20,6 +20,7 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import sys
 try:
     import cPickle as pickle
 except ImportError:
@@ -27,46 +28,155 @@ except ImportError:
 from weakref import ref as weakref
 from functools import wraps
 from warnings import warn
+from numbers import Number
+from collections import deque
 
-from compatibility import encode
+from compatibility import string_types
 
 
-__all__ = ['History', 'get_setter_command', 'get_calling_command', 'historize',
+__all__ = ['History', 'Command', 'SetterCommand', 'CallingCommand',
+           'TransactionCommand', 'get_setter_command', 'get_calling_command',
+           'get_transaction_command', 'resolve_path', 'historize',
            'HistoryAPI']
 
 
+def resolve_path(model, path):
+    """ Return the model at path below model.
+    
+    path is a sequence of model ids, the deepest model first, like the
+    paths collected by HistoryAPI.add_history.
+    """
+    for mid in reversed(path):
+        model = model.get_by_id(mid)
+    return model
+
+
+def _is_immutable(value):
+    """ True if value can be stored as it is, without a pickled copy """
+    if isinstance(value, tuple):
+        return all(_is_immutable(item) for item in value)
+    return value is None or isinstance(value, (Number, ) + string_types)
+
+
+def _get_size(value):
+    """ Approximate the memory used by an immutable value in bytes. """
+    size = sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(_get_size(item) for item in value)
+    return size
+
+
+class Command(object):
+    """ Base for the records stored by History.
+    
+    A command is called with the model it belongs to as only argument.
+    
+    name: used to distinguish between different commands on the same model,
+          it is important to detect consecutive commands
+    size: approximate memory used by the command in bytes
+    """
+    __slots__ = ('name', 'size', '_value', '_pickled')
+    
+    def __init__(self, name, value=None):
+        self.name = name
+        if _is_immutable(value):
+            # no need to pickle, numbers, strings and tuples of them
+            # won't change anymore
+            self._value = value
+            self._pickled = False
+            value_size = _get_size(value)
+        else:
+            self._value = pickle.dumps(value, -1)
+            self._pickled = True
+            value_size = len(self._value)
+        self.size = sys.getsizeof(self) + value_size
+    
+    def _get_value(self):
+        if self._pickled:
+            return pickle.loads(self._value)
+        return self._value
+    
+    def __call__(self, obj):
+        raise NotImplementedError('__call__ must be defined by subclass')
+    
+    def __repr__(self):
+        return '<{0} {1}>'.format(type(self).__name__, self.name)
+
+
+class SetterCommand(Command):
+    """ Set the stored value to an attribute: setattr(obj, attribute, value) """
+    __slots__ = ('attribute', )
+    
+    def __init__(self, attribute, value):
+        super(SetterCommand, self).__init__('set__{0}__'.format(attribute), value)
+        self.attribute = attribute
+    
+    def __call__(self, obj):
+        setattr(obj, self.attribute, self._get_value())
+
+
+class CallingCommand(Command):
+    """ Call a method with the stored args: getattr(obj, method)(*args) """
+    __slots__ = ('method', )
+    
+    def __init__(self, method, args):
+        super(CallingCommand, self).__init__('call__{0}__'.format(method), args)
+        self.method = method
+    
+    def __call__(self, obj):
+        getattr(obj, self.method)(*self._get_value())
+
+
+class TransactionCommand(Command):
+    """ Execute the commands of entries in reversed order, within
+    obj.transaction().
+    
+    entries: sequence of (path, command) as collected by Model.transaction
+             path is relative to obj, see resolve_path.
+    """
+    __slots__ = ('entries', )
+    
+    def __init__(self, entries):
+        super(TransactionCommand, self).__init__('transaction')
+        self.entries = tuple(entries)
+        self.size += sum(command.size + sys.getsizeof(path)
+                         for path, command in self.entries)
+    
+    def __call__(self, obj):
+        with obj.transaction():
+            for path, command in reversed(self.entries):
+                command(resolve_path(obj, path))
+
+
 def get_setter_command(name, value):
-    """ Return a method that takes an object as argument and set value
+    """ Return a command that takes an object as argument and set value
     to the attribute name: setattr(obj, name, value).
     
-    value is stored pickled, so it won't change anymore.
+    value is stored as it is if it is immutable, otherwise pickled, so it
+    won't change anymore.
     """
-    pickled_value = pickle.dumps(value, -1)
-    def cmd(obj):
-        value = pickle.loads(pickled_value)
-        setattr(obj, name, value)
-    cmd.__doc__ = encode('setting {0}'.format(name))
-    # name is used to distinguish between different commands on the same model
-    # model it is important detect consecutive commands
-    cmd.__name__= encode('set__{0}__'.format(name))
-    return cmd
+    return SetterCommand(name, value)
 
 
 def get_calling_command(method, *args):
-    """ Return a method that takes an object as argument and calls its method
+    """ Return a command that takes an object as argument and calls its method
     method and args as arguments: getattr(obj, method)(*args)
     
-    args is stored pickled, so it won't change anymore.
+    args are stored as they are if they are immutable, otherwise pickled,
+    so they won't change anymore.
     """
-    pickled_args = pickle.dumps(args, -1)
-    def cmd(obj):
-        args = pickle.loads(pickled_args)
-        getattr(obj, method)(*args)
-    cmd.__doc__ = encode('calling {0}'.format(method))
-    # name is used to distinguish between different commands on the same
-    # model it is important detect consecutive commands
-    cmd.__name__= encode('call__{0}__'.format(method))
-    return cmd
+    return CallingCommand(method, args)
+
+
+def get_transaction_command(entries):
+    """ Return a command that takes an object as argument and executes the
+    commands of entries in reversed order, within obj.transaction().
+    
+    The commands executed will create their own history entries, the
+    transaction collects these to one entry again, so this is used for
+    undo and redo.
+    """
+    return TransactionCommand(entries)
 
 
 def historize(fn):
@@ -140,7 +250,7 @@ class HistoryAPI(object):
     def add_history(self, command, path=None):
         if path is None:
             path = []
-            # print('add history: ', self.__class__.__name__, command.__doc__)
+            # print('add history: ', self.__class__.__name__, command)
         path.append(self.id)
             
         history_api = self.history_api
@@ -154,7 +264,7 @@ class HistoryAPI(object):
         The view is about to execute the same command with different values
         consecutively zero or more times. To make just one history entry
         of that process, the view can use this method. Then the following
-        commands with the same combination of path and command.__name__
+        commands with the same combination of path and command.name
         will only make one history undo entry
         """
         if path is None:
@@ -168,10 +278,25 @@ class HistoryAPI(object):
 
 
 class History(object):
-    """ Manage history entries and execute undo/redo commands """
-    def __init__(self, root_model):
-        self._undo_commands = []
+    """ Manage history entries and execute undo/redo commands
+    
+    max_depth: None or the maximum number of undo entries to keep
+    memory_budget: None or the approximate maximum of bytes all entries
+                   together may use, see get_memory_usage
+    
+    When a limit is exceeded the oldest entries are dropped, but the
+    newest undo entry is always kept.
+    """
+    default_memory_budget = 32 * 1024 * 1024
+    
+    def __init__(self, root_model, max_depth=None,
+                 memory_budget=default_memory_budget):
+        self.max_depth = max_depth
+        self.memory_budget = memory_budget
+        # deque, because the oldest entries are removed from the left
+        self._undo_commands = deque()
         self._redo_commands = []
+        self._memory_usage = 0
         self._is_undo = False
         self._is_redo = False
         
@@ -183,25 +308,64 @@ class History(object):
     
     def _resolve_path(self, path):
         path = path[:-1] # we don't need the root_model id
-        model = self._root_model
-        for mid in reversed(path):
-            model = model.get_by_id(mid)
-        return model
+        return resolve_path(self._root_model, path)
+    
+    @staticmethod
+    def _get_entry_size(entry):
+        path, command = entry
+        return sys.getsizeof(entry) + sys.getsizeof(path) + command.size
+    
+    def _push(self, commands, entry):
+        commands.append(entry)
+        self._memory_usage += self._get_entry_size(entry)
+    
+    def _pop(self, commands, oldest=False):
+        entry = commands.popleft() if oldest else commands.pop()
+        self._memory_usage -= self._get_entry_size(entry)
+        return entry
+    
+    def _clear_redo(self):
+        for entry in self._redo_commands:
+            self._memory_usage -= self._get_entry_size(entry)
+        self._redo_commands = []
+    
+    def _enforce_limits(self):
+        """ Drop the oldest undo entries until max_depth and memory_budget
+        are respected. The redo entries are dropped only if removing the
+        undo entries was not enough, starting with the most distant one.
+        
+        The newest undo and redo entries are never dropped for the memory
+        budget, so the last change can always be undone, even if it alone
+        is bigger than the budget.
+        """
+        while self.max_depth is not None \
+                and len(self._undo_commands) > self.max_depth:
+            self._pop(self._undo_commands, oldest=True)
+        if self.memory_budget is None:
+            return
+        while self._memory_usage > self.memory_budget \
+                and len(self._undo_commands) > 1:
+            self._pop(self._undo_commands, oldest=True)
+        while self._memory_usage > self.memory_budget \
+                and len(self._redo_commands) > 1:
+            entry = self._redo_commands.pop(0)
+            self._memory_usage -= self._get_entry_size(entry)
     
     def add_history(self, command, path):
         path = tuple(path)
         entry = (path, command)
         if self._is_undo:
             self._end_consecutive_command()
-            self._redo_commands.append(entry)
+            self._push(self._redo_commands, entry)
         else:
             if not self._is_redo:
                 # if its no redo its do: new history and the old redos are invalid
-                self._redo_commands = []
+                self._clear_redo()
             else:
                 self._end_consecutive_command()
-            if not self._is_consecutive_command(path, command.__name__):
-                self._undo_commands.append(entry)
+            if not self._is_consecutive_command(path, command.name):
+                self._push(self._undo_commands, entry)
+        self._enforce_limits()
     
     def register_consecutive_command(self, path):
         self._conscecutive_command = (tuple(path), False, None)
@@ -234,7 +398,7 @@ class History(object):
     def undo(self):
         if not self._undo_commands:
             return
-        path, command = self._undo_commands.pop()
+        path, command = self._pop(self._undo_commands)
         model = self._resolve_path(path)
         # this will add a command to history
         self._is_undo = True
@@ -244,7 +408,7 @@ class History(object):
     def redo(self):
         if not self._redo_commands:
             return
-        path, command = self._redo_commands.pop()
+        path, command = self._pop(self._redo_commands)
         model = self._resolve_path(path)
         # this will add a command to history
         self._is_redo = True
@@ -253,3 +417,9 @@ class History(object):
     
     def get_counts(self):
         return (len(self._undo_commands), len(self._redo_commands))
+    
+    def get_memory_usage(self):
+        """ Return the approximate number of bytes used by all undo and redo
+        entries. This is what memory_budget is compared to.
+        """
+        return self._memory_usage
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import atexit
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import PIL.Image as Image
+
+from mtt2eps import load_gray
+
+__all__ = ['CachedImage', 'ImageCache']
+
+# ANTIALIAS is called LANCZOS in newer versions of PIL
+_antialias = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+
+class CachedImage(object):
+    """ The grayscale pixels of an image, stored in a file.
+    
+    This is small and can be sent to another process, which reads the
+    pixels with map.
+    
+    filename: the file with the pixels, one byte each, row by row
+    offset: where the pixels start in the file
+    size: tuple of integers (width, height)
+    notice: a tuple with a notice for the user or None, see load_image
+    temporary: True if the file was made by the cache, False if it is
+               the image file itself
+    """
+    def __init__(self, filename, offset, size, notice, temporary):
+        self.filename = filename
+        self.offset = offset
+        self.size = size
+        self.notice = notice
+        self.temporary = temporary
+    
+    @property
+    def nbytes(self):
+        width, height = self.size
+        return width * height
+    
+    def map(self):
+        """ Return the pixels as read only numpy array of uint8 with the
+        shape (height, width), memory mapped from the file.
+        """
+        width, height = self.size
+        return np.memmap(self.filename, dtype=np.uint8, mode='r',
+                         offset=self.offset, shape=(height, width))
+
+
+class ImageCache(object):
+    """ Grayscale images made with load_gray, shared by all clients.
+    
+    The pixels are written to files in directory, by default in shared
+    memory (/dev/shm) if available, so worker processes can memory map
+    them and a job just needs to send a CachedImage. Images that load_gray
+    returns memory mapped are not copied at all.
+    
+    Images are found by the path, the modification time and the size of
+    their files, so a changed file is loaded again. When the copied pixels
+    take more than memory_budget bytes, the least recently used images
+    are removed. The file of a removed image is kept while a job still
+    uses it, see acquire.
+    """
+    default_memory_budget = 256 * 1024 * 1024
+    
+    def __init__(self, directory=None, memory_budget=default_memory_budget):
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        self.directory = tempfile.mkdtemp(prefix='multitoner-', dir=directory)
+        self.memory_budget = memory_budget
+        # (key, scale) => CachedImage, the least recently used first
+        self._images = OrderedDict()
+        self._memory_usage = 0
+        # the files are numbered, a removed image that is loaded again
+        # must not overwrite the file a job may still read
+        self._file_number = 0
+        # filename => number of jobs using the file, see acquire
+        self._users = {}
+        # filenames of removed images, deleted when the last job is done
+        self._orphans = set()
+        # acquire and release are called from the threads of the pool
+        self._users_lock = threading.Lock()
+        atexit.register(self.close)
+    
+    @staticmethod
+    def get_key(image_name):
+        """ Return the key of the current contents of the file at image_name.
+        
+        raises OSError if the file doesn't exist
+        """
+        stat = os.stat(image_name)
+        # repr is ascii, no matter how the path is encoded
+        key = repr((os.path.abspath(image_name), stat.st_mtime, stat.st_size))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+    
+    def _copy(self, key, scale, pixels, notice):
+        """ Write pixels, a numpy array of uint8, to a new file """
+        self._file_number += 1
+        filename = os.path.join(self.directory, '{0}-{1!r}-{2}'.format(key,
+                                                    scale, self._file_number))
+        with open(filename, 'wb') as f:
+            np.ascontiguousarray(pixels).tofile(f)
+        height, width = pixels.shape
+        return CachedImage(filename, 0, (width, height), notice, True)
+    
+    def _load(self, key, image_name, scale):
+        """ Return (image, error) like get, without the cache """
+        if scale == 1:
+            pixels, notice, error = load_gray(image_name)
+            if error is not None:
+                return None, error
+            if isinstance(pixels, np.memmap) and pixels.flags.c_contiguous:
+                # memory mapped from the image or the cache of load_gray,
+                # the workers can map it the same way
+                height, width = pixels.shape
+                return CachedImage(pixels.filename, pixels.offset,
+                                   (width, height), notice, False), None
+            return self._copy(key, scale, pixels, notice), None
+        
+        # the scaled images are made from the cached original
+        original, error = self.get(image_name)
+        if error is not None:
+            return None, error
+        width, height = original.size
+        pixels = original.map()
+        im = Image.frombuffer('L', original.size, pixels, 'raw', 'L', 0, 1)
+        size = (max(1, int(round(width * scale))),
+                max(1, int(round(height * scale))))
+        im = im.resize(size, _antialias)
+        return self._copy(key, scale, np.asarray(im), original.notice), None
+    
+    def get(self, image_name, scale=1):
+        """ Return (image, error)
+        
+        image: a CachedImage of the image at image_name, resized by scale
+        error: None or if an error occured an error tuple like load_image
+               returns, then image is None
+        """
+        try:
+            key = self.get_key(image_name)
+        except EnvironmentError:
+            # load_gray makes the right message
+            return None, load_gray(image_name)[2]
+        image = self._images.pop((key, scale), None)
+        if image is None:
+            image, error = self._load(key, image_name, scale)
+            if error is not None:
+                return None, error
+            if image.temporary:
+                self._memory_usage += image.nbytes
+        # the most recently used images are at the end
+        self._images[(key, scale)] = image
+        self._enforce_budget()
+        return image, None
+    
+    def acquire(self, image):
+        """ Keep the file of image, a CachedImage returned by get, until
+        release is called with it, even if the image is removed from the
+        cache meanwhile. A job that maps the image, e.g. in a worker process,
+        must do this before the next call of get.
+        
+        acquire and release can be called from any thread.
+        """
+        with self._users_lock:
+            self._users[image.filename] = self._users.get(image.filename, 0) + 1
+    
+    def release(self, image):
+        """ The job that called acquire with image is done with it """
+        with self._users_lock:
+            users = self._users.pop(image.filename) - 1
+            if users:
+                self._users[image.filename] = users
+                return
+            if image.filename not in self._orphans:
+                return
+            self._orphans.remove(image.filename)
+        self._delete(image.filename)
+    
+    @staticmethod
+    def _delete(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    
+    def _remove(self, item):
+        image = self._images.pop(item)
+        if not image.temporary:
+            return
+        self._memory_usage -= image.nbytes
+        with self._users_lock:
+            if image.filename in self._users:
+                # release deletes it
+                self._orphans.add(image.filename)
+                return
+        self._delete(image.filename)
+    
+    def _enforce_budget(self):
+        """ Remove the least recently used images until memory_budget is
+        respected. The most recently used image is always kept, a job
+        may be about to use it.
+        """
+        while self._memory_usage > self.memory_budget and len(self._images) > 1:
+            self._remove(next(iter(self._images)))
+    
+    def get_memory_usage(self):
+        """ Return the number of bytes of the copied pixels """
+        return self._memory_usage
+    
+    def clear(self):
+        """ Remove all images """
+        for item in list(self._images):
+            self._remove(item)
+    
+    def close(self):
+        """ Remove all images and the directory """
+        self.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
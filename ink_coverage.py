@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Ink coverage and total area coverage (TAC) of an image printed with
+a set of inks.
+
+Each of the 256 gray values is printed with the amounts of the inks in
+get_device_n_table. So all statistics follow from the histogram of the
+image and that table, the pixels are read just once for the histogram,
+which can be used again for any set of inks.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from epstool import get_device_n_table
+from image_cache import ImageCache
+from mtt2eps import load_gray, iter_gray_images
+
+__all__ = ['get_histogram', 'HistogramCache', 'Coverage']
+
+# just a preparation for i18n
+def _(string):
+    return string
+
+
+# pixels counted at once, np.bincount makes a copy of them as integers
+_chunk_size = 4 * 1024 * 1024
+
+
+def get_histogram(pixels):
+    """ Return the number of pixels of each of the 256 gray values as numpy
+    array of int64. pixels is a numpy array of uint8, like load_gray returns.
+    """
+    pixels = pixels.reshape(-1)
+    histogram = np.zeros(256, dtype=np.int64)
+    for start in range(0, len(pixels), _chunk_size):
+        histogram += np.bincount(pixels[start:start + _chunk_size],
+                                 minlength=256)
+    return histogram
+
+
+class HistogramCache(object):
+    """ The histograms of images by their filenames. The images are found
+    like ImageCache does it, so a changed file is read again.
+    """
+    max_histograms = 4096
+    
+    def __init__(self):
+        # key => histogram, the least recently used first
+        self._histograms = OrderedDict()
+    
+    def _add(self, key, histogram):
+        if len(self._histograms) >= self.max_histograms:
+            self._histograms.popitem(last=False)
+        self._histograms[key] = histogram
+    
+    def get(self, image_name):
+        """ Return (histogram, error), like ImageCache.get """
+        try:
+            key = ImageCache.get_key(image_name)
+        except EnvironmentError:
+            # load_gray makes the right message
+            return None, load_gray(image_name)[2]
+        histogram = self._histograms.pop(key, None)
+        if histogram is None:
+            pixels, notice, error = load_gray(image_name)
+            if error is not None:
+                return None, error
+            histogram = get_histogram(pixels)
+        self._add(key, histogram)
+        return histogram, None
+    
+    def iter_histograms(self, filenames, prefetch=2, threads=None):
+        """ Yield (filename, histogram, error) for each of filenames, in the
+        same order. The images that are not in the cache are decoded in
+        parallel with iter_gray_images.
+        """
+        # (filename, histogram, error), histogram and error are None
+        # while the image is loaded
+        entries = deque()
+        def get_missing():
+            for filename in filenames:
+                try:
+                    key = ImageCache.get_key(filename)
+                except EnvironmentError:
+                    # load_gray makes the right message
+                    entries.append((filename, None, load_gray(filename)[2]))
+                    continue
+                histogram = self._histograms.pop(key, None)
+                if histogram is not None:
+                    # the most recently used histograms are at the end
+                    self._histograms[key] = histogram
+                entries.append((filename, histogram, None))
+                if histogram is None:
+                    yield filename
+        
+        for filename, pixels, notice, error in \
+                    iter_gray_images(get_missing(), prefetch, threads):
+            # the entries before this image are done already
+            entry = entries.popleft()
+            while entry[1] is not None or entry[2] is not None:
+                yield entry
+                entry = entries.popleft()
+            histogram = None
+            if error is None:
+                histogram = get_histogram(pixels)
+                self._add(ImageCache.get_key(filename), histogram)
+            del pixels
+            yield filename, histogram, error
+        while entries:
+            yield entries.popleft()
+
+
+class Coverage(object):
+    """ The ink coverage of an image with the histogram printed with inks.
+    All values are in percent, for the total area coverage (TAC) the
+    coverages of the inks are added, i.e. two solid inks are 200%.
+    
+    names: the names of inks
+    mean: the mean coverage of each of inks over the whole image
+    max: the maximum coverage of each of inks in the image
+    tac_mean: the mean total area coverage
+    tac_max: the maximum total area coverage in the image
+    """
+    def __init__(self, histogram, *inks):
+        self.histogram = histogram
+        self.names = [ink.name for ink in inks]
+        # 256 rows, the coverage of each ink for a gray value
+        self.table = get_device_n_table(*inks).astype(float) / 255 * 100
+        self.tac = self.table.sum(axis=1)
+        self.pixels = int(histogram.sum())
+        used = histogram > 0
+        if self.pixels:
+            self.mean = histogram.dot(self.table) / self.pixels
+            self.max = self.table[used].max(axis=0)
+            self.tac_mean = histogram.dot(self.tac) / self.pixels
+            self.tac_max = self.tac[used].max()
+        else:
+            self.mean = self.max = np.zeros(len(inks))
+            self.tac_mean = self.tac_max = 0
+    
+    def get_area_over(self, tac_limit):
+        """ Return the part of the image in percent with a total area
+        coverage above tac_limit.
+        """
+        if not self.pixels:
+            return 0
+        return self.histogram[self.tac > tac_limit].sum() / self.pixels * 100
+    
+    def get_warnings(self, tac_limit=300, ink_limit=None):
+        """ Return a list of tuples ('warning', message, more info) for each
+        limit that is exceeded.
+        
+        tac_limit: the maximum total area coverage in percent
+        ink_limit: the maximum coverage of each ink in percent or None
+        """
+        warnings = []
+        if self.tac_max > tac_limit:
+            warnings.append(('warning'
+                , _('Total area coverage of {0:.1f}% exceeds {1}%.')
+                                        .format(self.tac_max, tac_limit)
+                , _('{0:.2f}% of the image is above the limit.')
+                                        .format(self.get_area_over(tac_limit))
+                ))
+        if ink_limit is not None:
+            for name, maximum in zip(self.names, self.max):
+                if maximum > ink_limit:
+                    warnings.append(('warning'
+                        , _('Coverage of {0} of {1:.1f}% exceeds {2}%.')
+                                            .format(name, maximum, ink_limit)
+                        , None
+                        ))
+        return warnings
+    
+    def get_summary(self):
+        """ Return a dict that can be serialized as JSON """
+        return {
+            'inks': OrderedDict((name, {'mean': float(mean), 'max': float(maximum)})
+                    for name, mean, maximum in zip(self.names, self.mean, self.max)),
+            'tac_mean': float(self.tac_mean),
+            'tac_max': float(self.tac_max)
+        }
+
+
+if __name__ == '__main__':
+    import sys
+    import json
+    from mtt2eps import open_mtt_file
+    args = sys.argv[1:]
+    tac_limit = 300
+    if args and args[0].startswith('--tac='):
+        tac_limit = float(args.pop(0)[len('--tac='):])
+    if len(args) >= 2:
+        inks = open_mtt_file(args[0]).visible_curves
+        cache = HistogramCache()
+        for filename, histogram, error in cache.iter_histograms(args[1:]):
+            if error is not None:
+                print(filename, error[1])
+                continue
+            coverage = Coverage(histogram, *inks)
+            summary = coverage.get_summary()
+            summary['warnings'] = [warning[1:] for warning
+                                   in coverage.get_warnings(tac_limit)]
+            print(filename, json.dumps(summary))
+    else:
+        print(_('Give me a mtt-filename and one or more image-filenames, optionally first --tac=<limit in percent>'))
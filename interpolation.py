@@ -24,9 +24,9 @@ import numpy as np
 from scipy import interpolate # http://docs.scipy.org/doc/scipy/reference/tutorial/interpolate.html
 
 
-__all__ = ['InterpolationStrategy', 'InterpolatedSpline', 'InterpolatedMonotoneCubic'
-           'InterpolatedLinear', 'interpolation_strategies',
-           'interpolation_strategies_dict']
+__all__ = ['CurveException', 'InterpolationStrategy', 'InterpolatedSpline',
+           'InterpolatedMonotoneCubic', 'InterpolatedLinear',
+           'interpolation_strategies', 'interpolation_strategies_dict']
 
 
 # just a preparation for i18n
@@ -34,6 +34,10 @@ def _(string):
     return string
 
 
+class CurveException(ValueError):
+    pass
+
+
 class InterpolationStrategy(object):
     """ Abstract base class for all interpolation strategies. """
     @property
@@ -53,12 +57,11 @@ class InterpolationStrategy(object):
     def set_points(self, points):
         if len(points) < 2:
             raise CurveException('Need at least two points');
-        pts = list(zip(*points))
-        # in python3 pts needs the conversion to list because in python3
-        # zip returns iterators resulting in:
-        # TypeError: 'zip' object is not subscriptable
-        self._x = np.array(pts[0], dtype=float)
-        self._y = np.array(pts[1], dtype=float)
+        # points is a sequence of (x, y) or an array of shape (n, 2)
+        # like ModelCurve.points_array
+        points = np.array(points, dtype=float)
+        self._x = points[:, 0]
+        self._y = points[:, 1]
     
     def __call__(self, xs):
         """ Take an np array of x values and return an np array of the same
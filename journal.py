@@ -0,0 +1,355 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+import mmap
+from bisect import bisect_right
+
+from history import Command
+
+__all__ = ['Journal', 'JournalCommand', 'DocumentJournal']
+
+
+def _dumps(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def _normalize(state):
+    """ Return state with the types it would have after loading it from json.
+    e.g. tuples become lists.
+    """
+    return json.loads(_dumps(state))
+
+
+class Journal(object):
+    """ Append-only journal of the states of a document, stored as JSON lines
+    next to the document file.
+    
+    Each line is one revision, the line number is the revision number.
+    A line is one of:
+        {"snapshot":state} the complete state
+        {"saved":state}    the complete state, as written to the document file
+        {"diff":changes}   the keys of the state that changed since the
+                           previous revision. Lists of dicts (like the curves
+                           of ModelCurves.get_args) are stored with an int
+                           instead of each element that is equal to an element
+                           of the previous revision, the int is its index there.
+    
+    Every snapshot_interval revisions a snapshot is written, so get_state
+    never needs to apply more diffs than that. The file is memory mapped
+    to find the revisions without reading it completely.
+    """
+    file_extension = '.journal'
+    snapshot_interval = 100
+    
+    _snapshot_prefix = b'{"snapshot":'
+    _saved_prefix = b'{"saved":'
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'ab')
+        self._mmap = None
+        # byte offsets of the beginning of each line, plus the end of the file
+        self._offsets = [0]
+        # revisions that contain a complete state, ascending
+        self._snapshots = []
+        self._saved_revision = None
+        self._last_state = None
+        self._load_index()
+    
+    @classmethod
+    def get_filename(Cls, document_filename):
+        return document_filename + Cls.file_extension
+    
+    @classmethod
+    def for_document(Cls, document_filename):
+        return Cls(Cls.get_filename(document_filename))
+    
+    def _map(self):
+        """ Return a memory map of the file, that covers all lines. """
+        if self._mmap is None or len(self._mmap) < self._offsets[-1]:
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.filename, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+    
+    def _load_index(self):
+        if os.path.getsize(self.filename) == 0:
+            # can't memory map an empty file
+            return
+        data = self._map()
+        size = len(data)
+        start = 0
+        while start < size:
+            end = data.find(b'\n', start)
+            if end == -1:
+                # an incomplete last line, i.e. after a crash while writing
+                break
+            revision = len(self._offsets) - 1
+            if data[start:start + len(self._snapshot_prefix)] == self._snapshot_prefix:
+                self._snapshots.append(revision)
+            elif data[start:start + len(self._saved_prefix)] == self._saved_prefix:
+                self._snapshots.append(revision)
+                self._saved_revision = revision
+            start = end + 1
+            self._offsets.append(start)
+        if start < size:
+            # cut the incomplete line, appending will continue at start
+            self._mmap.close()
+            self._mmap = None
+            self._file.truncate(start)
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+    
+    @property
+    def saved_revision(self):
+        """ The last revision that was written to the document file or None """
+        return self._saved_revision
+    
+    def _read(self, revision):
+        data = self._map()
+        line = data[self._offsets[revision]:self._offsets[revision + 1]]
+        (kind, value), = json.loads(line.decode('utf-8')).items()
+        return kind, value
+    
+    @staticmethod
+    def _is_dict_list(value):
+        return isinstance(value, list) \
+                and all(isinstance(item, dict) for item in value)
+    
+    @classmethod
+    def _apply(Cls, state, changes):
+        state = dict(state)
+        for key, value in changes.items():
+            old = state.get(key, None)
+            if isinstance(value, list) and Cls._is_dict_list(old):
+                value = [old[item] if isinstance(item, int) else item
+                         for item in value]
+            state[key] = value
+        return state
+    
+    @classmethod
+    def _diff(Cls, old_state, state):
+        changes = {}
+        for key, value in state.items():
+            old = old_state.get(key, None)
+            if value == old:
+                continue
+            if Cls._is_dict_list(value) and Cls._is_dict_list(old):
+                old_indexes = dict((_dumps(item), i) for i, item in enumerate(old))
+                value = [old_indexes.get(_dumps(item), item) for item in value]
+            changes[key] = value
+        return changes
+    
+    def get_state(self, revision):
+        """ Return the state at revision, a negative revision counts from
+        the end like list indexes.
+        """
+        if revision < 0:
+            revision += len(self)
+        if not 0 <= revision < len(self):
+            raise IndexError('Journal has no revision {0}'.format(revision))
+        # the nearest complete state before or at revision
+        snapshot = self._snapshots[bisect_right(self._snapshots, revision) - 1]
+        state = self._read(snapshot)[1]
+        for i in range(snapshot + 1, revision + 1):
+            state = self._apply(state, self._read(i)[1])
+        return state
+    
+    def _write(self, kind, value):
+        line = _dumps({kind: value}).encode('utf-8') + b'\n'
+        self._file.write(line)
+        self._file.flush()
+        revision = len(self)
+        self._offsets.append(self._offsets[-1] + len(line))
+        return revision
+    
+    def append(self, state, saved=False):
+        """ Append a new revision if state is different from the state of the
+        last revision. Return the number of the last revision.
+        
+        saved: state was written to the document file
+        """
+        state = _normalize(state)
+        if self._last_state is None and len(self):
+            self._last_state = self.get_state(-1)
+        if not saved and state == self._last_state:
+            return len(self) - 1
+        
+        if saved:
+            revision = self._write('saved', state)
+            self._saved_revision = revision
+            self._snapshots.append(revision)
+        elif self._last_state is None \
+                or len(self) - self._snapshots[-1] >= self.snapshot_interval:
+            revision = self._write('snapshot', state)
+            self._snapshots.append(revision)
+        else:
+            revision = self._write('diff', self._diff(self._last_state, state))
+        self._last_state = state
+        return revision
+    
+    def reset(self):
+        """ Remove all revisions """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.truncate(0)
+        self._offsets = [0]
+        self._snapshots = []
+        self._saved_revision = None
+        self._last_state = None
+    
+    def attach(self, state):
+        """ Use this journal for a document that was loaded with state.
+        
+        Return (state, recovered), where state is the state to use for the
+        document and recovered is True when the journal has revisions
+        after the last save, e.g. because the program crashed. Then the
+        returned state is the last revision of the journal.
+        
+        If the journal does not belong to state, e.g. because the document
+        file was changed by another program, the journal is reset.
+        """
+        state = _normalize(state)
+        saved = self._saved_revision
+        try:
+            if saved is not None and self.get_state(saved) == state:
+                if saved < len(self) - 1:
+                    return self.get_state(-1), True
+                return state, False
+        except (ValueError, TypeError, KeyError, AttributeError, IndexError):
+            # a broken line, start again
+            pass
+        self.reset()
+        self.append(state, saved=True)
+        return state, False
+    
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+class JournalCommand(Command):
+    """ History command to restore the state of a journal revision. """
+    __slots__ = ('journal', 'revision')
+    
+    def __init__(self, journal, revision):
+        super(JournalCommand, self).__init__('journal')
+        self.journal = journal
+        self.revision = revision
+    
+    def __call__(self, obj):
+        # the models are changed in place, see ModelCurves.set_args
+        obj.set_args(**self.journal.get_state(self.revision))
+
+
+class DocumentJournal(object):
+    """ The Journal of a document file, which is made when the document is
+    changed for the first time. Just opening a document leaves no journal
+    file behind. If the journal file can't be written, e.g. because the
+    directory is not writable, there is no journal.
+    
+    filename: the document file or None if it was not saved yet
+    state: the state of the document file
+    """
+    # how many revisions of the journal are restored as undo steps
+    undo_depth = 1000
+    
+    def __init__(self, filename, state):
+        self.filename = filename
+        self._saved_state = state
+        self._journal = None
+        # False when the journal file could not be opened
+        self._usable = filename is not None
+    
+    def _open(self):
+        try:
+            self._journal = Journal.for_document(self.filename)
+        except EnvironmentError:
+            self._usable = False
+        return self._journal
+    
+    def recover(self):
+        """ Open the journal if there is one already.
+        
+        Return (state, recovered) like Journal.attach, without a journal
+        this is the state of the document file.
+        """
+        if self._usable and os.path.exists(Journal.get_filename(self.filename)) \
+                        and self._open() is not None:
+            return self._journal.attach(self._saved_state)
+        return self._saved_state, False
+    
+    def add_history(self, model):
+        """ Add the revisions of the journal before the last one as undo
+        steps to the history of model, at most undo_depth.
+        """
+        journal = self._journal
+        if journal is None:
+            return
+        last = len(journal) - 1
+        for revision in range(max(0, last - self.undo_depth), last):
+            model.add_history(JournalCommand(journal, revision))
+    
+    def append(self, state):
+        """ Append state of the changed document, the journal file is made
+        if it does not exist yet.
+        """
+        if self._journal is None:
+            if not self._usable or self._open() is None:
+                return
+            self._journal.attach(self._saved_state)
+        self._journal.append(state)
+    
+    def save(self, state, filename):
+        """ The document was saved with state to filename. """
+        if filename != self.filename:
+            self.close()
+            self.filename = filename
+            self._usable = True
+            # the journal of the overwritten file is outdated
+            try:
+                os.remove(Journal.get_filename(filename))
+            except EnvironmentError:
+                pass
+        self._saved_state = state
+        if self._journal is not None:
+            self._journal.append(state, saved=True)
+    
+    def close(self, discard_changes=False):
+        """ discard_changes: the document is closed without saving. When
+        it is opened again it should not recover the changes, but they
+        stay available as undo steps.
+        """
+        journal = self._journal
+        if journal is None:
+            return
+        self._journal = None
+        if discard_changes:
+            journal.append(self._saved_state, saved=True)
+        journal.close()
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" An index of many .mtt files, to find profiles by the names of their
+inks or by how similar their colors are.
+
+The index is a SQLite database. For each profile it has the inks with
+their names and CMYK values, a fingerprint of each curve and the
+gradient of all visible inks from black to white, which is used as
+thumbnail and to compare the profiles.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from color_management import ColorTransform
+from compatibility import tobytes
+from epstool import get_device_n_table
+from model import ModelCurves, ModelInk
+import mttfile
+
+__all__ = ['default_database', 'get_gradient', 'get_fingerprint',
+           'ProfileLibrary']
+
+# just a preparation for i18n
+def _(string):
+    return string
+
+
+default_database = os.path.join(os.path.expanduser('~'), '.multitoner',
+                                'library.sqlite')
+
+_schema_version = 1
+_schema = """
+CREATE TABLE profiles (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    -- 256 RGB pixels from black to white, see get_gradient
+    gradient BLOB NOT NULL
+);
+CREATE TABLE inks (
+    profile_id INTEGER NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    c REAL, m REAL, y REAL, k REAL,
+    visible INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX inks_profile ON inks(profile_id);
+CREATE INDEX inks_name ON inks(name COLLATE NOCASE);
+CREATE INDEX inks_fingerprint ON inks(fingerprint);
+"""
+
+
+def get_gradient(inks):
+    """ Return the colors of inks for the 256 gray values, from black to
+    white, as numpy array of uint8 with the shape (256, 3), R G B.
+    """
+    if not inks:
+        # just paper
+        gradient = np.empty((256, 3), dtype=np.uint8)
+        gradient.fill(255)
+        return gradient
+    # B G R unused => R G B
+    return ColorTransform().get_table(*inks)[:, 2::-1].copy()
+
+
+def get_fingerprint(ink):
+    """ Return a hex digest of the amounts of ink for the gray values. Two
+    curves with the same result have the same fingerprint, even if their
+    points differ.
+    """
+    return hashlib.sha1(tobytes(get_device_n_table(ink))).hexdigest()
+
+
+class ProfileLibrary(object):
+    """ The index of .mtt files in database, a filename. """
+    extension = '.mtt'
+    
+    def __init__(self, database=default_database):
+        directory = os.path.dirname(database)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != _schema_version:
+            self._create_schema()
+        # (paths, gradients) for find_similar, loaded on demand
+        self._gradients = None
+    
+    def _create_schema(self):
+        with self.connection:
+            self.connection.execute('DROP TABLE IF EXISTS inks')
+            self.connection.execute('DROP TABLE IF EXISTS profiles')
+            self.connection.executescript(_schema)
+            self.connection.execute('PRAGMA user_version = {0}'.format(_schema_version))
+    
+    def close(self):
+        self.connection.close()
+    
+    def _iter_files(self, directory):
+        for root, directories, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.endswith(self.extension):
+                    yield os.path.join(root, filename)
+    
+    def _add(self, path, stat):
+        """ Index the profile at path, replacing an old entry """
+        data = mttfile.load(path)
+        model = ModelCurves(ChildModel=ModelInk, **data)
+        gradient = get_gradient(model.visible_curves)
+        self.connection.execute('DELETE FROM profiles WHERE path = ?', (path, ))
+        cursor = self.connection.execute('INSERT INTO profiles (path, mtime, '
+                            'size, gradient) VALUES (?, ?, ?, ?)',
+                            (path, stat.st_mtime, stat.st_size,
+                             sqlite3.Binary(tobytes(gradient))))
+        profile_id = cursor.lastrowid
+        self.connection.executemany('INSERT INTO inks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(profile_id, position, ink.name) + tuple(ink.cmyk)
+                + (int(ink.visible), get_fingerprint(ink))
+             for position, ink in enumerate(model.curves)])
+    
+    def scan(self, *directories):
+        """ Index all .mtt files in directories and their subdirectories.
+        Files that did not change since the last scan are skipped, the
+        entries of files that don't exist anymore are removed.
+        
+        Return (number of indexed files, number of removed entries, errors),
+        errors is a list of (path, message) of files that could not be read.
+        A file fails as a whole, whatever goes wrong, and does not stop the
+        scan. A directory within another one is scanned just once.
+        """
+        roots = []
+        for root in sorted(set(os.path.join(os.path.abspath(directory), '')
+                               for directory in directories)):
+            # sorted, so a directory comes before its subdirectories
+            if not any(root.startswith(other) for other in roots):
+                roots.append(root)
+        known = dict((path, (mtime, size)) for path, mtime, size
+                in self.connection.execute('SELECT path, mtime, size FROM profiles')
+                if any(path.startswith(root) for root in roots))
+        indexed = 0
+        errors = []
+        isolation_level = self.connection.isolation_level
+        # the transaction and the savepoints of the files are explicit
+        self.connection.isolation_level = None
+        try:
+            self.connection.execute('BEGIN')
+            completed = False
+            try:
+                for root in roots:
+                    for path in self._iter_files(root):
+                        try:
+                            stat = os.stat(path)
+                        except EnvironmentError as e:
+                            errors.append((path, '{0} {1}'.format(e, type(e))))
+                            continue
+                        if known.get(path, None) == (stat.st_mtime, stat.st_size):
+                            del known[path]
+                            continue
+                        self.connection.execute('SAVEPOINT scan_file')
+                        try:
+                            self._add(path, stat)
+                        except Exception as e:
+                            # _add may have written a part of the entry
+                            self.connection.execute('ROLLBACK TO scan_file')
+                            errors.append((path, '{0} {1}'.format(e, type(e))))
+                            continue
+                        finally:
+                            self.connection.execute('RELEASE scan_file')
+                        known.pop(path, None)
+                        indexed += 1
+                # what is left was not found or can't be read anymore
+                self.connection.executemany('DELETE FROM profiles WHERE path = ?',
+                                            [(path, ) for path in known])
+                completed = True
+            finally:
+                self.connection.execute('COMMIT' if completed else 'ROLLBACK')
+        finally:
+            self.connection.isolation_level = isolation_level
+            self._gradients = None
+        return indexed, len(known), errors
+    
+    def get_inks(self, path):
+        """ Return a list of (name, cmyk, visible) of the inks of the
+        profile at path.
+        """
+        return [(name, (c, m, y, k), bool(visible)) for name, c, m, y, k, visible
+                in self.connection.execute('SELECT name, c, m, y, k, visible '
+                        'FROM inks JOIN profiles ON profile_id = id '
+                        'WHERE path = ? ORDER BY position', (path, ))]
+    
+    def get_gradient(self, path):
+        """ Return the gradient of the profile at path like get_gradient or
+        None if it is not in the library.
+        """
+        row = self.connection.execute('SELECT gradient FROM profiles '
+                                      'WHERE path = ?', (path, )).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(bytes(row[0]), dtype=np.uint8).reshape(256, 3)
+    
+    def search(self, ink_name):
+        """ Return a sorted list of the paths of the profiles with an ink
+        whose name contains ink_name, ignoring the case.
+        """
+        pattern = '%{0}%'.format(ink_name.replace('\\', '\\\\')
+                                         .replace('%', '\\%')
+                                         .replace('_', '\\_'))
+        return [path for path, in self.connection.execute(
+                    'SELECT DISTINCT path FROM profiles JOIN inks ON profile_id = id '
+                    'WHERE name LIKE ? ESCAPE \'\\\' ORDER BY path', (pattern, ))]
+    
+    def find_same_curve(self, ink):
+        """ Return a sorted list of the paths of the profiles that have a
+        curve with the same result as the curve of ink.
+        """
+        return [path for path, in self.connection.execute(
+                    'SELECT DISTINCT path FROM profiles JOIN inks ON profile_id = id '
+                    'WHERE fingerprint = ? ORDER BY path', (get_fingerprint(ink), ))]
+    
+    def _load_gradients(self):
+        if self._gradients is None:
+            paths = []
+            gradients = []
+            for path, gradient in self.connection.execute(
+                                'SELECT path, gradient FROM profiles'):
+                paths.append(path)
+                gradients.append(bytes(gradient))
+            gradients = np.frombuffer(b''.join(gradients), dtype=np.uint8)
+            self._gradients = (paths, gradients.reshape(-1, 256 * 3))
+        return self._gradients
+    
+    def find_similar(self, inks, limit=10):
+        """ Return up to limit tuples (distance, path) of the profiles with
+        the most similar colors to inks, the closest first. The distance is
+        the root mean square difference of the gradients, from 0 to 255.
+        
+        inks: a sequence of ModelInk or a gradient like get_gradient returns
+        """
+        if isinstance(inks, np.ndarray):
+            gradient = inks
+        else:
+            gradient = get_gradient([ink for ink in inks if ink.visible])
+        paths, gradients = self._load_gradients()
+        if not paths:
+            return []
+        differences = gradients.astype(np.int32) - gradient.reshape(-1)
+        distances = np.sqrt((differences * differences).mean(axis=1))
+        closest = np.argsort(distances, kind='mergesort')[:limit]
+        return [(float(distances[i]), paths[i]) for i in closest]
+
+
+if __name__ == '__main__':
+    import sys
+    commands = {
+        'scan': _('scan <directory> [<directory> ...]'),
+        'search': _('search <ink name>'),
+        'similar': _('similar <mtt-filename> [<number of results>]')
+    }
+    if len(sys.argv) < 3 or sys.argv[1] not in commands:
+        print(_('Give me one of these commands:'))
+        for usage in sorted(commands.values()):
+            print('  ', usage)
+        sys.exit(1)
+    library = ProfileLibrary()
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == 'scan':
+        indexed, removed, errors = library.scan(*args)
+        for path, message in errors:
+            print(_('Can\'t read {0}: {1}').format(path, message))
+        print(_('Indexed: {0} Removed: {1}').format(indexed, removed))
+    elif command == 'search':
+        for path in library.search(args[0]):
+            print(path, '|', ', '.join(name for name, __, __ in library.get_inks(path)))
+    elif command == 'similar':
+        model = ModelCurves(ChildModel=ModelInk, **mttfile.load(args[0]))
+        limit = int(args[1]) if len(args) > 1 else 10
+        for distance, path in library.find_similar(model.curves, limit):
+            print('{0:8.3f}'.format(distance), path)
+    library.close()
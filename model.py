@@ -20,8 +20,13 @@
 
 from __future__ import division, print_function, unicode_literals
 
+from contextlib import contextmanager
+
+import numpy as np
+
 from emitter import Emitter
-from history import get_calling_command, historize, HistoryAPI
+from history import get_calling_command, get_transaction_command, historize, \
+                    resolve_path, HistoryAPI
 
 
 __all__ = ['ModelException', 'Model', 'ModelControlPoint', 'ModelCurve',
@@ -46,17 +51,133 @@ def get_unique_id():
     return result
 
 
+def _freeze(value):
+    """ Return value with all lists replaced by tuples, for the history """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
 class ModelException(Exception):
     pass
 
 
+class _Transaction(object):
+    """ Collect the events and history entries of a Model.transaction """
+    def __init__(self, owner):
+        self.owner = owner
+        # (model, args) in order of their first occurrence
+        self._events = []
+        self._seen = set()
+        # the keys of _events that can't be hashed, e.g. with a list of points
+        self._unhashable = []
+        # (path relative to owner, command)
+        self.history = []
+    
+    def add_event(self, model, args):
+        key = (model, args)
+        try:
+            if key in self._seen:
+                return
+            self._seen.add(key)
+        except TypeError:
+            # compare with the other unhashable keys instead
+            if key in self._unhashable:
+                return
+            self._unhashable.append(key)
+        self._events.append(key)
+    
+    def rollback(self):
+        """ Revert the changes recorded in history, the newest first.
+        
+        This must run within another transaction of the owner, which
+        takes the history entries and events the commands make.
+        """
+        for path, command in reversed(self.history):
+            command(resolve_path(self.owner, path))
+    
+    def _is_attached(self, model):
+        """ False if model was removed from the owner during the transaction """
+        while model is not self.owner:
+            parent = model._get_parent()
+            if parent is None:
+                return False
+            try:
+                parent.get_by_id(model.id)
+            except ModelException:
+                return False
+            model = parent
+        return True
+    
+    def get_events(self):
+        """ Return a list of (model, args) to trigger after the transaction.
+        
+        Structural changes of a model (like addPoint, removeCurve) are
+        summarized as one event that makes the subscribers rebuild from the
+        current state (setPoints or setCurves), these come first. Then each
+        other distinct event of each still attached model follows once.
+        """
+        summaries = []
+        events = []
+        for model, args in self._events:
+            if not self._is_attached(model):
+                continue
+            if args and args[0] in model._structural_events:
+                summary = (model, (model._structural_summary, ))
+                if summary not in summaries:
+                    summaries.append(summary)
+            else:
+                events.append((model, args))
+        return summaries + events
+    
+    @staticmethod
+    def get_receivers(events):
+        """ Return a list of (model, events) with each model that gets a
+        'transaction' event, the deepest models first: the models of events
+        and all their parents. events are the ones of the model and of its
+        children.
+        """
+        receivers = {}
+        order = []
+        for event in events:
+            path = []
+            model = event[0]
+            while model is not None:
+                path.append(model)
+                model = model._get_parent()
+            for depth, model in enumerate(reversed(path)):
+                if model not in receivers:
+                    receivers[model] = []
+                    order.append((depth, model))
+                receivers[model].append(event)
+        # sorted is stable, models with the same depth keep their order
+        order = sorted(order, key=lambda item: -item[0])
+        return [(model, tuple(receivers[model])) for depth, model in order]
+
+
 class Model(HistoryAPI, Emitter):
     """ Abstract base class for all models.
     
     Subscribers must implement on_model_updated which is called with the
     emmiting instance as first argument and more arguments depending on
     the concrete model implementation
+    
+    The second argument is the name of the event. Subscribers can filter
+    by these names, see Emitter.add. An event relayed from a child model
+    (see _relay_events) can also be filtered by the name of the relay
+    event and the name of the child event joined by a dot, e.g.
+    'curveUpdate.cmykChanged'.
+    
+    After a transaction each model that changed gets one 'transaction'
+    event with the events of the transaction as argument, see
+    get_transaction_events.
     """
+    # events that change the children of the model, see transaction
+    _structural_events = frozenset()
+    _structural_summary = None
+    # events that relay the events of a child model: (name, child, *child_args)
+    _relay_events = frozenset()
+    
     def __init__(self):
         super(Model, self).__init__()
         _id = get_unique_id()
@@ -67,6 +188,8 @@ class Model(HistoryAPI, Emitter):
         state = self.__dict__.copy() # copy the dict since we change it
         HistoryAPI._cleanstate(state)
         Emitter._cleanstate(state)
+        if '_transaction' in state:
+            del state['_transaction']
         return state
     
     @property
@@ -78,16 +201,168 @@ class Model(HistoryAPI, Emitter):
             child.add(self) # subscribe
             child.history_api = self # for undo/redo
     
+    def _disconnect(self, *children):
+        """ Stop relaying the events of children that were replaced or
+        removed, a view may still change them.
+        """
+        for child in children:
+            child.discard(self) # unsubscribe
+    
+    def _get_parent(self):
+        """ Return the model this is connected to or None. """
+        weak_ref = getattr(self, '_history_api', None)
+        parent = weak_ref() if weak_ref is not None else None
+        return parent if isinstance(parent, Model) else None
+    
+    def _get_transaction(self):
+        """ Return the open transaction of this model or of one of its
+        parents or None.
+        """
+        model = self
+        while model is not None:
+            transaction = model.__dict__.get('_transaction', None)
+            if transaction is not None:
+                return transaction
+            model = model._get_parent()
+        return None
+    
+    @contextmanager
+    def transaction(self):
+        """ Context manager to batch changes of this model and its children.
+        
+        >>>
+        with model.transaction():
+            ink.name = 'PANTONE 144 C'
+            ink.cmyk = (0.0, 0.5, 1.0, 0.0)
+            ink.points = points
+        <<<
+        
+        Within the transaction no subscriber is informed about updates.
+        When it ends, the subscribers of each model that changed or has
+        children that changed get one 'transaction' event instead of the
+        single events, this includes the parents of this model. The events
+        are an argument of it, where each distinct event is included just
+        once and structural changes are summarized, see
+        _Transaction.get_events and get_transaction_events.
+        All history entries made within the transaction are added as one
+        entry, so one undo reverts the whole transaction.
+        
+        A transaction within an open transaction of this model or one
+        of its parents just joins the outer transaction.
+        
+        If the block raises an exception the changes made so far are
+        reverted, nothing is added to the history and no subscriber is
+        informed.
+        """
+        if self._get_transaction() is not None:
+            yield
+            return
+        transaction = self._transaction = _Transaction(self)
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            if completed:
+                del self._transaction
+            else:
+                # the history entries and events of the rollback are dropped
+                self._transaction = _Transaction(self)
+                try:
+                    transaction.rollback()
+                finally:
+                    del self._transaction
+        if len(transaction.history) == 1:
+            path, command = transaction.history[0]
+            HistoryAPI.add_history(self, command, list(path))
+        elif transaction.history:
+            command = get_transaction_command(transaction.history)
+            HistoryAPI.add_history(self, command)
+        for model, events in transaction.get_receivers(transaction.get_events()):
+            model.trigger_on_model_updated('transaction', events)
+    
+    def get_transaction_events(self, events, names=None):
+        """ Return a list with the arguments of each event of a 'transaction'
+        event of this model, as they would have been received one by one
+        from this model: the events of children are relayed by their parents.
+        
+        events: the argument of the 'transaction' event
+        names: None for all events or the event names to filter by, like
+               the events argument of Emitter.add
+        
+        A subscriber can handle the 'transaction' event like this:
+        >>>
+        if event == 'transaction':
+            for args in model.get_transaction_events(args[0]):
+                self.on_model_updated(model, *args)
+            return
+        <<<
+        """
+        result = []
+        for model, args in events:
+            while model is not self and model is not None:
+                parent = model._get_parent()
+                if parent is not None:
+                    args = parent._get_relayed_args(model, args)
+                model = parent
+            if model is None:
+                # not a child of this model anymore
+                continue
+            if names is not None and not set(names).intersection(
+                                                self._get_event_names(args)):
+                continue
+            result.append(args)
+        return result
+    
+    def _get_relayed_args(self, child, args):
+        """ Return the arguments this model triggers for an event of child """
+        raise NotImplementedError()
+    
+    def add_history(self, command, path=None):
+        transaction = self.__dict__.get('_transaction', None)
+        if transaction is None:
+            return super(Model, self).add_history(command, path)
+        transaction.history.append((tuple(path or ()), command))
+    
     def trigger_on_model_updated(self, *args):
-        for item in self._subscriptions:
-            item.on_model_updated(self, *args)
+        transaction = self._get_transaction()
+        if transaction is not None:
+            transaction.add_event(self, args)
+            return
+        self._emit('on_model_updated', (self, ) + args,
+                   self._get_event_names(args))
+    
+    def _get_event_names(self, args):
+        """ Return the names subscribers can filter the event args by. """
+        if not args:
+            return ()
+        event = args[0]
+        if event == 'transaction' and len(args) > 1:
+            # the names of the single events, so the subscribers that filter
+            # by these receive it
+            names = set([event])
+            for relayed in self.get_transaction_events(args[1]):
+                names.update(self._get_event_names(relayed))
+            return names
+        if event in self._relay_events and len(args) > 2:
+            return (event, '{0}.{1}'.format(event, args[2]))
+        return (event, )
 
 
 class ModelControlPoint(Model):
     """ Model representing one control point """
     def __init__(self, xy):
         super(ModelControlPoint, self).__init__()
-        self.xy = xy
+        # a new model has no history and no subscribers yet, no need
+        # to use the setter
+        self._xy = self._clamp(xy)
+    
+    @staticmethod
+    def _clamp(xy):
+        return (
+            max(0, min(1, xy[0])),
+            max(0, min(1, xy[1]))
+        )
     
     @property
     def xy(self):
@@ -96,11 +371,8 @@ class ModelControlPoint(Model):
     @xy.setter
     @historize
     def xy(self, xy):
-        xy = (
-            max(0, min(1, xy[0])),
-            max(0, min(1, xy[1]))
-        )
-        if not hasattr(self, '_xy') or xy != self._xy:
+        xy = self._clamp(xy)
+        if xy != self._xy:
             self._xy = xy
             self.trigger_on_model_updated()
 
@@ -111,45 +383,110 @@ class ModelCurve(Model):
     
     The control points are in no specific order
     
+    As long as no ModelControlPoint instances are needed, e.g. by an editor
+    or by the history, the points are stored compactly in a sorted numpy
+    array. The point models are created on first access of points or
+    get_by_id. Read-only consumers should use points_array or points_value.
+    Setting the points to coordinates, like set_args and loading a file do,
+    drops the point models and stores the points compactly again.
+    
     Further data is:
     display_color: the color used to draw the curve in an editor
     locked: whether the curve can be manipulated via an editor
     visible: whether the curve is visible in an editor or elsewhere
     """
+    _structural_events = frozenset(['addPoint', 'removePoint', 'setPoints'])
+    _structural_summary = 'setPoints'
+    
     def __init__(self, points=((0,0), (1,1)), interpolation='monotoneCubic',
                  display_color=(0,0,0), locked=False, visible=True):
         super(ModelCurve, self).__init__()
-        self.interpolation = interpolation
-        self.points = points
-        self.display_color = display_color
-        self.locked = locked
-        self.visible = visible
+        # a new model has no history and no subscribers yet, so the setters
+        # are not used, this makes loading many models fast
+        self._interpolation = interpolation
+        self._set_points(points)
+        self._display_color = display_color
+        self._locked = bool(locked)
+        self._visible = bool(visible)
     
     def __setstate__(self, state):
         """ for the pickle protocol """
         self.__dict__.update(state)
-        self._connect(*self._points)
+        if self._points is not None:
+            self._connect(*self._points)
     
     def get_args(self):
         """ Returns a dict that can be used to make a model with the same value.
         All values in the dict are simple python types.
         """
         return {
-            'points': [p.xy for p in self.points],
+            'points': self.points_value,
             'interpolation': self.interpolation,
             'display_color': self.display_color,
             'locked': self.locked,
             'visible': self.visible,
         }
     
+    def set_args(self, **args):
+        """ Set the values of args, a dict like get_args returns, within one
+        transaction. Only the values that changed are set, so the point
+        models are kept if the points did not change.
+        """
+        with self.transaction():
+            for name, value in args.items():
+                if name == 'points':
+                    changed = not np.array_equal(self.points_array,
+                                                 self._make_points_array(value))
+                elif isinstance(value, (list, tuple)):
+                    changed = tuple(value) != tuple(getattr(self, name))
+                else:
+                    changed = value != getattr(self, name)
+                if changed:
+                    setattr(self, name, value)
+    
     def get_by_id(self, model_id):
-        for model in self._points:
-            if model.id == model_id:
-                return model
-        raise ModelException('Model not found by id {0}'.format(model_id))
+        self._materialize_points()
+        try:
+            return self._points_by_id[model_id]
+        except KeyError:
+            raise ModelException('Model not found by id {0}'.format(model_id))
     
     def on_model_updated(self, cp_model, *args):
-        self.trigger_on_model_updated('pointUpdate', cp_model, *args)
+        self._points_array = None
+        if args and args[0] == 'transaction':
+            # this model gets its own, see Model.transaction
+            return
+        self.trigger_on_model_updated(*self._get_relayed_args(cp_model, args))
+    
+    def _get_relayed_args(self, cp_model, args):
+        return ('pointUpdate', cp_model) + tuple(args)
+    
+    @staticmethod
+    def _make_points_array(points):
+        """ Return a read only numpy array of shape (n, 2) with the
+        values of points, clamped between 0 and 1 and sorted like
+        sorted(points) would do.
+        """
+        array = np.array(points, dtype=float).reshape(-1, 2)
+        np.clip(array, 0, 1, out=array)
+        # sort by x first and then by y
+        array = array[np.lexsort((array[:, 1], array[:, 0]))]
+        array.flags.writeable = False
+        return array
+    
+    def _materialize_points(self):
+        """ Create the ModelControlPoint instances from the compact storage
+        if that did not happen yet.
+        """
+        if self._points is not None:
+            return
+        points_array = self._points_array
+        self._points = []
+        self._points_by_id = {}
+        for xy in points_array.tolist():
+            self._add_point(tuple(xy))
+        # the values did not change
+        self._points_array = points_array
     
     def _add_point(self, point):
         if not isinstance(point, ModelControlPoint):
@@ -158,9 +495,12 @@ class ModelCurve(Model):
             model = point
         self._connect(model)
         self._points.append(model)
+        self._points_by_id[model.id] = model
+        self._points_array = None
         return model
     
     def add_point(self, point):
+        self._materialize_points()
         model = self._add_point(point)
         
         undo = get_calling_command('remove_point_by_id', model.id)
@@ -173,20 +513,32 @@ class ModelCurve(Model):
         
             The invert of this is add_point.
         """
+        self._materialize_points()
         if len(self._points) == 2:
             return
         position = self._points.index(model)
         
-        undo = get_calling_command('add_point', model)
+        undo = get_calling_command('_restore_point', model.id, model.xy)
         self.add_history(undo)
         
         self._points.pop(position)
+        del self._points_by_id[model.id]
+        self._disconnect(model)
+        self._points_array = None
         self.trigger_on_model_updated('removePoint', model)
     
     def remove_point_by_id(self, modelId):
         model = self.get_by_id(modelId)
         self.remove_point(model)
     
+    def _restore_point(self, model_id, xy):
+        """ The invert of remove_point, the point model is made again with
+        its former id, because the history refers to it.
+        """
+        model = ModelControlPoint(xy)
+        model._id = model_id
+        self.add_point(model)
+    
     @property
     def points(self):
         """ Return an unordered tuple of the point models.
@@ -194,17 +546,85 @@ class ModelCurve(Model):
         The _points list is not returned because changing the _points list
         would change the model value and that's not intended as part
         of the interface.
+        
+        This creates the point models if they don't exist yet.
         """
+        self._materialize_points()
         return tuple(self._points)
         
     @points.setter
-    @historize
     def points(self, points):
-        self._points = []
-        for point in points:
-            self._add_point(point)
+        undo = get_calling_command('_restore_points', self._get_points_record())
+        self.add_history(undo)
+        self._set_points(points)
         self.trigger_on_model_updated('setPoints')
     
+    def _get_points_record(self):
+        """ Return the points as a tuple of (id, x, y) tuples for the
+        history, without pickling the point models. The id is None when
+        there are no point models.
+        """
+        if self._points is None:
+            return tuple((None, x, y) for x, y in self._points_array.tolist())
+        return tuple((point.id, ) + tuple(point.xy) for point in self._points)
+    
+    @staticmethod
+    def _make_points(record):
+        """ Return the points of a record of _get_points_record, the point
+        models are made again with their former ids.
+        """
+        if all(model_id is None for model_id, x, y in record):
+            return [(x, y) for model_id, x, y in record]
+        points = []
+        for model_id, x, y in record:
+            point = ModelControlPoint((x, y))
+            point._id = model_id
+            points.append(point)
+        return points
+    
+    def _restore_points(self, record):
+        """ The invert of the points setter """
+        self.points = self._make_points(record)
+    
+    def get_record(self):
+        """ Return the value of this model as (id, args) for the history,
+        args are the items of get_args as tuples, the points with their
+        ids, see _get_points_record. Everything is immutable, so it needs
+        no pickling. The model can be made again with from_record.
+        """
+        args = self.get_args()
+        args['points'] = self._get_points_record()
+        return (self.id, tuple(sorted((name, _freeze(value))
+                                      for name, value in args.items())))
+    
+    @classmethod
+    def from_record(Cls, record):
+        """ Return a new model with the id and value of record, see
+        get_record.
+        """
+        model_id, args = record
+        args = dict(args)
+        args['points'] = Cls._make_points(args['points'])
+        model = Cls(**args)
+        model._id = model_id
+        return model
+    
+    def _set_points(self, points):
+        points = tuple(points)
+        if getattr(self, '_points', None) is not None:
+            self._disconnect(*self._points)
+        if any(isinstance(point, ModelControlPoint) for point in points):
+            # i.e. on undo, the ids of the models must survive
+            self._points = []
+            # lookup table for get_by_id, kept in sync with _points
+            self._points_by_id = {}
+            for point in points:
+                self._add_point(point)
+        else:
+            # just coordinates, the models are created when needed
+            self._points = self._points_by_id = None
+            self._points_array = self._make_points_array(points)
+    
     @property
     def interpolation(self):
         return self._interpolation
@@ -215,9 +635,20 @@ class ModelCurve(Model):
         self._interpolation = interpolation
         self.trigger_on_model_updated('interpolationChanged')
     
+    @property
+    def points_array(self):
+        """ Return the points as read only numpy array of shape (n, 2),
+        sorted by x. This does not create any point models.
+        """
+        if self._points_array is None:
+            self._points_array = self._make_points_array(
+                                        [point.xy for point in self._points])
+        return self._points_array
+    
     @property
     def points_value(self):
-        return sorted(point.xy for point in self._points)
+        """ Return a sorted list of (x, y) tuples. """
+        return [tuple(xy) for xy in self.points_array.tolist()]
     
     @property
     def display_color(self):
@@ -259,8 +690,8 @@ class ModelInk(ModelCurve):
     """
     def __init__(self, name=_('(unnamed)'), cmyk=(0.0, 0.0, 0.0, 0.0), **args):
         super(ModelInk, self).__init__(**args)
-        self.name = name
-        self.cmyk = cmyk
+        self._name = name
+        self._cmyk = list(cmyk)
     
     def get_args(self):
         args = super(ModelInk, self).get_args()
@@ -331,13 +762,20 @@ class ModelInk(ModelCurve):
 
 class ModelCurves(Model):
     """ Model representing a ordered collection of curves """
+    _structural_events = frozenset(['insertCurve', 'removeCurve', 'setCurves',
+                                    'reorderedCurves'])
+    _structural_summary = 'setCurves'
+    _relay_events = frozenset(['curveUpdate'])
+    
     def __init__(self, curves=(), ChildModel=ModelCurve):
         """ ChildModel is very often ModelInk but ModelCurve would be enough
         for some uses, like a stand alone CurveEditor.
         """
         super(ModelCurves, self).__init__()
         self.ChildModel = ChildModel
-        self.curves = curves
+        # a new model has no history and no subscribers yet, no need
+        # to use the setter
+        self._set_curves(curves)
     
     def __setstate__(self, state):
         """ for the pickle protocol """
@@ -347,18 +785,47 @@ class ModelCurves(Model):
     def get_args(self):
         return {'curves': [curve.get_args() for curve in self._curves]}
     
+    def set_args(self, curves=()):
+        """ Change this model to the value of the arguments, a dict like
+        get_args returns, i.e. data loaded from a file, within one
+        transaction.
+        
+        Unlike the curves setter, the existing curve models are changed in
+        place, so their ids stay the same and views of them stay valid.
+        """
+        curves = list(curves)
+        with self.transaction():
+            for position, args in enumerate(curves):
+                if position < len(self._curves):
+                    self._curves[position].set_args(**args)
+                else:
+                    self.insert_curve(position, dict(args))
+            while len(self._curves) > len(curves):
+                self.remove_curve(self._curves[-1])
+    
     @property
     def curves(self):
         return tuple(self._curves)
     
     @curves.setter
-    @historize
     def curves(self, curves=()):
+        undo = get_calling_command('_restore_curves',
+                    tuple(curve.get_record() for curve in self._curves))
+        self.add_history(undo)
+        self._set_curves(curves)
+        self.trigger_on_model_updated('setCurves')
+    
+    def _restore_curves(self, records):
+        """ The invert of the curves setter, see ModelCurve.get_record """
+        self.curves = [self.ChildModel.from_record(record) for record in records]
+    
+    def _set_curves(self, curves):
         self._curves = []
+        # lookup table for get_by_id, kept in sync with _curves
+        self._curves_by_id = {}
         for curve in curves:
             # -1 appends
             self._insert_curve(-1, curve)
-        self.trigger_on_model_updated('setCurves')
     
     @property
     def visible_curves(self):
@@ -393,22 +860,24 @@ class ModelCurves(Model):
             if mid in seen:
                 raise ModelException('Having a duplicate id in ordering {0}'.format(mid))
             seen.add(mid)
-            try:
-                current_pos = current_order.index(mid)
-            except ValueError as e:
-                raise ModelException('Model not found by id {0}'.format(mid))
-            new_order.append(self._curves[current_pos])
+            new_order.append(self.get_by_id(mid))
         self._curves = new_order
         self.trigger_on_model_updated('reorderedCurves', ids)
     
     def get_by_id(self, mid):
-        for model in self._curves:
-            if model.id == mid:
-                return model
-        raise ModelException('Model not found by id {0}'.format(mid))
+        try:
+            return self._curves_by_id[mid]
+        except KeyError:
+            raise ModelException('Model not found by id {0}'.format(mid))
     
     def on_model_updated(self, curve_model, *args):
-        self.trigger_on_model_updated('curveUpdate', curve_model, *args)
+        if args and args[0] == 'transaction':
+            # this model gets its own, see Model.transaction
+            return
+        self.trigger_on_model_updated(*self._get_relayed_args(curve_model, args))
+    
+    def _get_relayed_args(self, curve_model, args):
+        return ('curveUpdate', curve_model) + tuple(args)
     
     def _insert_curve(self, position, curve):
         if not isinstance(curve, self.ChildModel):
@@ -420,6 +889,7 @@ class ModelCurves(Model):
             # this appends to the list
             position = len(self._curves)
         self._curves.insert(position, model)
+        self._curves_by_id[model.id] = model
         return model
     
     def insert_curve(self, position, curve=None):
@@ -441,13 +911,18 @@ class ModelCurves(Model):
     def remove_curve(self, model):
         position = self._curves.index(model)
         
-        undo = get_calling_command('insert_curve', position, model)
+        undo = get_calling_command('_restore_curve', position, model.get_record())
         self.add_history(undo)
         
         self._curves.pop(position)
+        del self._curves_by_id[model.id]
         self.trigger_on_model_updated('removeCurve', model)
     
     def remove_curve_by_id(self, modelId):
         model = self.get_by_id(modelId)
         self.remove_curve(model)
+    
+    def _restore_curve(self, position, record):
+        """ The invert of remove_curve, see ModelCurve.get_record """
+        self.insert_curve(position, self.ChildModel.from_record(record))
 
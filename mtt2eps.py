@@ -20,92 +20,176 @@
 
 from __future__ import division, print_function, unicode_literals
 
-import PIL.Image as Image
-from PIL import ExifTags
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
-import json
+import numpy as np
+import PIL.Image as Image
 
+from compatibility import tobytes
 from epstool import EPSTool
+from grayscale import normalize, read_cache, write_cache
 from model import ModelCurves, ModelInk
+import mttfile
 
 
-__all__ = ['open_image', 'model2eps', 'mtt2eps']
+__all__ = ['map_image', 'load_gray', 'load_image', 'image2eps_tool',
+           'open_image', 'model2eps', 'mtt2eps', 'iter_gray_images',
+           'batch_convert', 'batch_model2eps', 'batch_mtt2eps']
 
 
 # just a preparation for i18n
 def _(string):
     return string
 
-class ImageManipulation(object):
-    # see rectify_rotation
-    for _exif_orientation_tag, search in ExifTags.TAGS.iteritems(): 
-        if search == 'Orientation':
-            del search
-            break
-    # see rectify_rotation
-    _orientation_transpose_methods = {
-          3: Image.ROTATE_180
-        , 6: Image.ROTATE_270
-        , 8: Image.ROTATE_90
-        }
+def map_image(filename):
+    """ Return the pixels of the image at filename as read only numpy array
+    of uint8 with the shape (height, width), memory mapped from the file.
+    So the image is never loaded into memory as a whole.
     
-    @classmethod
-    def rectify_rotation(cls, image):
-        """
-        Rotate the image physically to the orientation the exif tag for
-        orientation suggest. Return the original image if no rotation was
-        performed, otherwise return a rotated copy of image.
-        
-        A JPEG image might have an exif tag that tells the viewer how it
-        should be rotatet. Usually the camera writes that tag depending
-        on how it was held when taking the photo.
-        
-        from http://stackoverflow.com/a/11543365/1315369
-        """
-        # only present in JPEGs
-        if not hasattr(image, '_getexif'):
-            return image
-        
-        exif = image._getexif()
-        # has no exif tags
-        if exif is None:
-            return image
-        orientation = exif.get(cls._exif_orientation_tag, None) # 1, 3, 6, 8
-        if orientation in cls._orientation_transpose_methods:
-            transpose_method = cls._orientation_transpose_methods[orientation]
-            return image.transpose(transpose_method)
-        return image
+    Return None if the image is not stored as uncompressed 8 bit grayscale
+    pixels in one block, like binary PGM and uncompressed TIFF files are.
+    """
+    try:
+        with Image.open(filename) as im:
+            offset = _get_pixels_offset(im)
+            width, height = im.size
+    except IOError:
+        return None
+    if offset is None:
+        return None
+    try:
+        return np.memmap(filename, dtype=np.uint8, mode='r', offset=offset,
+                         shape=(height, width))
+    except (ValueError, EnvironmentError):
+        # i.e. the file is shorter than its header says
+        return None
 
-def open_image(filename):
-    """ Return (eps_tool, notice, error)
+
+def _get_pixels_offset(im):
+    """ Return where the pixels of the PIL image im start in its file or
+    None if they are not stored like map_image needs it.
+    """
+    if im.mode != 'L':
+        return None
+    width, height = im.size
+    offset = None
+    next_row = 0
+    # the tiles tell where and how PIL would read the pixel data, they
+    # must be raw rows, one after another without gaps
+    for decoder, box, tile_offset, args in im.tile:
+        if not isinstance(args, tuple):
+            args = (args, )
+        # (rawmode, stride, orientation)
+        args += (0, 1)[len(args) - 1:]
+        x0, y0, x1, y1 = box
+        if decoder != 'raw' or args[:3] not in (('L', 0, 1), ('L', width, 1)) \
+                or (x0, x1, y0) != (0, width, next_row):
+            return None
+        if offset is None:
+            offset = tile_offset
+        elif tile_offset != offset + y0 * width:
+            return None
+        next_row = y1
+    if next_row != height:
+        return None
+    return offset
+
+
+def _get_conversion_notice(mode):
+    if mode == 'L':
+        return None
+    # Display a message in the ui process. Reproducing
+    # the result relies on the method used to convert here. It's
+    # better to have a grayscale image as input.
+    return ('notice'
+           , _('Converted image to grayscale')
+           , _('From Python Imaging Library (PIL) mode "{0}".').format(mode)
+           )
+
+
+def load_gray(filename, weights='rec601'):
+    """ Return (pixels, notice, error)
     
-    eps_tool: an instance of eps_tool loaded with the data of the image at filename
+    pixels: the pixels of the image at filename rotated and converted to
+            grayscale by grayscale.normalize, as numpy array of uint8 with
+            the shape (height, width).
+            If possible the array is memory mapped from the image itself
+            (see map_image) or from the cache file of normalize next to it,
+            which is made when the image is loaded the first time. So the
+            image is decoded and converted just once.
     notice: a tuple with a notice for the user or None
     error: None or if an error occured an error tuple to return with work,
-           then eps_tool and notice must not be used.
+           then pixels and notice must not be used.
     """
-    error = notice = eps_tool = None
+    pixels = map_image(filename)
+    if pixels is not None:
+        return pixels, None, None
+    cached = read_cache(filename, weights)
+    if cached is not None:
+        pixels, mode = cached
+        return pixels, _get_conversion_notice(mode), None
     try:
-        im = Image.open(filename)
+        with Image.open(filename) as im:
+            mode = im.mode
+            pixels = normalize(im, weights)
     except IOError as e:
         error = ('error'
                 , _('Can\'t open image for preview {0}.').format(filename)
                 , _('Message: {0} {1}').format(e, type(e))
                 )
+        return None, None, error
+    mapped = write_cache(filename, pixels, mode, weights)
+    if mapped is not None:
+        pixels = mapped
+    return pixels, _get_conversion_notice(mode), None
+
+
+def load_image(filename):
+    """ Return (image, notice, error)
+    
+    image: the image at filename as grayscale PIL image, its pixels are
+           from load_gray
+    notice: a tuple with a notice for the user or None
+    error: None or if an error occured an error tuple to return with work,
+           then image and notice must not be used.
+    """
+    pixels, notice, error = load_gray(filename)
+    if error is not None:
+        return None, notice, error
+    height, width = pixels.shape
+    # uses the memory of pixels, nothing is copied
+    im = Image.frombuffer('L', (width, height), np.ascontiguousarray(pixels),
+                          'raw', 'L', 0, 1)
+    return im, notice, None
+
+
+def image2eps_tool(im):
+    """ Return an instance of EPSTool loaded with the data of the grayscale
+    PIL image im or of a numpy array like load_gray returns, the array
+    is not copied.
+    """
+    eps_tool = EPSTool()
+    if isinstance(im, np.ndarray):
+        height, width = im.shape
+        eps_tool.set_image_data(im, (width, height))
     else:
-        im = ImageManipulation.rectify_rotation(im)
-        if im.mode != 'L':
-            # Display a message in the ui process. Reproducing
-            # the result relies on the method used to convert here. It's
-            # better to have a grayscale image as input.
-            notice = ('notice'
-                     , _('Converted image to grayscale')
-                     , _('From Python Imaging Library (PIL) mode "{0}".').format(im.mode)
-                     )
-            im = im.convert('L')
-        eps_tool = EPSTool()
-        eps_tool.set_image_data(im.tostring(), im.size)
-        
+        eps_tool.set_image_data(tobytes(im), im.size)
+    return eps_tool
+
+
+def open_image(filename):
+    """ Return (eps_tool, notice, error)
+    
+    eps_tool: an instance of eps_tool loaded with the data of the image at filename
+    notice: a tuple with a notice for the user or None
+    error: None or if an error occured an error tuple to return with work,
+           then eps_tool and notice must not be used.
+    """
+    pixels, notice, error = load_gray(filename)
+    eps_tool = None
+    if error is None:
+        eps_tool = image2eps_tool(pixels)
     return eps_tool, notice, error
 
 
@@ -120,20 +204,20 @@ def make_eps_from_model(model, image_filename):
 
 
 def open_mtt_file(mtt_filename):
-    with open(mtt_filename, 'r') as f:
-        data = json.load(f)
+    data = mttfile.load(mtt_filename)
     model = ModelCurves(ChildModel=ModelInk, **data)
     return model
 
 
 def model2eps(model, image_filename, eps_filename):
-    eps, notice, error = make_eps_from_model(model, image_filename)
-    if error is None:
-        with open(eps_filename, 'w') as f:
-            f.write(eps)
-        return True, notice
-    else:
+    eps_tool, notice, error = open_image(image_filename)
+    if error is not None:
         return False, error
+    eps_tool.set_color_data(*model.visible_curves)
+    # written piece by piece, for huge images that need less memory
+    with open(eps_filename, 'wb') as f:
+        eps_tool.write(f)
+    return True, notice
 
 
 def mtt2eps(mtt_filename, image_filename, eps_filename):
@@ -141,15 +225,128 @@ def mtt2eps(mtt_filename, image_filename, eps_filename):
     return model2eps(model, image_filename, eps_filename)
 
 
+def iter_gray_images(filenames, prefetch=2, threads=None):
+    """ Yield (filename, pixels, notice, error) like load_gray returns it
+    for each of filenames, in the same order.
+    
+    The images are decoded in a pool of threads while the caller works
+    with the previous ones. PIL and numpy release the GIL while decoding
+    and converting, so this overlaps with reading the files and with
+    writing the results.
+    
+    filenames: any iterable, it is consumed lazily
+    prefetch: how many images are loaded ahead of the one that was yielded
+              last. Each needs the memory of its pixels, unless they are
+              memory mapped.
+    threads: the size of the thread pool, by default prefetch
+    """
+    prefetch = max(1, prefetch)
+    pool = ThreadPool(threads or prefetch)
+    pending = deque()
+    filenames = iter(filenames)
+    try:
+        while True:
+            while len(pending) < prefetch + 1:
+                try:
+                    filename = next(filenames)
+                except StopIteration:
+                    break
+                pending.append((filename, pool.apply_async(load_gray, (filename, ))))
+            if not pending:
+                break
+            filename, result = pending.popleft()
+            yield (filename, ) + result.get()
+    finally:
+        # the caller may stop early, don't wait for the prefetched images
+        pool.terminate()
+        pool.join()
+
+
+def batch_convert(convert, jobs, prefetch=2, threads=None):
+    """ Convert many images. Yield (image_filename, target_filename, result,
+    message) for each job.
+    
+    convert: a function (pixels, target_filename) that writes the result
+             for pixels, like load_gray returns them, and returns None or
+             an error tuple if that failed
+    jobs: an iterable of (image_filename, target_filename) tuples
+    
+    While a result is written the next images are decoded, see
+    iter_gray_images.
+    """
+    jobs = iter(jobs)
+    target_filenames = deque()
+    def get_image_filenames():
+        for image_filename, target_filename in jobs:
+            target_filenames.append(target_filename)
+            yield image_filename
+    
+    images = iter_gray_images(get_image_filenames(), prefetch, threads)
+    for image_filename, pixels, notice, error in images:
+        target_filename = target_filenames.popleft()
+        if error is None:
+            error = convert(pixels, target_filename)
+        # don't keep the pixels while the next image is loaded
+        del pixels
+        if error is not None:
+            yield image_filename, target_filename, False, error
+        else:
+            yield image_filename, target_filename, True, notice
+
+
+def batch_model2eps(model, jobs, prefetch=2, threads=None):
+    """ Like model2eps for many images. Yield
+    (image_filename, eps_filename, result, message) for each job.
+    
+    jobs: an iterable of (image_filename, eps_filename) tuples
+    
+    See batch_convert.
+    """
+    inks = model.visible_curves
+    def convert(pixels, eps_filename):
+        eps_tool = image2eps_tool(pixels)
+        eps_tool.set_color_data(*inks)
+        try:
+            with open(eps_filename, 'wb') as f:
+                eps_tool.write(f)
+        except IOError as e:
+            return ('error'
+                   , _('Can\'t write the EPS {0}.').format(eps_filename)
+                   , _('Message: {0} {1}').format(e, type(e))
+                   )
+        return None
+    return batch_convert(convert, jobs, prefetch, threads)
+
+
+def batch_mtt2eps(mtt_filename, jobs, prefetch=2, threads=None):
+    model = open_mtt_file(mtt_filename)
+    return batch_model2eps(model, jobs, prefetch, threads)
+
+
 if __name__ == '__main__':
     import sys
     if len(sys.argv) == 4:
         result, message = mtt2eps(*sys.argv[1:])
         if message is not None:
-            print(message[1].title() + ':', *message[1:])
+            print(message[0].title() + ':', *message[1:])
         if result:
             print('Done!')
         else:
             print('Failed!')
+    elif len(sys.argv) > 4 and len(sys.argv) % 2 == 0:
+        jobs = zip(sys.argv[2::2], sys.argv[3::2])
+        failed = 0
+        for image_filename, eps_filename, result, message \
+                                in batch_mtt2eps(sys.argv[1], jobs):
+            print(image_filename, '=>', eps_filename)
+            if message is not None:
+                print('  ', message[0].title() + ':', *message[1:])
+            if not result:
+                failed += 1
+        if failed:
+            print('Failed: {0}!'.format(failed))
+        else:
+            print('Done!')
     else:
         print(_('Give me three arguments: source mtt-filename, source image-filename, destination eps-filename'))
+        print(_('Or more pairs of source image-filename, destination eps-filename to convert many images with the same mtt-file'))
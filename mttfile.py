@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Read and write the data of .mtt files.
+
+The .mtt file is JSON. Next to it there can be a binary sidecar file,
+which is much faster to read, because the points of all curves are stored
+as one block of numbers. The sidecar is only used while it belongs to
+the current contents of the .mtt file, otherwise the JSON is read.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+import struct
+
+import numpy as np
+
+from compatibility import tobytes
+
+__all__ = ['sidecar_extension', 'dumps', 'pack', 'unpack', 'load', 'save',
+           'write_sidecar']
+
+
+sidecar_extension = '.bin'
+
+# magic, format version, mtime and size of the .mtt file, length of the header
+_head = struct.Struct(str('<4sBdQI'))
+_magic = b'MTTB'
+_version = 1
+# the points: pairs of little endian doubles
+_points_dtype = np.dtype(str('<f8'))
+
+
+def dumps(data):
+    """ Return the JSON text of a .mtt file with data """
+    return json.dumps(data, sort_keys=True, indent=2, separators=(',', ': '))
+
+
+def pack(data, stat=(0, 0)):
+    """ Return the binary representation of data as bytes.
+    
+    data: a dict like ModelCurves.get_args returns
+    stat: (mtime, size) of the .mtt file the result belongs to
+    """
+    header = dict(data)
+    points = []
+    curves = []
+    for curve in data.get('curves', ()):
+        curve = dict(curve)
+        if 'points' in curve:
+            points += curve['points']
+            # just the number of points is stored in the header
+            curve['points'] = len(curve['points'])
+        curves.append(curve)
+    header['curves'] = curves
+    header = json.dumps(header, sort_keys=True, separators=(',', ':'))\
+                                                            .encode('utf-8')
+    points = np.array(points, dtype=_points_dtype).reshape(-1, 2)
+    mtime, size = stat
+    return _head.pack(_magic, _version, mtime, size, len(header)) \
+         + header + tobytes(points)
+
+
+def _read_head(binary):
+    """ Return (mtime, size, header_length) or None if binary is not in
+    the sidecar format.
+    """
+    if len(binary) < _head.size:
+        return None
+    magic, version, mtime, size, header_length = _head.unpack_from(binary)
+    if magic != _magic or version != _version:
+        return None
+    return mtime, size, header_length
+
+
+def unpack(binary):
+    """ Return the data of binary as made by pack. The result is the same
+    as the result of json.loads(dumps(data)), except that the coordinates
+    of the points are always floats, e.g. [0.0, 1.0] instead of [0, 1].
+    The models make no difference between these.
+    
+    raises ValueError if binary is not in the right format.
+    """
+    head = _read_head(binary)
+    if head is None:
+        raise ValueError('Not in the binary .mtt format.')
+    header_length = head[-1]
+    start = _head.size
+    data = json.loads(binary[start:start + header_length].decode('utf-8'))
+    points = np.frombuffer(binary, dtype=_points_dtype,
+                           offset=start + header_length).reshape(-1, 2).tolist()
+    position = 0
+    for curve in data.get('curves', ()):
+        if 'points' in curve:
+            count = curve['points']
+            curve['points'] = points[position:position + count]
+            position += count
+    return data
+
+
+def _get_stat(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime, stat.st_size
+
+
+def _read_sidecar(filename):
+    """ Return the data of the sidecar of filename or None if there is
+    none or if it does not belong to the current contents of filename.
+    """
+    try:
+        with open(filename + sidecar_extension, 'rb') as f:
+            binary = f.read()
+    except (IOError, OSError):
+        return None
+    head = _read_head(binary)
+    if head is None or head[:2] != _get_stat(filename):
+        return None
+    return unpack(binary)
+
+
+def load(filename):
+    """ Return the data of the .mtt file at filename. """
+    data = _read_sidecar(filename)
+    if data is None:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+    return data
+
+
+def write_sidecar(filename, data):
+    """ Write the sidecar of the .mtt file at filename, which contains
+    data.
+    """
+    with open(filename + sidecar_extension, 'wb') as f:
+        f.write(pack(data, _get_stat(filename)))
+
+
+def save(filename, data):
+    """ Write data to the .mtt file at filename. An existing sidecar is
+    updated, too.
+    """
+    with open(filename, 'w') as f:
+        f.write(dumps(data))
+    if os.path.exists(filename + sidecar_extension):
+        write_sidecar(filename, data)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        # make the sidecars for batch processing
+        for filename in sys.argv[1:]:
+            with open(filename, 'r') as f:
+                write_sidecar(filename, json.load(f))
+    else:
+        print('Give me one or more mtt-filenames to write the sidecar files for.')
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, print_function, unicode_literals
+
+import math
+import time
+
+__all__ = ['RateController']
+
+# time.monotonic is not available in python 2
+_now = getattr(time, 'monotonic', time.time)
+
+
+class RateController(object):
+    """ Pace the rendering jobs of one client, like a widget displaying a
+    preview, by measuring the round trip time of its jobs.
+    
+    The estimate is a moving average of the time between starting a job
+    and receiving its result. It can be kept separately for different
+    kinds of jobs using the key arguments. From the estimate follows:
+        get_delay: how long to wait after a change before starting a job,
+                   so that a series of quick changes results in one job
+        get_max_in_flight: how many jobs may be running at once
+    No two jobs are started within min_interval seconds, can_start is False
+    until get_wait seconds passed.
+    
+    The class attributes can be changed to tune the behavior for the
+    hardware, get_estimate returns what was measured.
+    """
+    # seconds, the jobs are not started more often than 25 times a second
+    min_interval = 1 / 25
+    max_delay = 1.0
+    # the delay is this part of the estimated round trip time
+    delay_factor = 0.5
+    # jobs faster than this are pipelined, see get_max_in_flight
+    pipeline_latency = 0.15
+    # weight of a new measurement in the moving average
+    smoothing = 0.3
+    # used until the first job of a key finished, this was the fixed
+    # delay before
+    initial_estimate = 0.3
+    
+    def __init__(self):
+        # key => seconds
+        self._estimates = {}
+        # token => (key, start time)
+        self._jobs = {}
+        self._next_token = 0
+        self._newest_finished = -1
+        self._last_start = None
+    
+    def __repr__(self):
+        estimates = ', '.join('{0}: {1:.3f}s'.format(key, estimate)
+                              for key, estimate in self._estimates.items())
+        return '<RateController {{{0}}} in flight: {1}>'.format(estimates,
+                                                                self.in_flight)
+    
+    def get_estimate(self, key=None):
+        """ Return the estimated round trip time of a job in seconds """
+        return self._estimates.get(key, self.initial_estimate)
+    
+    def get_delay(self, key=None):
+        """ Return the seconds to wait after a change before starting a job """
+        delay = self.get_estimate(key) * self.delay_factor
+        delay = max(self.min_interval, min(self.max_delay, delay))
+        if self._last_start is not None:
+            delay = max(delay, self._last_start + self.min_interval - _now())
+        return delay
+    
+    @staticmethod
+    def _to_ms(seconds):
+        # rounded up, so a timeout does not end before the time passed
+        return int(math.ceil(round(seconds * 1000, 3)))
+    
+    def get_delay_ms(self, key=None):
+        """ get_delay in milliseconds, as used by GObject.timeout_add """
+        return self._to_ms(self.get_delay(key))
+    
+    def get_wait(self):
+        """ Return the seconds until min_interval passed since the last job
+        started, 0 if it passed already.
+        """
+        if self._last_start is None:
+            return 0
+        return max(0, self._last_start + self.min_interval - _now())
+    
+    def get_wait_ms(self):
+        """ get_wait in milliseconds, as used by GObject.timeout_add """
+        return self._to_ms(self.get_wait())
+    
+    def get_max_in_flight(self, key=None):
+        """ Return how many jobs may be running at once.
+        
+        Fast jobs are pipelined: the next job is rendered while the result
+        of the former job is transferred and displayed. Slow jobs would
+        just keep the workers busy with results that are outdated when
+        they arrive.
+        """
+        return 2 if self.get_estimate(key) < self.pipeline_latency else 1
+    
+    @property
+    def in_flight(self):
+        return len(self._jobs)
+    
+    def is_busy(self, key=None):
+        """ True if the maximum of jobs is running, see get_max_in_flight """
+        return self.in_flight >= self.get_max_in_flight(key)
+    
+    def can_start(self, key=None):
+        """ True if a job can start now: it is not busy and the last job
+        started min_interval seconds ago.
+        """
+        return not self.is_busy(key) and self.get_wait() == 0
+    
+    def start(self, key=None):
+        """ Register the start of a job and return a token for finish """
+        token = self._next_token
+        self._next_token += 1
+        now = _now()
+        self._jobs[token] = (key, now)
+        self._last_start = now
+        return token
+    
+    def finish(self, token):
+        """ Register the result of the job of token.
+        
+        Return True if the result is newer than all results finished
+        before, False if a job started later finished already, then
+        the result is outdated.
+        """
+        key, started = self._jobs.pop(token)
+        elapsed = _now() - started
+        estimate = self._estimates.get(key, None)
+        if estimate is None:
+            self._estimates[key] = elapsed
+        else:
+            self._estimates[key] = estimate + self.smoothing * (elapsed - estimate)
+        if token < self._newest_finished:
+            return False
+        self._newest_finished = token
+        return True
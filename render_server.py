@@ -0,0 +1,443 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" A local HTTP server that renders previews and EPS files without GTK.
+
+The worker processes with Ghostscript and the loaded images stay warm
+between the requests, so a request costs just the rendering.
+
+    POST /preview?image=<path>[&scale=<0..1>]   body: the .mtt JSON
+        returns the preview as PNG
+    POST /eps?image=<path>                      body: the .mtt JSON
+        returns the EPS file
+    GET /metrics
+        returns JSON with the number of requests and their latencies
+
+Errors are returned as JSON: {"error": message, "info": more info}
+A notice for an image, i.e. that it was converted to grayscale, is in
+the header X-Multitoner-Notice.
+
+The paths of the images are relative to the image root. Without an image
+root they can be any path, so everyone who can connect can render any
+image the server is allowed to read. That's why the server listens just
+on 127.0.0.1 by default.
+
+    python render_server.py [<port> [<image root>]]
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+import time
+import threading
+from io import BytesIO
+from collections import deque
+from multiprocessing import cpu_count
+try:
+    # python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    # python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import PIL.Image as Image
+
+from epstool import EPSTool
+from model import ModelCurves, ModelInk
+from ghostscript_workers import PreviewWorker
+
+__all__ = ['RenderError', 'Metrics', 'RenderService', 'RenderServer',
+           'make_server']
+
+# time.monotonic is not available in python 2
+_now = getattr(time, 'monotonic', time.time)
+
+# just a preparation for i18n
+def _(string):
+    return string
+
+
+class RenderError(Exception):
+    """ A request can't be answered. The arguments are the HTTP status,
+    the message and more info or None.
+    """
+    @property
+    def status(self):
+        return self.args[0]
+
+
+class Metrics(object):
+    """ Count the requests of each kind and keep the latencies of the
+    most recent ones. All methods can be called from any thread.
+    """
+    # number of latencies kept per kind of request
+    window = 1000
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        # kind => {'count': int, 'errors': int, 'latencies': deque}
+        self._requests = {}
+        self.rejected = 0
+        self.in_flight = 0
+    
+    def _get(self, kind):
+        if kind not in self._requests:
+            self._requests[kind] = {
+                'count': 0,
+                'errors': 0,
+                'latencies': deque(maxlen=self.window)
+            }
+        return self._requests[kind]
+    
+    def add(self, kind, seconds, error=False):
+        with self._lock:
+            data = self._get(kind)
+            data['count'] += 1
+            if error:
+                data['errors'] += 1
+            data['latencies'].append(seconds)
+    
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+    
+    @staticmethod
+    def _percentile(ordered, fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+    
+    def get_summary(self):
+        """ Return a dict that can be serialized as JSON, the latencies
+        are in milliseconds.
+        """
+        with self._lock:
+            requests = {}
+            for kind, data in self._requests.items():
+                ordered = sorted(data['latencies'])
+                summary = {'count': data['count'], 'errors': data['errors']}
+                if ordered:
+                    summary.update({
+                        'mean': sum(ordered) / len(ordered) * 1000,
+                        'p50': self._percentile(ordered, 0.5) * 1000,
+                        'p95': self._percentile(ordered, 0.95) * 1000,
+                        'max': ordered[-1] * 1000
+                    })
+                requests[kind] = summary
+            return {
+                'requests': requests,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight
+            }
+
+
+class RenderService(object):
+    """ Render previews and EPS files for many threads.
+    
+    preview_worker: an instance of PreviewWorker, its pool and its
+                    ImageCache are used for all requests
+    max_concurrent: the number of requests that are rendered at once,
+                    more are rejected
+    timeout: seconds to wait for the result of a worker
+    image_root: if not None only images in this directory can be used,
+                otherwise any image the process can read
+    """
+    def __init__(self, preview_worker, max_concurrent=4, timeout=60,
+                 image_root=None):
+        self.preview_worker = preview_worker
+        self.timeout = timeout
+        self.image_root = image_root and os.path.realpath(image_root)
+        self.metrics = Metrics()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        # PreviewWorker and ImageCache are not made for threads
+        self._lock = threading.Lock()
+        self._next_client_id = 0
+    
+    @classmethod
+    def new_with_pool(Cls, processes=None, **kwargs):
+        return Cls(PreviewWorker.new_with_pool(processes), **kwargs)
+    
+    def get_image_name(self, image_name):
+        """ Return the path of the image or raise RenderError """
+        if not image_name:
+            raise RenderError(400, _('The parameter "image" is missing.'), None)
+        path = os.path.realpath(image_name if self.image_root is None
+                                else os.path.join(self.image_root, image_name))
+        if self.image_root is not None \
+                and not path.startswith(self.image_root + os.sep):
+            raise RenderError(403, _('The image is not in the image root.'),
+                              image_name)
+        return path
+    
+    @staticmethod
+    def get_inks(profile):
+        """ Return the visible inks of profile, the data of a .mtt file,
+        or raise RenderError.
+        """
+        try:
+            model = ModelCurves(ChildModel=ModelInk, **profile)
+        except (TypeError, ValueError, KeyError, AttributeError) as e:
+            raise RenderError(400, _('The profile is not valid.'),
+                              '{0} {1}'.format(e, type(e)))
+        return model.visible_curves
+    
+    def _get_client_id(self):
+        with self._lock:
+            self._next_client_id += 1
+            return 'render-{0}'.format(self._next_client_id)
+    
+    def render_preview(self, profile, image_name, scale=1):
+        """ Return (width, height, rowstride, buf, notice) with the pixels
+        in the format of cairo.FORMAT_RGB24, like the PreviewWorker renders
+        them, or raise RenderError.
+        """
+        inks = self.get_inks(profile)
+        image_name = self.get_image_name(image_name)
+        client_id = self._get_client_id()
+        done = threading.Event()
+        results = []
+        def callback(*args):
+            results.append(args)
+            done.set()
+        with self._lock:
+            # an image that can't be loaded is the fault of the client
+            image, error = self.preview_worker.image_cache.get(image_name, scale)
+            if error is not None:
+                raise RenderError(400, *error[1:])
+            self.preview_worker.add_scaled_job(client_id, (callback, ),
+                                               image_name, scale, *inks)
+        try:
+            if not done.wait(self.timeout) and not results:
+                raise RenderError(504, _('Rendering took too long.'), None)
+        finally:
+            with self._lock:
+                self.preview_worker.remove_client(client_id)
+        result = results[0]
+        if result[0] != 'result':
+            raise RenderError(500, *result[1:])
+        return result[1:]
+    
+    def render_png(self, profile, image_name, scale=1):
+        """ Return (png, notice), png is bytes """
+        width, height, rowstride, buf, notice \
+                            = self.render_preview(profile, image_name, scale)
+        im = Image.frombuffer('RGB', (width, height), buf.raw, 'raw', 'BGRX',
+                              rowstride, 1)
+        png = BytesIO()
+        im.save(png, 'PNG')
+        return png.getvalue(), notice
+    
+    def render_eps(self, profile, image_name):
+        """ Return (eps, notice), eps is bytes """
+        inks = self.get_inks(profile)
+        image_name = self.get_image_name(image_name)
+        image_cache = self.preview_worker.image_cache
+        with self._lock:
+            image, error = image_cache.get(image_name)
+            if error is None:
+                # other threads may remove it from the cache meanwhile
+                image_cache.acquire(image)
+        if error is not None:
+            raise RenderError(400, *error[1:])
+        try:
+            eps_tool = EPSTool()
+            eps_tool.set_image_data(image.map(), image.size)
+            eps_tool.set_color_data(*inks)
+            eps = BytesIO()
+            eps_tool.write(eps)
+        finally:
+            image_cache.release(image)
+        return eps.getvalue(), image.notice
+    
+    def acquire(self):
+        """ Return False if max_concurrent requests are being rendered,
+        otherwise reserve a slot, which must be freed with release.
+        """
+        if not self._slots.acquire(False):
+            self.metrics.reject()
+            return False
+        with self._lock:
+            self.metrics.in_flight += 1
+        return True
+    
+    def release(self):
+        with self._lock:
+            self.metrics.in_flight -= 1
+        self._slots.release()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, clients can reuse the connection
+    protocol_version = 'HTTP/1.1'
+    
+    @property
+    def service(self):
+        return self.server.service
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+    
+    def _send(self, status, content_type, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_json(self, status, data, headers=()):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self._send(status, 'application/json', body, headers)
+    
+    def _read_profile(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            raise RenderError(400, _('The profile is not valid JSON.'),
+                              '{0}'.format(e))
+    
+    @staticmethod
+    def _get_scale(query):
+        try:
+            scale = float(query.get('scale', 1))
+        except ValueError:
+            scale = None
+        if scale is None or not 0 < scale <= 1:
+            raise RenderError(400, _('The scale must be a number between 0 and 1.'),
+                              query.get('scale'))
+        return scale
+    
+    def _send_error(self, error):
+        self._send_json(error.status, {'error': error.args[1],
+                                       'info': error.args[2]})
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            summary = self.service.metrics.get_summary()
+            summary['image_cache'] = self.service.preview_worker.image_cache\
+                                                        .get_memory_usage()
+            self._send_json(200, summary)
+        else:
+            self._send_json(404, {'error': _('Not found.'), 'info': url.path})
+    
+    def do_POST(self):
+        url = urlparse(self.path)
+        kind = url.path.strip('/')
+        if kind not in ('preview', 'eps'):
+            # the body must be read, the connection is kept alive
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self._send_json(404, {'error': _('Not found.'), 'info': url.path})
+            return
+        query = dict((key, values[-1]) for key, values
+                                        in parse_qs(url.query).items())
+        try:
+            profile = self._read_profile()
+            scale = self._get_scale(query)
+        except RenderError as e:
+            self._send_error(e)
+            return
+        if not self.service.acquire():
+            self._send_json(503, {'error': _('Too many requests.'), 'info': None},
+                            (('Retry-After', '1'), ))
+            return
+        start = _now()
+        error = None
+        try:
+            if kind == 'preview':
+                body, notice = self.service.render_png(profile,
+                                                query.get('image'), scale)
+                content_type = 'image/png'
+            else:
+                body, notice = self.service.render_eps(profile,
+                                                query.get('image'))
+                content_type = 'application/postscript'
+        except RenderError as e:
+            error = e
+        except Exception as e:
+            # the server keeps running and the client gets an answer
+            error = RenderError(500, _('Caught a Fatal Exception'),
+                                _('Message: {0} {1}').format(e, type(e)))
+        finally:
+            # before the answer, the client may send the next request
+            # as soon as it has it
+            self.service.metrics.add(kind, _now() - start, error is not None)
+            self.service.release()
+        if error is not None:
+            self._send_error(error)
+            return
+        headers = []
+        if notice is not None:
+            # JSON is ascii, as a header must be
+            headers.append(('X-Multitoner-Notice', json.dumps(notice[1:])))
+        self._send(200, content_type, body, headers)
+
+
+class RenderServer(ThreadingMixIn, HTTPServer):
+    """ Answer each request in its own thread with service, an instance
+    of RenderService.
+    """
+    daemon_threads = True
+    
+    def __init__(self, address, service, verbose=False):
+        HTTPServer.__init__(self, address, _RequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def make_server(host='127.0.0.1', port=8765, processes=None,
+                max_concurrent=None, image_root=None, verbose=False):
+    """ Return a RenderServer with a new worker pool. Use port 0 to get
+    a free port, it is server.server_address[1] then. See RenderService
+    for image_root.
+    """
+    preview_worker = PreviewWorker.new_with_pool(processes)
+    if max_concurrent is None:
+        # a request can wait for its result while another one is rendered
+        max_concurrent = (processes or cpu_count()) * 2
+    service = RenderService(preview_worker, max_concurrent=max_concurrent,
+                            image_root=image_root)
+    return RenderServer((host, port), service, verbose)
+
+
+if __name__ == '__main__':
+    import sys
+    port = 8765
+    image_root = None
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        image_root = sys.argv[2]
+    server = make_server(port=port, image_root=image_root, verbose=True)
+    print(_('Serving on http://{0}:{1}/').format(*server.server_address))
+    if image_root is None:
+        print(_('No image root given, any image this user can read can be rendered.'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
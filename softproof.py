@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Soft proofs that simulate how the inks print over each other.
+
+The DeviceN fallback of the EPS adds the CMYK values of the inks, which
+is wrong as soon as two inks overprint: a transparent ink filters the
+light that comes through the inks below it. Here each ink is a filter
+with the color of its solid on paper and the filters are multiplied.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import numpy as np
+import PIL.Image as Image
+
+from color_management import ColorTransform
+from mtt2eps import batch_convert, open_mtt_file
+
+__all__ = ['lab_to_linear_rgb', 'linear_to_srgb', 'srgb_to_linear',
+           'OverprintTransform', 'proof_image', 'batch_proof']
+
+# just a preparation for i18n
+def _(string):
+    return string
+
+
+# the white point of Lab in printing, D50
+_d50 = np.array([0.96422, 1.0, 0.82521])
+# Bradford adaptation from D50 to D65, the white point of sRGB
+_d50_to_d65 = np.array([
+    [ 0.9555766, -0.0230393,  0.0631636],
+    [-0.0282895,  1.0099416,  0.0210077],
+    [ 0.0122982, -0.0204830,  1.3299098]
+])
+_xyz_to_linear_rgb = np.array([
+    [ 3.2404542, -1.5371385, -0.4985314],
+    [-0.9692660,  1.8760108,  0.0415560],
+    [ 0.0556434, -0.2040259,  1.0572252]
+])
+
+
+def lab_to_linear_rgb(lab):
+    """ Convert CIE Lab (D50) to linear sRGB from 0 to 1, the last axis of
+    lab has L, a and b.
+    """
+    lab = np.asarray(lab, dtype=float)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.rollaxis(np.array([fy + lab[..., 1] / 500, fy,
+                              fy - lab[..., 2] / 200]), 0, lab.ndim)
+    xyz = np.where(f > 6 / 29, f ** 3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * _d50
+    rgb = xyz.dot(_d50_to_d65.T).dot(_xyz_to_linear_rgb.T)
+    return np.clip(rgb, 0, 1)
+
+
+def srgb_to_linear(rgb):
+    """ Remove the gamma of sRGB from 0 to 1 """
+    rgb = np.asarray(rgb, dtype=float)
+    return np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(rgb):
+    """ Apply the gamma of sRGB to linear RGB from 0 to 1 """
+    rgb = np.clip(rgb, 0, 1)
+    return np.where(rgb <= 0.0031308, rgb * 12.92,
+                    1.055 * rgb ** (1 / 2.4) - 0.055)
+
+
+class OverprintTransform(ColorTransform):
+    """ A ColorTransform that simulates overprinting inks.
+    
+    Each ink lets through a part of the light that the paper reflects, in
+    linear RGB that is the color of its solid divided by the color of the
+    paper. A tint lets through proportionally more (Murray-Davies) and
+    the inks printed over each other are multiplied.
+    
+    lab: a dict of ink name => (L, a, b), the measured color of the solid
+         ink on paper. The color of other inks is estimated from their
+         CMYK values, converted like ColorTransform does.
+    paper_lab: the measured color of the paper as (L, a, b), otherwise
+               it is estimated like the inks
+    The other arguments are the arguments of ColorTransform, they are used
+    for the estimated colors.
+    
+    It can be used as color_transform of a PreviewWorker.
+    """
+    def __init__(self, lab=None, paper_lab=None, cmyk_profile=None,
+                 rgb_profile=None, intent='perceptual'):
+        ColorTransform.__init__(self, cmyk_profile, rgb_profile, intent)
+        self.lab = dict(lab or {})
+        self.paper_lab = paper_lab
+    
+    def _estimate(self, amount, ink):
+        """ The linear RGB of ink in amount, with ColorTransform """
+        amounts = np.array([[amount]], dtype=np.uint8)
+        rgb = ColorTransform.get_rgb(self, amounts, ink)[0] / 255
+        return srgb_to_linear(rgb)
+    
+    def get_paper(self, *inks):
+        """ Return the linear RGB of the paper """
+        if self.paper_lab is not None:
+            return lab_to_linear_rgb(self.paper_lab)
+        if not inks:
+            return np.ones(3)
+        # no ink at all
+        return self._estimate(0, inks[0])
+    
+    def get_solid(self, ink):
+        """ Return the linear RGB of the solid ink on paper """
+        if ink.name in self.lab:
+            return lab_to_linear_rgb(self.lab[ink.name])
+        return self._estimate(255, ink)
+    
+    def get_rgb(self, amounts, *inks):
+        paper = self.get_paper(*inks)
+        # the part of the light reflected by the paper each ink lets through
+        filters = [np.clip(self.get_solid(ink) / np.maximum(paper, 1e-6), 0, 1)
+                   for ink in inks]
+        amounts = amounts / 255
+        rgb = np.ones(amounts.shape[:-1] + (3, )) * paper
+        for i, filter in enumerate(filters):
+            rgb *= 1 - amounts[..., i:i + 1] * (1 - filter)
+        return np.rint(linear_to_srgb(rgb) * 255).astype(np.uint8)
+
+
+def proof_image(transform, pixels, *inks):
+    """ Return a RGB PIL image of pixels, a numpy array of uint8 with the
+    shape (height, width) like load_gray returns, printed with inks as
+    transform, an instance of ColorTransform, predicts it.
+    """
+    table = transform.get_table(*inks)
+    # B G R unused => R G B
+    rgb = table[:, 2::-1].copy()
+    return Image.fromarray(transform.apply(rgb, pixels), 'RGB')
+
+
+def batch_proof(transform, model, jobs, prefetch=2, threads=None):
+    """ Like batch_model2eps but write a proof of each image, in a format
+    PIL guesses from the proof filename. Yield
+    (image_filename, proof_filename, result, message) for each job.
+    
+    jobs: an iterable of (image_filename, proof_filename) tuples
+    """
+    inks = model.visible_curves
+    def convert(pixels, proof_filename):
+        try:
+            proof_image(transform, pixels, *inks).save(proof_filename)
+        except (IOError, KeyError, ValueError) as e:
+            # KeyError or ValueError: PIL knows no format for the filename
+            return ('error'
+                   , _('Can\'t write the proof {0}.').format(proof_filename)
+                   , _('Message: {0} {1}').format(e, type(e))
+                   )
+        return None
+    return batch_convert(convert, jobs, prefetch, threads)
+
+
+if __name__ == '__main__':
+    import sys
+    import json
+    args = sys.argv[1:]
+    lab = paper_lab = None
+    if args and args[0].startswith('--lab='):
+        # {"paper": [L, a, b], "inks": {"ink name": [L, a, b], ...}}
+        with open(args.pop(0)[len('--lab='):]) as f:
+            measured = json.load(f)
+        lab = measured.get('inks')
+        paper_lab = measured.get('paper')
+    if len(args) >= 3 and len(args) % 2 == 1:
+        transform = OverprintTransform(lab, paper_lab)
+        model = open_mtt_file(args[0])
+        jobs = zip(args[1::2], args[2::2])
+        for image_filename, proof_filename, result, message \
+                        in batch_proof(transform, model, jobs):
+            print(image_filename, '=>', proof_filename)
+            if message is not None:
+                print('  ', message[0].title() + ':', *message[1:])
+    else:
+        print(_('Give me a mtt-filename and one or more pairs of source image-filename, destination proof-filename (i.e. .png)'))
+        print(_('Optionally first --lab=<json-filename> with the measured Lab colors of the inks'))
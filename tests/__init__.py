@@ -0,0 +1,2 @@
+# Run the tests from the root directory of Multitoner:
+#     python -m unittest discover -s tests -t .
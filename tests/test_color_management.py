@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import struct
+import shutil
+import tempfile
+import itertools
+import unittest
+
+import numpy as np
+
+from model import ModelCurves, ModelInk
+from color_management import ColorManagementError, ColorTransform, \
+                             ImageCms, mix_cmyk, cmyk_to_rgb
+
+
+def _s15_fixed16(value):
+    return struct.pack(str('>i'), int(round(value * 0x10000)))
+
+
+def make_cmyk_profile():
+    """ Return the bytes of a minimal ICC profile of a CMYK press, which
+    prints gray. The lightness of a mix is (1 - 0.3C - 0.5M - 0.1Y) * (1 - K)
+    at the corners of its lookup table.
+    """
+    def pack(format, *values):
+        return struct.pack(str(format), *values)
+    white_point = _s15_fixed16(0.9642) + _s15_fixed16(1) + _s15_fixed16(0.8249)
+    text = b'Test CMYK\0'
+    desc = b'desc' + b'\0' * 4 + pack('>I', len(text)) + text \
+         + pack('>IIHB', 0, 0, 0, 0) + b'\0' * 67
+    wtpt = b'XYZ ' + b'\0' * 4 + white_point
+    lut = b''
+    for c, m, y, k in itertools.product((0, 1), repeat=4):
+        lightness = (1 - 0.3 * c - 0.5 * m - 0.1 * y) * (1 - k)
+        # Lab, a and b are 0
+        lut += pack('>HHH', int(lightness * 0xFF00), 0x8000, 0x8000)
+    # lut16Type: 4 inputs, 3 outputs, 2 grid points, identity matrix,
+    # linear input and output tables
+    a2b0 = b'mft2' + b'\0' * 4 + pack('>BBBB', 4, 3, 2, 0) \
+         + b''.join(_s15_fixed16(v) for v in (1, 0, 0, 0, 1, 0, 0, 0, 1)) \
+         + pack('>HH', 2, 2) + pack('>HH', 0, 0xFFFF) * 4 \
+         + lut + pack('>HH', 0, 0xFFFF) * 3
+    tags = [(b'desc', desc), (b'wtpt', wtpt), (b'A2B0', a2b0)]
+    offset = 128 + 4 + 12 * len(tags)
+    table = pack('>I', len(tags))
+    data = b''
+    for signature, tag in tags:
+        tag += b'\0' * (-len(tag) % 4)
+        table += signature + pack('>II', offset + len(data), len(tag))
+        data += tag
+    header = pack('>I', offset + len(data)) + b'\0' * 4 \
+           + pack('>I', 0x02100000) + b'prtrCMYKLab ' + b'\0' * 12 \
+           + b'acsp' + b'\0' * 28 + white_point + b'\0' * 48
+    return header + table + data
+
+
+def make_inks(*cmyks):
+    return ModelCurves(ChildModel=ModelInk, curves=[
+        {'name': 'Ink {0}'.format(i), 'cmyk': cmyk, 'points': [(0, 0), (1, 1)]}
+        for i, cmyk in enumerate(cmyks)]).curves
+
+
+class NaiveTestCase(unittest.TestCase):
+    def test_mix_cmyk(self):
+        inks = make_inks((0, 0, 0, 1), (0.5, 0.5, 0, 0))
+        amounts = np.array([[0, 0], [255, 0], [255, 255]], dtype=np.uint8)
+        self.assertEqual(mix_cmyk(amounts, *inks).tolist(),
+                         [[0, 0, 0, 0], [0, 0, 0, 1], [0.5, 0.5, 0, 1]])
+    
+    def test_cmyk_to_rgb(self):
+        cmyk = np.array([[0, 0, 0, 0], [0.25, 0.5, 0, 0.25], [0, 0, 0, 1]])
+        self.assertEqual(cmyk_to_rgb(cmyk).tolist(),
+                         [[1, 1, 1], [0.5, 0.25, 0.75], [0, 0, 0]])
+    
+    def test_table(self):
+        transform = ColorTransform()
+        self.assertFalse(transform.is_color_managed)
+        table = transform.get_table(*make_inks((0, 0, 0, 1)))
+        self.assertEqual(table.shape, (256, 4))
+        # B G R unused, from black to white
+        self.assertEqual(table[0].tolist(), [0, 0, 0, 0])
+        self.assertEqual(table[255].tolist(), [255, 255, 255, 0])
+        self.assertIs(transform.get_table(*make_inks((0, 0, 0, 1))), table)
+
+
+@unittest.skipIf(ImageCms is None, 'PIL has no ImageCms')
+class ManagedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profile = os.path.join(self.directory, 'press.icc')
+        with open(self.profile, 'wb') as f:
+            f.write(make_cmyk_profile())
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_get_rgb(self):
+        transform = ColorTransform(self.profile)
+        self.assertTrue(transform.is_color_managed)
+        inks = make_inks((0, 0, 0, 1), (1, 0, 0, 0))
+        amounts = np.array([[[0, 0], [0, 255]], [[255, 0], [128, 0]]],
+                           dtype=np.uint8)
+        rgb = transform.get_rgb(amounts, *inks)
+        self.assertEqual(rgb.shape, (2, 2, 3))
+        self.assertEqual(rgb.dtype, np.uint8)
+        # paper white, the profile prints gray
+        self.assertEqual(rgb[0, 0].tolist(), [255, 255, 255])
+        self.assertEqual(rgb[1, 0].tolist(), [0, 0, 0])
+        self.assertEqual(len(set(rgb[0, 1].tolist())), 1)
+        self.assertTrue(0 < rgb[1, 1, 0] < rgb[0, 1, 0] < 255)
+    
+    def test_table(self):
+        transform = ColorTransform(self.profile, intent='relative')
+        table = transform.get_table(*make_inks((0, 0, 0, 1)))
+        self.assertEqual(table.shape, (256, 4))
+        self.assertEqual(table[255].tolist(), [255, 255, 255, 0])
+        self.assertEqual(table[0].tolist(), [0, 0, 0, 0])
+        # from black to white
+        self.assertTrue(np.all(np.diff(table[:, 0].astype(int)) >= 0))
+    
+    def test_not_a_profile(self):
+        filename = os.path.join(self.directory, 'nothing.icc')
+        with open(filename, 'wb') as f:
+            f.write(b'not a profile')
+        self.assertRaises(ColorManagementError, ColorTransform, filename)
+        self.assertRaises(ColorManagementError, ColorTransform,
+                          os.path.join(self.directory, 'missing.icc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
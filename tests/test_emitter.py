@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import emitter
+from emitter import Emitter, set_scheduler, flush_deferred
+
+
+class Subscriber(object):
+    def __init__(self):
+        self.calls = []
+    
+    def on_event(self, *args):
+        self.calls.append(args)
+
+
+class Source(Emitter):
+    def trigger(self, name, *args):
+        self._emit('on_event', (self, name) + args, (name, ))
+
+
+class TestEmitter(unittest.TestCase):
+    def setUp(self):
+        self.scheduled = []
+        set_scheduler(None)
+    
+    def tearDown(self):
+        set_scheduler(None)
+        flush_deferred()
+    
+    def test_all_events(self):
+        source = Source()
+        subscriber = Subscriber()
+        source.add(subscriber)
+        source.trigger('a', 1)
+        source.trigger('b')
+        self.assertEqual(subscriber.calls, [(source, 'a', 1), (source, 'b')])
+    
+    def test_filter(self):
+        source = Source()
+        subscriber = Subscriber()
+        source.add(subscriber, events=['b'])
+        source.trigger('a')
+        source.trigger('b')
+        self.assertEqual(subscriber.calls, [(source, 'b')])
+        # subscribing again replaces the filter
+        source.add(subscriber)
+        source.trigger('a')
+        self.assertEqual(subscriber.calls[-1], (source, 'a'))
+    
+    def test_remove(self):
+        source = Source()
+        subscriber = Subscriber()
+        source.add(subscriber)
+        source.remove(subscriber)
+        source.trigger('a')
+        self.assertEqual(subscriber.calls, [])
+        self.assertRaises(KeyError, source.remove, subscriber)
+        source.discard(subscriber)
+    
+    def test_deferred_without_scheduler(self):
+        source = Source()
+        subscriber = Subscriber()
+        source.add(subscriber, deferred=True)
+        source.trigger('a')
+        self.assertEqual(subscriber.calls, [(source, 'a')])
+    
+    def test_deferred(self):
+        set_scheduler(self.scheduled.append)
+        source = Source()
+        deferred = Subscriber()
+        immediate = Subscriber()
+        source.add(deferred, deferred=True)
+        source.add(immediate)
+        source.trigger('a', 1)
+        source.trigger('b')
+        source.trigger('a', 1)
+        source.trigger('c', [1, 2])
+        source.trigger('c', [1, 2])
+        self.assertEqual(len(immediate.calls), 5)
+        self.assertEqual(deferred.calls, [])
+        # scheduled just once
+        self.assertEqual(self.scheduled, [flush_deferred])
+        self.assertFalse(flush_deferred())
+        # duplicates are delivered once, in the order of the latest
+        # occurrence, unhashable arguments are not collapsed
+        self.assertEqual(deferred.calls, [(source, 'b'), (source, 'a', 1),
+                                          (source, 'c', [1, 2]),
+                                          (source, 'c', [1, 2])])
+    
+    def test_deferred_unsubscribed(self):
+        set_scheduler(self.scheduled.append)
+        source = Source()
+        subscriber = Subscriber()
+        source.add(subscriber, deferred=True)
+        source.trigger('a')
+        source.discard(subscriber)
+        flush_deferred()
+        self.assertEqual(subscriber.calls, [])
+        self.assertEqual(len(emitter._deferred), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
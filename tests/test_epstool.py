@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+from epstool import EPSTool, get_device_n_table, get_gradients_table
+from model import ModelInk
+
+
+def make_inks():
+    return [ModelInk(name='Cyan', cmyk=(1, 0, 0, 0),
+                     points=[(0, 0), (0.5, 0.8), (1, 0)]),
+            ModelInk(name='Black', cmyk=(0, 0, 0, 1), points=[(0, 0), (1, 1)]),
+            ModelInk(name='Yellow', cmyk=(0, 0, 1, 0), visible=False)]
+
+
+class GradientsTableTestCase(unittest.TestCase):
+    def test_rows(self):
+        inks = make_inks()
+        table = get_device_n_table(*inks)
+        rows = get_gradients_table(*inks)
+        self.assertEqual(rows.shape, (4, 256, 3))
+        self.assertEqual(rows.dtype, np.uint8)
+        # a row for each ink alone
+        for i in range(3):
+            expected = np.zeros((256, 3), dtype=np.uint8)
+            expected[:, i] = table[:, i]
+            np.testing.assert_array_equal(rows[i], expected)
+        # and one for the visible inks together
+        expected = table.copy()
+        expected[:, 2] = 0
+        np.testing.assert_array_equal(rows[3], expected)
+    
+    def test_black_to_white(self):
+        black = make_inks()[1]
+        rows = get_gradients_table(black)
+        self.assertEqual((rows[0, 0, 0], rows[0, -1, 0]), (255, 0))
+    
+    def test_set_gradients_data(self):
+        inks = make_inks()
+        eps_tool = EPSTool()
+        eps_tool.set_gradients_data(*inks)
+        eps = eps_tool.create()
+        self.assertIn(b'/rows 4 def', eps)
+        self.assertIn(b'/cols 256 def', eps)
+        self.assertIn(b'/Decode [0 1 0 1 0 1] def', eps)
+
+
+if __name__ == '__main__':
+    unittest.main()
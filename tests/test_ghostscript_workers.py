@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+try:
+    from ghostscript_workers import GradientWorker, render_gradients
+except RuntimeError:
+    # the Ghostscript library is not installed
+    GradientWorker = None
+
+from epstool import get_device_n_table
+from model import ModelInk
+
+
+def make_inks(visible=True):
+    return [ModelInk(name='Cyan', cmyk=(1, 0, 0, 0),
+                     points=[(0, 0), (0.5, 0.8), (1, 0)], visible=visible),
+            ModelInk(name='Black', cmyk=(0, 0, 0, 1), points=[(0, 0), (1, 1)])]
+
+
+def get_rgb(result):
+    """ The RGB pixels of a result with the cairo.FORMAT_RGB24 layout """
+    width, height, rowstride, data = result[1:]
+    pixels = np.frombuffer(bytes(data), dtype=np.uint8)
+    pixels = pixels[:height * rowstride].reshape(height, rowstride // 4, 4)
+    return pixels[:, :width, 2::-1]
+
+
+@unittest.skipIf(GradientWorker is None, 'needs the Ghostscript library')
+class RenderGradientsTestCase(unittest.TestCase):
+    def test_device_n_table(self):
+        inks = make_inks()
+        result = render_gradients(*inks)
+        self.assertEqual(result[:4], ('result', 256, 3, 256 * 4))
+        cyan, black = (get_device_n_table(*inks) / 255).T
+        white = np.ones(256)
+        expected = np.array([
+            # each ink alone
+            [1 - cyan, white, white],
+            [1 - black, 1 - black, 1 - black],
+            # both inks together
+            [1 - np.minimum(1, cyan + black), 1 - black, 1 - black]
+        ]).transpose(0, 2, 1)
+        np.testing.assert_array_equal(get_rgb(result),
+                                      np.rint(expected * 255).astype(np.uint8))
+    
+    def test_gradients_job(self):
+        # InkGradients relies on one job with a row for each ink and
+        # a last row with all visible inks
+        inks = make_inks(visible=False)
+        received = []
+        def callback(*args):
+            received.append(args)
+        GradientWorker(None).add_gradients_job((callback, 'data'), *inks)
+        self.assertEqual(len(received), 1)
+        user_data, width, height, rowstride, buf = received[0]
+        self.assertEqual((user_data, width, height, rowstride),
+                         ('data', 256, 3, 256 * 4))
+        rgb = get_rgb(('result', width, height, rowstride, buf.raw))
+        # the invisible cyan ink is not in the last row
+        np.testing.assert_array_equal(rgb[2], rgb[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
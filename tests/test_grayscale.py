@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import PIL.Image as Image
+
+from grayscale import normalize, get_cache_filename, read_cache, write_cache
+
+
+def make_rgb():
+    pixels = np.arange(16 * 8 * 3, dtype=np.uint32).reshape(8, 16, 3) * 7 % 256
+    return Image.fromarray(pixels.astype(np.uint8), 'RGB')
+
+
+class NormalizeTestCase(unittest.TestCase):
+    def test_like_pil(self):
+        im = make_rgb()
+        expected = np.asarray(im.convert('L'))
+        pixels = normalize(im)
+        self.assertEqual(pixels.dtype, np.uint8)
+        self.assertTrue(np.array_equal(pixels, expected))
+    
+    def test_gray(self):
+        pixels = np.arange(256, dtype=np.uint8).reshape(16, 16)
+        self.assertTrue(np.array_equal(normalize(Image.fromarray(pixels)), pixels))
+    
+    def test_depth_16(self):
+        pixels = np.array([[0, 1, 128, 255]], dtype=np.uint8)
+        result = normalize(Image.fromarray(pixels), depth=16)
+        self.assertEqual(result.dtype, np.uint16)
+        self.assertEqual(result.tolist(), [[0, 0x101, 0x8080, 0xFFFF]])
+    
+    def test_weights(self):
+        im = Image.new('RGB', (1, 1), (0, 255, 0))
+        self.assertEqual(normalize(im, 'rec601')[0, 0], 150)
+        self.assertEqual(normalize(im, 'rec709')[0, 0], 182)
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'image.png')
+        make_rgb().save(self.filename)
+        self.pixels = normalize(Image.open(self.filename))
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_no_cache(self):
+        self.assertIsNone(read_cache(self.filename))
+    
+    def test_write_and_read(self):
+        mapped = write_cache(self.filename, self.pixels, 'RGB')
+        self.assertTrue(np.array_equal(mapped, self.pixels))
+        self.assertTrue(os.path.exists(get_cache_filename(self.filename)))
+        pixels, mode = read_cache(self.filename)
+        self.assertEqual(mode, 'RGB')
+        self.assertTrue(np.array_equal(pixels, self.pixels))
+    
+    def test_depth_16(self):
+        pixels = normalize(Image.open(self.filename), depth=16)
+        write_cache(self.filename, pixels, 'RGB', depth=16)
+        self.assertIsNone(read_cache(self.filename))
+        cached, mode = read_cache(self.filename, depth=16)
+        self.assertTrue(np.array_equal(cached, pixels))
+    
+    def test_changed_image(self):
+        write_cache(self.filename, self.pixels, 'RGB')
+        Image.new('RGB', (3, 3)).save(self.filename)
+        self.assertIsNone(read_cache(self.filename))
+    
+    def test_touched_image(self):
+        write_cache(self.filename, self.pixels, 'RGB')
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(read_cache(self.filename))
+    
+    def test_truncated_cache(self):
+        write_cache(self.filename, self.pixels, 'RGB')
+        cache_filename = get_cache_filename(self.filename)
+        with open(cache_filename, 'r+b') as f:
+            f.truncate(os.path.getsize(cache_filename) - 1)
+        self.assertIsNone(read_cache(self.filename))
+    
+    def test_threads(self):
+        # each thread writes its own temporary file
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda i: write_cache(self.filename, self.pixels, 'RGB'),
+                               range(32))
+        finally:
+            pool.close()
+            pool.join()
+        for mapped in results:
+            self.assertTrue(np.array_equal(mapped, self.pixels))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['image.png',
+                                 os.path.basename(get_cache_filename(self.filename))]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+from model import ModelCurves, ModelInk
+from history import History
+
+
+def make_model(**history_args):
+    model = ModelCurves(ChildModel=ModelInk, curves=[
+        {'name': 'Black', 'points': [(0, 0), (0.5, 0.4), (1, 1)]},
+        {'name': 'Red', 'cmyk': (0, 1, 1, 0)}
+    ])
+    history = History(model, **history_args)
+    return model, history
+
+
+def get_commands(history):
+    return [command for path, command in history._undo_commands]
+
+
+class TestCommands(unittest.TestCase):
+    def test_immutable_values_are_not_pickled(self):
+        model, history = make_model()
+        ink = model.curves[0]
+        ink.name = 'Gray'
+        ink.points = [(0, 0.1), (1, 0.9)]
+        point = ink.points[0]
+        point.xy = (0.1, 0.2)
+        ink.remove_point(point)
+        model.curves = [{'name': 'Cyan'}]
+        model.remove_curve(model.curves[0])
+        for command in get_commands(history):
+            self.assertFalse(command._pickled, command)
+    
+    def test_undo_points_keeps_ids(self):
+        model, history = make_model()
+        ink = model.curves[0]
+        point = ink.points[1]
+        point_id = point.id
+        point.xy = (0.6, 0.5)
+        ink.points = [(0, 0), (1, 0.5)]
+        history.undo()
+        self.assertEqual(ink.points_value, [(0, 0), (0.6, 0.5), (1, 1)])
+        # the history refers to the point by its id
+        self.assertEqual(ink.get_by_id(point_id).xy, (0.6, 0.5))
+        history.undo()
+        self.assertEqual(ink.get_by_id(point_id).xy, (0.5, 0.4))
+        history.redo()
+        history.redo()
+        self.assertEqual(ink.points_value, [(0, 0), (1, 0.5)])
+    
+    def test_undo_curves_keeps_ids(self):
+        model, history = make_model()
+        ids = model.ids
+        ink = model.curves[0]
+        ink.points[0].xy = (0, 0.2)
+        args = model.get_args()
+        model.curves = [{'name': 'Cyan'}]
+        model.remove_curve(model.curves[0])
+        history.undo()
+        history.undo()
+        self.assertEqual(model.ids, ids)
+        self.assertEqual(model.get_args(), args)
+        # the point of the undo entry is found again
+        history.undo()
+        self.assertEqual(model.curves[0].points_value[0], (0, 0))
+    
+    def test_undo_remove_point(self):
+        model, history = make_model()
+        ink = model.curves[0]
+        point = ink.points[1]
+        ink.remove_point(point)
+        history.undo()
+        self.assertEqual(ink.get_by_id(point.id).xy, (0.5, 0.4))
+
+
+class TestLimits(unittest.TestCase):
+    def test_max_depth(self):
+        model, history = make_model(max_depth=3)
+        ink = model.curves[0]
+        for i in range(10):
+            ink.name = 'Ink {0}'.format(i)
+        self.assertEqual(history.get_counts(), (3, 0))
+        for i in range(3):
+            history.undo()
+        self.assertEqual(ink.name, 'Ink 6')
+    
+    def test_memory_usage(self):
+        model, history = make_model()
+        self.assertEqual(history.get_memory_usage(), 0)
+        model.curves[0].name = 'Gray'
+        usage = history.get_memory_usage()
+        self.assertGreater(usage, 0)
+        history.undo()
+        self.assertEqual(history.get_counts(), (0, 1))
+        self.assertGreater(history.get_memory_usage(), 0)
+        # a new change drops the redo entries
+        model.curves[0].name = 'Blue'
+        self.assertEqual(history.get_memory_usage(), usage)
+    
+    def test_memory_budget(self):
+        model, history = make_model(memory_budget=4096)
+        ink = model.curves[0]
+        for i in range(100):
+            ink.name = 'Ink {0}'.format(i)
+        self.assertLessEqual(history.get_memory_usage(), 4096)
+        undos = history.get_counts()[0]
+        self.assertTrue(0 < undos < 100)
+    
+    def test_newest_entry_is_kept(self):
+        model, history = make_model(memory_budget=1)
+        ink = model.curves[0]
+        ink.name = 'Gray'
+        model.curves = [{'name': 'Cyan'}]
+        self.assertEqual(history.get_counts(), (1, 0))
+        history.undo()
+        self.assertEqual(history.get_counts(), (0, 1))
+        self.assertEqual([curve.name for curve in model.curves], ['Gray', 'Red'])
+        history.redo()
+        self.assertEqual([curve.name for curve in model.curves], ['Cyan'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import PIL.Image as Image
+
+from image_cache import ImageCache
+
+
+class ImageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image_name = os.path.join(self.directory, 'image.png')
+        pixels = np.arange(64 * 64, dtype=np.uint32).reshape(64, 64) % 256
+        Image.fromarray(pixels.astype(np.uint8)).save(self.image_name)
+        # a quarter of the image fits, 32 * 32 pixels
+        self.cache = ImageCache(self.directory, memory_budget=1024)
+    
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+    
+    def test_get(self):
+        image, error = self.cache.get(self.image_name, 0.5)
+        self.assertIsNone(error)
+        self.assertEqual(image.size, (32, 32))
+        self.assertEqual(image.map().shape, (32, 32))
+        self.assertIs(self.cache.get(self.image_name, 0.5)[0], image)
+        self.assertEqual(self.cache.get_memory_usage(), 32 * 32)
+    
+    def test_missing_image(self):
+        image, error = self.cache.get(os.path.join(self.directory, 'nothing.png'))
+        self.assertIsNone(image)
+        self.assertEqual(error[0], 'error')
+    
+    def test_remove_unused(self):
+        image = self.cache.get(self.image_name, 0.5)[0]
+        self.cache.get(self.image_name, 0.25)
+        self.cache.get(self.image_name, 0.125)
+        self.assertFalse(os.path.exists(image.filename))
+        self.assertLessEqual(self.cache.get_memory_usage(), 1024)
+    
+    def test_keep_acquired(self):
+        image = self.cache.get(self.image_name, 0.5)[0]
+        self.cache.acquire(image)
+        self.cache.acquire(image)
+        self.cache.get(self.image_name, 0.25)
+        self.cache.get(self.image_name, 0.125)
+        # removed from the cache, but a job still uses it
+        self.assertIsNot(self.cache.get(self.image_name, 0.5)[0], image)
+        self.assertTrue(os.path.exists(image.filename))
+        self.cache.release(image)
+        self.assertTrue(os.path.exists(image.filename))
+        self.cache.release(image)
+        self.assertFalse(os.path.exists(image.filename))
+    
+    def test_release_cached(self):
+        image = self.cache.get(self.image_name, 0.5)[0]
+        self.cache.acquire(image)
+        self.cache.release(image)
+        self.assertTrue(os.path.exists(image.filename))
+        self.assertIs(self.cache.get(self.image_name, 0.5)[0], image)
+    
+    def test_clear(self):
+        image = self.cache.get(self.image_name, 0.5)[0]
+        self.cache.clear()
+        self.assertFalse(os.path.exists(image.filename))
+        self.assertEqual(self.cache.get_memory_usage(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
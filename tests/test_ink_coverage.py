@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import PIL.Image as Image
+
+from model import ModelCurves, ModelInk
+from ink_coverage import get_histogram, HistogramCache, Coverage
+
+
+def make_inks():
+    return ModelCurves(ChildModel=ModelInk, curves=[
+        {'name': 'Black', 'cmyk': (0, 0, 0, 1), 'points': [(0, 0), (1, 1)]},
+        {'name': 'Solid', 'cmyk': (0, 0, 1, 0), 'points': [(0, 1), (1, 1)]}
+        ]).curves
+
+
+class CoverageTestCase(unittest.TestCase):
+    def test_get_histogram(self):
+        pixels = np.array([[0, 0, 1], [255, 0, 1]], dtype=np.uint8)
+        histogram = get_histogram(pixels)
+        self.assertEqual(len(histogram), 256)
+        self.assertEqual((histogram[0], histogram[1], histogram[255]), (3, 2, 1))
+        self.assertEqual(histogram.sum(), 6)
+    
+    def test_coverage(self):
+        histogram = np.zeros(256, dtype=np.int64)
+        # one black pixel, three white ones
+        histogram[0] = 1
+        histogram[255] = 3
+        coverage = Coverage(histogram, *make_inks())
+        self.assertEqual(coverage.names, ['Black', 'Solid'])
+        self.assertEqual(coverage.mean.tolist(), [25, 100])
+        self.assertEqual(coverage.max.tolist(), [100, 100])
+        self.assertEqual(coverage.tac_mean, 125)
+        self.assertEqual(coverage.tac_max, 200)
+        self.assertEqual(coverage.get_area_over(150), 25)
+        self.assertEqual(coverage.get_area_over(200), 0)
+    
+    def test_warnings(self):
+        histogram = np.zeros(256, dtype=np.int64)
+        histogram[0] = 1
+        coverage = Coverage(histogram, *make_inks())
+        self.assertEqual(coverage.get_warnings(), [])
+        warnings = coverage.get_warnings(tac_limit=150, ink_limit=90)
+        self.assertEqual([warning[0] for warning in warnings], ['warning'] * 3)
+        self.assertIn('Black', warnings[1][1])
+    
+    def test_empty_image(self):
+        coverage = Coverage(np.zeros(256, dtype=np.int64), *make_inks())
+        self.assertEqual(coverage.mean.tolist(), [0, 0])
+        self.assertEqual(coverage.tac_max, 0)
+        self.assertEqual(coverage.get_area_over(0), 0)
+        self.assertEqual(coverage.get_summary()['tac_mean'], 0)
+
+
+class HistogramCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+        for value in range(3):
+            filename = os.path.join(self.directory, '{0}.png'.format(value))
+            Image.new('L', (4, 2), value).save(filename)
+            self.filenames.append(filename)
+        self.missing = os.path.join(self.directory, 'missing.png')
+        self.cache = HistogramCache()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_get(self):
+        histogram, error = self.cache.get(self.filenames[1])
+        self.assertIsNone(error)
+        self.assertEqual(histogram[1], 8)
+        self.assertIs(self.cache.get(self.filenames[1])[0], histogram)
+        histogram, error = self.cache.get(self.missing)
+        self.assertIsNone(histogram)
+        self.assertEqual(error[0], 'error')
+    
+    def test_iter_histograms(self):
+        cached = self.cache.get(self.filenames[1])[0]
+        filenames = [self.filenames[0], self.missing, self.filenames[1],
+                     self.filenames[2], self.filenames[0]]
+        results = list(self.cache.iter_histograms(filenames, prefetch=1))
+        self.assertEqual([result[0] for result in results], filenames)
+        self.assertIs(results[2][1], cached)
+        self.assertEqual(results[1][1:2], (None, ))
+        self.assertEqual(results[1][2][0], 'error')
+        for index, value in ((0, 0), (2, 1), (3, 2), (4, 0)):
+            self.assertIsNone(results[index][2])
+            self.assertEqual(results[index][1][value], 8)
+    
+    def test_least_recently_used(self):
+        self.cache.max_histograms = 2
+        first = self.cache.get(self.filenames[0])[0]
+        self.cache.get(self.filenames[1])
+        # using the first one again keeps it in the cache
+        list(self.cache.iter_histograms([self.filenames[0]]))
+        self.cache.get(self.filenames[2])
+        self.assertIs(self.cache.get(self.filenames[0])[0], first)
+        self.assertEqual(len(self.cache._histograms), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from model import ModelCurves, ModelInk
+from history import History
+from journal import Journal, DocumentJournal
+
+
+def make_state(*names):
+    return {'curves': [{'name': name, 'points': [[0, 0], [1, 1]]}
+                       for name in names]}
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'profile.mtt')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    @property
+    def journal_filename(self):
+        return Journal.get_filename(self.filename)
+
+
+class TestJournal(JournalTestCase):
+    def test_revisions(self):
+        journal = Journal.for_document(self.filename)
+        journal.snapshot_interval = 3
+        states = [make_state('Black', *['Ink {0}'.format(j) for j in range(i)])
+                  for i in range(10)]
+        for i, state in enumerate(states):
+            self.assertEqual(journal.append(state, saved=i == 0), i)
+        # no new revision without a change
+        self.assertEqual(journal.append(states[-1]), 9)
+        journal.close()
+        
+        journal = Journal.for_document(self.filename)
+        self.assertEqual(len(journal), 10)
+        self.assertEqual(journal.saved_revision, 0)
+        for i, state in enumerate(states):
+            self.assertEqual(journal.get_state(i), state)
+        self.assertEqual(journal.get_state(-1), states[-1])
+        self.assertRaises(IndexError, journal.get_state, 10)
+        journal.close()
+    
+    def test_unchanged_curves_are_not_repeated(self):
+        journal = Journal.for_document(self.filename)
+        journal.append(make_state('Black', 'Red', 'Blue'), saved=True)
+        journal.append(make_state('Black', 'Red', 'Blue', 'Yellow'))
+        journal.close()
+        with open(self.journal_filename, 'rb') as f:
+            last = f.read().splitlines()[-1]
+        self.assertEqual(last.count(b'"name"'), 1)
+    
+    def test_incomplete_line_is_cut(self):
+        journal = Journal.for_document(self.filename)
+        journal.append(make_state('Black'), saved=True)
+        journal.append(make_state('Red'))
+        journal.close()
+        size = os.path.getsize(self.journal_filename)
+        with open(self.journal_filename, 'ab') as f:
+            f.write(b'{"diff":{"curves":[{"na')
+        
+        journal = Journal.for_document(self.filename)
+        self.assertEqual(len(journal), 2)
+        self.assertEqual(os.path.getsize(self.journal_filename), size)
+        journal.append(make_state('Blue'))
+        self.assertEqual(journal.get_state(-1), make_state('Blue'))
+        journal.close()
+    
+    def test_attach_recovers(self):
+        journal = Journal.for_document(self.filename)
+        self.assertEqual(journal.attach(make_state('Black')),
+                         (make_state('Black'), False))
+        journal.append(make_state('Red'))
+        journal.close()
+        
+        journal = Journal.for_document(self.filename)
+        self.assertEqual(journal.attach(make_state('Black')),
+                         (make_state('Red'), True))
+        journal.close()
+    
+    def test_attach_other_document(self):
+        journal = Journal.for_document(self.filename)
+        journal.attach(make_state('Black'))
+        journal.append(make_state('Red'))
+        journal.close()
+        
+        # the document was changed by another program
+        journal = Journal.for_document(self.filename)
+        self.assertEqual(journal.attach(make_state('Blue')),
+                         (make_state('Blue'), False))
+        self.assertEqual(len(journal), 1)
+        journal.close()
+    
+    def test_attach_broken_line(self):
+        with open(self.journal_filename, 'wb') as f:
+            f.write(b'{"saved":{"curves":[]}}\n[1, 2]\n')
+        journal = Journal.for_document(self.filename)
+        self.assertEqual(journal.attach(make_state('Black')),
+                         (make_state('Black'), False))
+        self.assertEqual(len(journal), 1)
+        journal.close()
+
+
+class TestDocumentJournal(JournalTestCase):
+    def test_no_file_without_changes(self):
+        document_journal = DocumentJournal(self.filename, make_state('Black'))
+        self.assertEqual(document_journal.recover(), (make_state('Black'), False))
+        document_journal.close()
+        self.assertFalse(os.path.exists(self.journal_filename))
+        
+        document_journal.save(make_state('Black'), self.filename)
+        document_journal.close()
+        self.assertFalse(os.path.exists(self.journal_filename))
+    
+    def test_file_on_first_change(self):
+        document_journal = DocumentJournal(self.filename, make_state('Black'))
+        document_journal.recover()
+        document_journal.append(make_state('Red'))
+        self.assertTrue(os.path.exists(self.journal_filename))
+        # a crash, the journal is not closed
+        
+        document_journal = DocumentJournal(self.filename, make_state('Black'))
+        self.assertEqual(document_journal.recover(), (make_state('Red'), True))
+        document_journal.close()
+    
+    def test_discard_changes(self):
+        document_journal = DocumentJournal(self.filename, make_state('Black'))
+        document_journal.recover()
+        document_journal.append(make_state('Red'))
+        document_journal.close(discard_changes=True)
+        
+        document_journal = DocumentJournal(self.filename, make_state('Black'))
+        self.assertEqual(document_journal.recover(), (make_state('Black'), False))
+        document_journal.close()
+    
+    def test_save_as_replaces_old_journal(self):
+        other = os.path.join(self.directory, 'other.mtt')
+        document_journal = DocumentJournal(other, make_state('Black'))
+        document_journal.append(make_state('Red'))
+        document_journal.close()
+        
+        document_journal = DocumentJournal(None, make_state())
+        # no journal for a document that was not saved
+        document_journal.append(make_state('Blue'))
+        self.assertEqual(os.listdir(self.directory), ['other.mtt.journal'])
+        document_journal.save(make_state('Blue'), other)
+        document_journal.append(make_state('Yellow'))
+        document_journal.close()
+        
+        journal = Journal.for_document(other)
+        self.assertEqual([journal.get_state(i) for i in range(len(journal))],
+                         [make_state('Blue'), make_state('Yellow')])
+        journal.close()
+    
+    def test_undo_through_journal(self):
+        states = [make_state('Black'), make_state('Black', 'Red'),
+                  make_state('Gray', 'Red')]
+        document_journal = DocumentJournal(self.filename, states[0])
+        for state in states[1:]:
+            document_journal.append(state)
+        document_journal.close()
+        
+        document_journal = DocumentJournal(self.filename, states[0])
+        state, recovered = document_journal.recover()
+        model = ModelCurves(ChildModel=ModelInk, **state)
+        history = History(model)
+        document_journal.add_history(model)
+        self.assertEqual(history.get_counts(), (2, 0))
+        
+        curve_id = model.curves[0].id
+        history.undo()
+        self.assertEqual([curve.name for curve in model.curves], ['Black', 'Red'])
+        # the curve models are changed in place
+        self.assertEqual(model.curves[0].id, curve_id)
+        history.undo()
+        self.assertEqual([curve.name for curve in model.curves], ['Black'])
+        self.assertEqual(model.curves[0].id, curve_id)
+        history.redo()
+        history.redo()
+        self.assertEqual([curve.name for curve in model.curves], ['Gray', 'Red'])
+        document_journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mttfile
+from model import ModelCurves, ModelInk
+from library import ProfileLibrary
+
+
+def make_data(*inks):
+    """ inks: (name, cmyk, points, visible) """
+    return {'curves': [{'name': name, 'cmyk': cmyk, 'points': points,
+                        'visible': visible}
+                       for name, cmyk, points, visible in inks]}
+
+
+black = ('Black', (0, 0, 0, 1), [(0, 0), (1, 1)], True)
+gold = ('Gold', (0, 0.2, 0.8, 0.1), [(0, 0), (0.5, 0.2), (1, 0.8)], True)
+# a curve can't be interpolated with one point
+broken = ('Broken', (1, 0, 0, 0), [(0.5, 0.5)], False)
+
+
+class LibraryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = ProfileLibrary(os.path.join(self.directory, 'db',
+                                                   'library.sqlite'))
+        self.profiles = os.path.join(self.directory, 'profiles')
+        os.makedirs(os.path.join(self.profiles, 'sub'))
+    
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+    
+    def write(self, name, *inks):
+        path = os.path.join(self.profiles, name)
+        mttfile.save(path, make_data(*inks))
+        return path
+    
+    def write_json(self, name, text):
+        path = os.path.join(self.profiles, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+    
+    def test_scan(self):
+        duotone = self.write('duotone.mtt', black, gold)
+        mono = self.write(os.path.join('sub', 'mono.mtt'), black)
+        self.write_json('notes.txt', 'not a profile')
+        self.assertEqual(self.library.scan(self.profiles), (2, 0, []))
+        self.assertEqual(self.library.get_inks(duotone), [
+            ('Black', (0, 0, 0, 1), True),
+            ('Gold', (0, 0.2, 0.8, 0.1), True)])
+        self.assertEqual(self.library.search('gol'), [duotone])
+        self.assertEqual(self.library.search('black'), [duotone, mono])
+        self.assertEqual(self.library.get_gradient(mono).shape, (256, 3))
+        # nothing changed
+        self.assertEqual(self.library.scan(self.profiles), (0, 0, []))
+        os.remove(mono)
+        self.assertEqual(self.library.scan(self.profiles), (0, 1, []))
+        self.assertIsNone(self.library.get_gradient(mono))
+    
+    def test_overlapping_directories(self):
+        self.write('duotone.mtt', black, gold)
+        self.write(os.path.join('sub', 'mono.mtt'), black)
+        sub = os.path.join(self.profiles, 'sub')
+        self.assertEqual(self.library.scan(sub, self.profiles, sub + os.sep),
+                         (2, 0, []))
+    
+    def test_errors(self):
+        good = self.write('good.mtt', black)
+        bad_json = self.write_json('bad.mtt', '{"curves": ')
+        one_point = self.write('one_point.mtt', black, broken)
+        indexed, removed, errors = self.library.scan(self.profiles)
+        self.assertEqual((indexed, removed), (1, 0))
+        self.assertEqual(sorted(path for path, message in errors),
+                         [bad_json, one_point])
+        self.assertEqual(self.library.search(''), [good])
+        # the entry was written just partly, that was undone
+        self.assertIsNone(self.library.get_gradient(one_point))
+        self.assertEqual(self.library.get_inks(one_point), [])
+    
+    def test_broken_later(self):
+        path = self.write('profile.mtt', black)
+        self.library.scan(self.profiles)
+        self.write('profile.mtt', black, gold, broken)
+        indexed, removed, errors = self.library.scan(self.profiles)
+        self.assertEqual((indexed, removed), (0, 1))
+        self.assertEqual([error[0] for error in errors], [path])
+        self.assertEqual(self.library.search(''), [])
+    
+    def test_find(self):
+        duotone = self.write('duotone.mtt', black, gold)
+        mono = self.write('mono.mtt', black)
+        other = self.write('other.mtt', gold)
+        self.library.scan(self.profiles)
+        inks = ModelCurves(ChildModel=ModelInk, **make_data(black)).curves
+        self.assertEqual(self.library.find_same_curve(inks[0]), [duotone, mono])
+        similar = self.library.find_similar(inks, 2)
+        self.assertEqual(similar[0], (0, mono))
+        self.assertEqual([path for distance, path in similar], [mono, duotone])
+        self.assertTrue(similar[1][0] > 0)
+        self.assertEqual(len(self.library.find_similar(inks)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+from model import ModelCurves, ModelInk
+from history import History
+
+
+class Subscriber(object):
+    def __init__(self):
+        self.events = []
+    
+    def on_model_updated(self, model, event, *args):
+        self.events.append((model, event) + args)
+    
+    def get_transaction_events(self):
+        """ The events of the one transaction event received """
+        assert len(self.events) == 1, self.events
+        model, event, events = self.events[0]
+        assert event == 'transaction', event
+        return [(model, ) + args for args in model.get_transaction_events(events)]
+
+
+def make_model(**args):
+    model = ModelCurves(ChildModel=ModelInk, curves=[
+        {'name': 'Black', 'points': [(0, 0), (1, 1)]},
+        {'name': 'Red', 'cmyk': (0, 1, 1, 0)}
+    ], **args)
+    history = History(model)
+    subscriber = Subscriber()
+    model.add(subscriber)
+    return model, history, subscriber
+
+
+class TestTransaction(unittest.TestCase):
+    def test_events_are_collected(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[0]
+        with model.transaction():
+            ink.name = 'Blue'
+            ink.cmyk = (1, 0, 0, 0)
+            ink.cmyk = (1, 0.5, 0, 0)
+            self.assertEqual(subscriber.events, [])
+        self.assertEqual([event[2:] for event in subscriber.get_transaction_events()],
+                         [(ink, 'nameChanged'), (ink, 'cmykChanged')])
+    
+    def test_structural_events_are_summarized(self):
+        model, history, subscriber = make_model()
+        with model.transaction():
+            model.append_curve({'name': 'Yellow'})
+            model.remove_curve(model.curves[0])
+            model.curves[0].add_point((0.5, 0.3))
+        events = [event[1:] for event in subscriber.get_transaction_events()]
+        self.assertEqual(events[0], ('setCurves', ))
+        self.assertIn(('curveUpdate', model.curves[0], 'setPoints'), events)
+    
+    def test_unhashable_arguments(self):
+        model, history, subscriber = make_model()
+        with model.transaction():
+            model.trigger_on_model_updated('custom', [(0, 0), (1, 1)])
+            model.trigger_on_model_updated('custom', [(0, 0), (1, 1)])
+            model.trigger_on_model_updated('custom', [(0, 0)])
+        self.assertEqual(subscriber.get_transaction_events(), [
+            (model, 'custom', [(0, 0), (1, 1)]),
+            (model, 'custom', [(0, 0)])
+        ])
+    
+    def test_one_history_entry(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[1]
+        with model.transaction():
+            ink.name = 'Magenta'
+            ink.cmyk = (0, 1, 0, 0)
+            model.append_curve({'name': 'Cyan'})
+        self.assertEqual(history.get_counts(), (1, 0))
+        history.undo()
+        self.assertEqual(len(model), 2)
+        self.assertEqual((ink.name, ink.cmyk), ('Red', (0, 1, 1, 0)))
+        history.redo()
+        self.assertEqual(len(model), 3)
+        self.assertEqual((ink.name, ink.cmyk), ('Magenta', (0, 1, 0, 0)))
+    
+    def test_nested_transactions_join(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[0]
+        with model.transaction():
+            with ink.transaction():
+                ink.name = 'Gray'
+            self.assertEqual(subscriber.events, [])
+            ink.visible = False
+        self.assertEqual(history.get_counts(), (1, 0))
+        self.assertEqual(len(subscriber.get_transaction_events()), 2)
+    
+    def test_rollback_on_exception(self):
+        model, history, subscriber = make_model()
+        args = model.get_args()
+        ink = model.curves[0]
+        ids = model.ids
+        with self.assertRaises(RuntimeError):
+            with model.transaction():
+                ink.name = 'Gray'
+                ink.add_point((0.5, 0.2))
+                model.remove_curve(model.curves[1])
+                raise RuntimeError('stop')
+        self.assertEqual(model.get_args(), args)
+        self.assertEqual(model.ids, ids)
+        self.assertEqual(history.get_counts(), (0, 0))
+        self.assertEqual(subscriber.events, [])
+    
+    def test_one_event_for_each_subscriber(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[0]
+        point = ink.points[0]
+        ink_subscriber = Subscriber()
+        ink.add(ink_subscriber)
+        point_subscriber = Subscriber()
+        point.add(point_subscriber)
+        other_subscriber = Subscriber()
+        model.curves[1].add(other_subscriber)
+        with ink.transaction():
+            ink.name = 'Gray'
+            point.xy = (0, 0.2)
+            ink.cmyk = (0, 0, 0, 0.5)
+        # the parent of the transaction gets the relayed events as well
+        self.assertEqual([event[1:] for event in subscriber.get_transaction_events()],
+                         [('curveUpdate', ink, 'nameChanged'),
+                          ('curveUpdate', ink, 'pointUpdate', point),
+                          ('curveUpdate', ink, 'cmykChanged')])
+        self.assertEqual([event[1:] for event in ink_subscriber.get_transaction_events()],
+                         [('nameChanged', ), ('pointUpdate', point), ('cmykChanged', )])
+        self.assertEqual(point_subscriber.get_transaction_events(), [(point, )])
+        self.assertEqual(other_subscriber.events, [])
+        self.assertEqual(ink.points_value, [(0, 0.2), (1, 1)])
+    
+    def test_filtered_subscribers(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[0]
+        names = ('curveUpdate.nameChanged', )
+        model.add(subscriber, events=names)
+        with model.transaction():
+            ink.visible = False
+        self.assertEqual(subscriber.events, [])
+        with model.transaction():
+            ink.visible = True
+            ink.name = 'Gray'
+        events = subscriber.events[0][2]
+        self.assertEqual(model.get_transaction_events(events, names),
+                         [('curveUpdate', ink, 'nameChanged')])
+
+
+class TestSetArgs(unittest.TestCase):
+    def test_models_are_kept(self):
+        model, history, subscriber = make_model()
+        ids = model.ids
+        point_ids = [point.id for point in model.curves[0].points]
+        args = model.get_args()
+        args['curves'][1]['cmyk'] = [0, 0.5, 1, 0]
+        args['curves'].append({'name': 'Cyan', 'cmyk': (1, 0, 0, 0)})
+        model.set_args(**args)
+        self.assertEqual(model.ids[:2], ids)
+        self.assertEqual([point.id for point in model.curves[0].points],
+                         point_ids)
+        self.assertEqual(model.curves[1].cmyk, (0, 0.5, 1, 0))
+        self.assertEqual(model.curves[2].name, 'Cyan')
+        self.assertEqual(history.get_counts(), (1, 0))
+    
+    def test_remove_curves(self):
+        model, history, subscriber = make_model()
+        first = model.curves[0]
+        model.set_args(curves=[{'name': 'Black', 'points': [(0, 0), (1, 0.5)]}])
+        self.assertEqual(model.curves, (first, ))
+        self.assertEqual(first.points_value, [(0, 0), (1, 0.5)])
+        history.undo()
+        self.assertEqual(len(model), 2)
+        self.assertEqual(first.points_value, [(0, 0), (1, 1)])
+    
+    def test_no_changes(self):
+        model, history, subscriber = make_model()
+        model.set_args(**model.get_args())
+        self.assertEqual(history.get_counts(), (0, 0))
+        self.assertEqual(subscriber.events, [])
+
+
+class TestPoints(unittest.TestCase):
+    def test_replaced_point_models(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[0]
+        old_point = ink.points[0]
+        ink.points = [(0, 0), (0.5, 0.3), (1, 1)]
+        del subscriber.events[:]
+        # a view of the old point model may still change it
+        old_point.xy = (0.2, 0.8)
+        self.assertEqual(ink.points_value, [(0, 0), (0.5, 0.3), (1, 1)])
+        self.assertEqual(subscriber.events, [])
+        # the new point models are used again
+        point = ink.get_by_id(ink.points[1].id)
+        point.xy = (0.5, 0.4)
+        self.assertEqual(ink.points_value, [(0, 0), (0.5, 0.4), (1, 1)])
+        self.assertEqual(subscriber.events[-1][1:4],
+                         ('curveUpdate', ink, 'pointUpdate'))
+    
+    def test_removed_point_model(self):
+        model, history, subscriber = make_model()
+        ink = model.curves[0]
+        point = ink.points[0]
+        ink.add_point((0.5, 0.3))
+        ink.remove_point(point)
+        value = ink.points_value
+        del subscriber.events[:]
+        point.xy = (0.1, 0.1)
+        self.assertEqual(ink.points_value, value)
+        self.assertEqual(subscriber.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import PIL.Image as Image
+
+from model import ModelCurves, ModelInk
+from mtt2eps import batch_model2eps, image2eps_tool, iter_gray_images, map_image
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.images = []
+        for i in range(3):
+            filename = os.path.join(self.directory, 'image-{0}.png'.format(i))
+            pixels = np.arange(64, dtype=np.uint8).reshape(8, 8) + i
+            Image.fromarray(pixels).save(filename)
+            self.images.append(filename)
+        self.model = ModelCurves(ChildModel=ModelInk, curves=[
+            {'name': 'Black', 'cmyk': (0, 0, 0, 1), 'points': [(0, 0), (1, 1)]}])
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+    
+    def test_iter_gray_images(self):
+        filenames = self.images + [self._path('missing.png')]
+        results = list(iter_gray_images(filenames, prefetch=1))
+        self.assertEqual([result[0] for result in results], filenames)
+        for i, (filename, pixels, notice, error) in enumerate(results[:3]):
+            self.assertIsNone(error)
+            self.assertEqual(int(pixels[0, 0]), i)
+        self.assertEqual(results[3][3][0], 'error')
+    
+    def test_batch(self):
+        jobs = [(image, image + '.eps') for image in self.images]
+        results = list(batch_model2eps(self.model, jobs))
+        self.assertEqual([result[:3] for result in results],
+                         [job + (True, ) for job in jobs])
+        for image, eps in jobs:
+            with open(eps, 'rb') as f:
+                self.assertTrue(f.read().startswith(b'%!PS-Adobe-3.0 EPSF-3.0'))
+    
+    def test_failed_jobs(self):
+        jobs = [(self.images[0], self._path('no directory', 'image.eps')),
+                (self._path('missing.png'), self._path('missing.eps')),
+                (self.images[1], self._path('image.eps'))]
+        results = list(batch_model2eps(self.model, jobs))
+        self.assertEqual([result[:2] for result in results], jobs)
+        self.assertEqual([result[2] for result in results], [False, False, True])
+        self.assertEqual(results[0][3][0], 'error')
+        self.assertEqual(results[1][3][0], 'error')
+        self.assertTrue(os.path.exists(self._path('image.eps')))
+        self.assertFalse(os.path.exists(self._path('missing.eps')))
+
+
+class MapImageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # more than one chunk of the eps image data
+        self.pixels = (np.arange(300 * 400) % 251).astype(np.uint8).reshape(300, 400)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def _save(self, name, image, **kwargs):
+        filename = os.path.join(self.directory, name)
+        image.save(filename, **kwargs)
+        return filename
+    
+    def _assert_mapped(self, filename):
+        pixels = map_image(filename)
+        self.assertIsInstance(pixels, np.memmap)
+        np.testing.assert_array_equal(pixels, self.pixels)
+        del pixels
+    
+    def test_pgm(self):
+        self._assert_mapped(self._save('image.pgm', Image.fromarray(self.pixels)))
+    
+    def test_uncompressed_tiff(self):
+        self._assert_mapped(self._save('image.tif', Image.fromarray(self.pixels)))
+    
+    def test_fallback(self):
+        image = Image.fromarray(self.pixels)
+        filenames = [self._save('image.png', image),
+                     self._save('image.tif', image, compression='tiff_lzw'),
+                     self._save('rgb.tif', image.convert('RGB'))]
+        for filename in filenames:
+            self.assertIsNone(map_image(filename), filename)
+        self.assertIsNone(map_image(os.path.join(self.directory, 'missing.pgm')))
+    
+    def test_truncated(self):
+        filename = self._save('image.pgm', Image.fromarray(self.pixels))
+        with open(filename, 'rb+') as f:
+            f.truncate(os.path.getsize(filename) - 1)
+        self.assertIsNone(map_image(filename))
+    
+    def test_write_equals_create(self):
+        inks = [ModelInk(name='Black', cmyk=(0, 0, 0, 1), points=[(0, 0), (1, 1)]),
+                ModelInk(name='Cyan', cmyk=(1, 0, 0, 0), points=[(0, 0), (0.5, 0.8), (1, 0)])]
+        filename = self._save('image.pgm', Image.fromarray(self.pixels))
+        for source in (map_image(filename), Image.fromarray(self.pixels)):
+            eps_tool = image2eps_tool(source)
+            eps_tool.set_color_data(*inks)
+            f = io.BytesIO()
+            eps_tool.write(f)
+            self.assertEqual(f.getvalue(), eps_tool.create())
+
+
+if __name__ == '__main__':
+    unittest.main()
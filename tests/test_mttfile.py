@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import mttfile
+
+
+def make_data():
+    return {'curves': [
+                {'name': 'Black', 'cmyk': [0, 0, 0, 1], 'visible': True,
+                 'interpolation': 'monotoneCubic',
+                 'points': [[0, 0], [0.25, 0.5], [1, 1]]},
+                {'name': 'Gold', 'cmyk': [0, 0.2, 0.8, 0.1], 'visible': False,
+                 'interpolation': 'linear', 'points': [[0.5, 0.125], [1, 0]]},
+                {'name': 'No Points'}
+            ]}
+
+
+def as_floats(data):
+    """ data like unpack returns it """
+    data = json.loads(mttfile.dumps(data))
+    for curve in data['curves']:
+        if 'points' in curve:
+            curve['points'] = [[float(x), float(y)] for x, y in curve['points']]
+    return data
+
+
+class PackTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        data = make_data()
+        self.assertEqual(mttfile.unpack(mttfile.pack(data)), as_floats(data))
+    
+    def test_coordinates_are_floats(self):
+        result = mttfile.unpack(mttfile.pack(make_data()))
+        for x, y in result['curves'][0]['points']:
+            self.assertIsInstance(x, float)
+            self.assertIsInstance(y, float)
+    
+    def test_no_curves(self):
+        self.assertEqual(mttfile.unpack(mttfile.pack({'curves': []})),
+                         {'curves': []})
+    
+    def test_not_packed(self):
+        self.assertRaises(ValueError, mttfile.unpack, b'')
+        self.assertRaises(ValueError, mttfile.unpack,
+                          mttfile.dumps(make_data()).encode('utf-8'))
+
+
+class FileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'inks.mtt')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_load_json(self):
+        data = make_data()
+        mttfile.save(self.filename, data)
+        self.assertFalse(os.path.exists(self.filename + mttfile.sidecar_extension))
+        self.assertEqual(mttfile.load(self.filename), json.loads(mttfile.dumps(data)))
+    
+    def test_load_sidecar(self):
+        data = make_data()
+        mttfile.save(self.filename, data)
+        mttfile.write_sidecar(self.filename, data)
+        # prove the sidecar is read and not the JSON
+        with open(self.filename + mttfile.sidecar_extension, 'rb') as f:
+            self.assertEqual(mttfile.unpack(f.read()), mttfile.load(self.filename))
+        self.assertEqual(mttfile.load(self.filename), as_floats(data))
+    
+    def test_save_updates_sidecar(self):
+        data = make_data()
+        mttfile.save(self.filename, data)
+        mttfile.write_sidecar(self.filename, data)
+        data['curves'][0]['name'] = 'Darker Black'
+        mttfile.save(self.filename, data)
+        self.assertEqual(mttfile.load(self.filename), as_floats(data))
+    
+    def test_stale_sidecar_is_ignored(self):
+        data = make_data()
+        mttfile.save(self.filename, data)
+        mttfile.write_sidecar(self.filename, data)
+        # another program changes the .mtt file
+        data['curves'][1]['name'] = 'Silver and some more text'
+        with open(self.filename, 'w') as f:
+            f.write(mttfile.dumps(data))
+        self.assertEqual(mttfile.load(self.filename)['curves'][1]['name'],
+                         'Silver and some more text')
+
+
+if __name__ == '__main__':
+    unittest.main()
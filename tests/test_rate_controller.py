@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import rate_controller
+from rate_controller import RateController
+
+
+class TestRateController(unittest.TestCase):
+    def setUp(self):
+        self.time = 100.0
+        self._now = rate_controller._now
+        rate_controller._now = lambda: self.time
+    
+    def tearDown(self):
+        rate_controller._now = self._now
+    
+    def test_min_interval(self):
+        rate = RateController()
+        self.assertTrue(rate.can_start())
+        rate.finish(rate.start())
+        self.assertFalse(rate.is_busy())
+        self.assertFalse(rate.can_start())
+        self.assertAlmostEqual(rate.get_wait(), rate.min_interval)
+        self.assertEqual(rate.get_wait_ms(), 40)
+        self.time += rate.min_interval / 2
+        self.assertFalse(rate.can_start())
+        self.assertEqual(rate.get_wait_ms(), 20)
+        self.time += rate.min_interval
+        self.assertTrue(rate.can_start())
+        self.assertEqual(rate.get_wait(), 0)
+    
+    def test_in_flight(self):
+        rate = RateController()
+        # the initial estimate is slow, one job at once
+        first = rate.start()
+        self.time += 1
+        self.assertTrue(rate.is_busy())
+        self.assertFalse(rate.can_start())
+        self.time += 0.05
+        rate.finish(first)
+        self.assertAlmostEqual(rate.get_estimate(), 1.05)
+        self.assertTrue(rate.can_start())
+    
+    def test_pipelining(self):
+        rate = RateController()
+        for i in range(3):
+            token = rate.start()
+            self.time += 0.05
+            rate.finish(token)
+        self.assertEqual(rate.get_max_in_flight(), 2)
+        rate.start()
+        self.time += rate.min_interval
+        self.assertTrue(rate.can_start())
+        rate.start()
+        self.time += rate.min_interval
+        self.assertFalse(rate.can_start())
+    
+    def test_estimate_per_key(self):
+        rate = RateController()
+        token = rate.start('small')
+        self.time += 0.1
+        rate.finish(token)
+        self.assertAlmostEqual(rate.get_estimate('small'), 0.1)
+        self.assertEqual(rate.get_estimate('big'), rate.initial_estimate)
+        # a moving average
+        token = rate.start('small')
+        self.time += 0.2
+        rate.finish(token)
+        self.assertAlmostEqual(rate.get_estimate('small'),
+                               0.1 + rate.smoothing * 0.1)
+    
+    def test_delay(self):
+        rate = RateController()
+        self.assertAlmostEqual(rate.get_delay(),
+                               rate.initial_estimate * rate.delay_factor)
+        token = rate.start()
+        self.time += 10
+        rate.finish(token)
+        self.assertEqual(rate.get_delay(), rate.max_delay)
+        self.assertEqual(rate.get_delay_ms(), 1000)
+    
+    def test_outdated_results(self):
+        rate = RateController()
+        first = rate.start()
+        self.time += 1
+        second = rate.start()
+        self.assertTrue(rate.finish(second))
+        self.assertFalse(rate.finish(first))
+        self.assertEqual(rate.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
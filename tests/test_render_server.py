@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from multiprocessing import Pool
+try:
+    # python 2
+    from httplib import HTTPConnection
+except ImportError:
+    # python 3
+    from http.client import HTTPConnection
+
+import numpy as np
+import PIL.Image as Image
+
+try:
+    from render_server import RenderService, RenderServer
+    from ghostscript_workers import PreviewWorker
+except RuntimeError:
+    # the Ghostscript library is not installed
+    RenderService = None
+
+from image_cache import ImageCache
+from color_management import ColorTransform
+
+
+profile = {'curves': [{'name': 'Black', 'cmyk': [0, 0, 0, 1],
+                       'points': [[0, 0], [1, 1]]}]}
+
+
+@unittest.skipIf(RenderService is None, 'Ghostscript is not available')
+class RenderServerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.image_root = os.path.join(cls.directory, 'images')
+        os.mkdir(cls.image_root)
+        pixels = np.arange(32 * 16, dtype=np.uint32).reshape(16, 32) % 256
+        Image.fromarray(pixels.astype(np.uint8)).save(
+                                os.path.join(cls.image_root, 'image.png'))
+        Image.new('L', (4, 4)).save(os.path.join(cls.directory, 'secret.png'))
+        # without Ghostscript, the previews are rendered with lookup tables
+        cls.pool = Pool(1)
+        preview_worker = PreviewWorker(cls.pool, ImageCache(cls.directory),
+                                       ColorTransform())
+        cls.service = RenderService(preview_worker, max_concurrent=1,
+                                    timeout=30, image_root=cls.image_root)
+        cls.server = RenderServer(('127.0.0.1', 0), cls.service)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.service.preview_worker.image_cache.close()
+        cls.pool.terminate()
+        cls.pool.join()
+        shutil.rmtree(cls.directory)
+    
+    def request(self, method, path, body=None):
+        """ Return (status, headers, body) """
+        connection = HTTPConnection('127.0.0.1', self.server.server_address[1],
+                                    timeout=30)
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+    
+    def post(self, path, data=profile):
+        return self.request('POST', path, json.dumps(data).encode('utf-8'))
+    
+    def get_metrics(self):
+        status, headers, body = self.request('GET', '/metrics')
+        self.assertEqual(status, 200)
+        return json.loads(body.decode('utf-8'))
+    
+    def test_preview(self):
+        status, headers, body = self.post('/preview?image=image.png')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'image/png')
+        with tempfile.TemporaryFile() as f:
+            f.write(body)
+            f.seek(0)
+            im = Image.open(f)
+            self.assertEqual(im.size, (32, 16))
+            # a black ink on white paper from black to white
+            self.assertEqual(im.getpixel((0, 0)), im.getpixel((0, 0))[:1] * 3)
+    
+    def test_scaled_preview(self):
+        status, headers, body = self.post('/preview?image=image.png&scale=0.5')
+        self.assertEqual(status, 200)
+        with tempfile.TemporaryFile() as f:
+            f.write(body)
+            f.seek(0)
+            self.assertEqual(Image.open(f).size, (16, 8))
+    
+    def test_eps(self):
+        status, headers, body = self.post('/eps?image=image.png')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'application/postscript')
+        self.assertTrue(body.startswith(b'%!PS-Adobe-3.0 EPSF-3.0'))
+    
+    def test_metrics(self):
+        before = self.get_metrics()['requests'].get('eps', {'count': 0})
+        self.post('/eps?image=image.png')
+        self.post('/eps?image=missing.png')
+        after = self.get_metrics()['requests']['eps']
+        self.assertEqual(after['count'], before['count'] + 2)
+        self.assertEqual(after['errors'], before.get('errors', 0) + 1)
+        self.assertIn('p95', after)
+    
+    def test_too_many_requests(self):
+        # the only slot is taken
+        self.assertTrue(self.service.acquire())
+        try:
+            status, headers, body = self.post('/preview?image=image.png')
+        finally:
+            self.service.release()
+        self.assertEqual(status, 503)
+        self.assertEqual(headers['Retry-After'], '1')
+        self.assertEqual(self.post('/preview?image=image.png')[0], 200)
+    
+    def test_outside_image_root(self):
+        self.assertEqual(self.post('/preview?image=../secret.png')[0], 403)
+        path = os.path.join(self.directory, 'secret.png')
+        self.assertEqual(self.post('/eps?image=' + path)[0], 403)
+    
+    def test_errors(self):
+        status, headers, body = self.post('/preview?image=missing.png')
+        self.assertEqual(status, 400)
+        self.assertIn('error', json.loads(body.decode('utf-8')))
+        self.assertEqual(self.post('/preview')[0], 400)
+        self.assertEqual(self.post('/preview?image=image.png&scale=2')[0], 400)
+        self.assertEqual(self.post('/preview?image=image.png',
+                                   {'curves': [{'points': 'none'}]})[0], 400)
+        self.assertEqual(self.request('POST', '/eps?image=image.png', b'{')[0], 400)
+        self.assertEqual(self.post('/nothing')[0], 404)
+        self.assertEqual(self.request('GET', '/nothing')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
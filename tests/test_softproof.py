@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import PIL.Image as Image
+
+from model import ModelCurves, ModelInk
+from color_management import ImageCms
+from softproof import lab_to_linear_rgb, linear_to_srgb, srgb_to_linear, \
+                      OverprintTransform, proof_image, batch_proof
+from tests.test_color_management import make_cmyk_profile
+
+
+def make_model():
+    return ModelCurves(ChildModel=ModelInk, curves=[
+        {'name': 'Cyan', 'cmyk': (1, 0, 0, 0), 'points': [(0, 0), (1, 1)]},
+        {'name': 'Yellow', 'cmyk': (0, 0, 1, 0), 'points': [(0, 0), (1, 1)]}
+    ])
+
+
+# measured colors, paper is a bit yellowish
+paper_lab = (95, 0, 5)
+lab = {'Cyan': (55, -37, -50), 'Yellow': (89, -5, 93)}
+
+
+def to_srgb(linear):
+    return np.rint(linear_to_srgb(linear) * 255).astype(np.uint8)
+
+
+class ConversionTestCase(unittest.TestCase):
+    def test_lab_to_linear_rgb(self):
+        self.assertTrue(np.allclose(lab_to_linear_rgb((100, 0, 0)), 1, atol=0.001))
+        self.assertTrue(np.allclose(lab_to_linear_rgb((0, 0, 0)), 0))
+        gray = lab_to_linear_rgb([(50, 0, 0), (75, 0, 0)])
+        self.assertEqual(gray.shape, (2, 3))
+        self.assertTrue(np.allclose(gray, gray[:, :1], atol=0.001))
+        self.assertTrue(np.all(gray[0] < gray[1]))
+    
+    def test_srgb(self):
+        values = np.linspace(0, 1, 11)
+        self.assertTrue(np.allclose(srgb_to_linear(linear_to_srgb(values)), values))
+        self.assertAlmostEqual(float(linear_to_srgb(0.5)), 0.7354, 3)
+
+
+class OverprintTestCase(unittest.TestCase):
+    def setUp(self):
+        self.inks = make_model().curves
+        self.transform = OverprintTransform(lab, paper_lab)
+    
+    def test_no_ink_is_paper(self):
+        amounts = np.zeros((3, 2), dtype=np.uint8)
+        rgb = self.transform.get_rgb(amounts, *self.inks)
+        paper = to_srgb(lab_to_linear_rgb(paper_lab))
+        self.assertEqual(rgb.tolist(), [paper.tolist()] * 3)
+        # estimated paper without measurements is white
+        rgb = OverprintTransform().get_rgb(amounts, *self.inks)
+        self.assertEqual(rgb.tolist(), [[255, 255, 255]] * 3)
+    
+    def test_solid_is_measured(self):
+        amounts = np.array([[255, 0], [0, 255]], dtype=np.uint8)
+        rgb = self.transform.get_rgb(amounts, *self.inks).astype(int)
+        paper = lab_to_linear_rgb(paper_lab)
+        for index, name in enumerate(['Cyan', 'Yellow']):
+            # a solid can't be brighter than the paper
+            expected = to_srgb(np.minimum(lab_to_linear_rgb(lab[name]), paper))
+            self.assertTrue(np.all(np.abs(rgb[index] - expected) <= 1))
+    
+    def test_monotonic(self):
+        amounts = np.zeros((256, 2), dtype=np.uint8)
+        amounts[:, 0] = np.arange(256)
+        rgb = self.transform.get_rgb(amounts, *self.inks).astype(int)
+        # Murray-Davies: more ink lets through less light in every channel
+        self.assertTrue(np.all(np.diff(rgb, axis=0) <= 0))
+        self.assertTrue(np.any(np.diff(rgb, axis=0) < 0))
+    
+    def test_overprint_multiplies(self):
+        transform = OverprintTransform(lab)
+        amounts = np.array([[255, 0], [0, 255], [255, 255]], dtype=np.uint8)
+        linear = srgb_to_linear(transform.get_rgb(amounts, *self.inks) / 255)
+        self.assertTrue(np.allclose(linear[2], linear[0] * linear[1], atol=0.01))
+    
+    @unittest.skipIf(ImageCms is None, 'PIL has no ImageCms')
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            profile = os.path.join(directory, 'press.icc')
+            with open(profile, 'wb') as f:
+                f.write(make_cmyk_profile())
+            transform = OverprintTransform(cmyk_profile=profile)
+            table = transform.get_table(*self.inks)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(table.shape, (256, 4))
+        self.assertEqual(table[255].tolist(), [255, 255, 255, 0])
+        self.assertTrue(np.all(table[0, :3] < 255))
+
+
+class ProofTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.model = make_model()
+        self.transform = OverprintTransform(lab, paper_lab)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_proof_image(self):
+        pixels = np.array([[0, 128, 255]], dtype=np.uint8)
+        im = proof_image(self.transform, pixels, *self.model.visible_curves)
+        self.assertEqual((im.mode, im.size), ('RGB', (3, 1)))
+        table = self.transform.get_table(*self.model.visible_curves)
+        for x, value in enumerate(pixels[0]):
+            # B G R unused => R G B
+            self.assertEqual(list(im.getpixel((x, 0))),
+                             table[value, 2::-1].tolist())
+    
+    def test_batch_proof(self):
+        image = os.path.join(self.directory, 'image.png')
+        Image.new('L', (4, 3), 255).save(image)
+        proof = os.path.join(self.directory, 'proof.png')
+        jobs = [(image, proof), (image, os.path.join(self.directory, 'proof.nothing'))]
+        results = list(batch_proof(self.transform, self.model, jobs))
+        self.assertEqual([result[:3] for result in results],
+                         [jobs[0] + (True, ), jobs[1] + (False, )])
+        self.assertEqual(results[1][3][0], 'error')
+        im = Image.open(proof)
+        self.assertEqual(im.size, (4, 3))
+        paper = to_srgb(lab_to_linear_rgb(paper_lab)).tolist()
+        self.assertEqual(list(im.getpixel((0, 0))), paper)
+        im.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+from model import ModelCurves, ModelInk
+from history import History
+from epstool import get_device_n_table
+from variants import get_value, set_value, apply_value, get_bounds, \
+                     get_sweep_values, make_grid, get_inks, min_distance
+
+
+def make_model():
+    return ModelCurves(ChildModel=ModelInk, curves=[
+        {'name': 'Black', 'cmyk': (0, 0, 0, 1),
+         'points': [(0, 0), (0.5, 0.6), (0.52, 0.7), (1, 1)]},
+        {'name': 'Gold', 'cmyk': (0, 0.2, 0.8, 0.1), 'points': [(0, 0), (1, 1)]}
+    ])
+
+
+class VariantsTestCase(unittest.TestCase):
+    def test_get_and_set_value(self):
+        args = make_model().get_args()
+        self.assertEqual(get_value(args, ('point', 0, 1, 1)), 0.6)
+        self.assertEqual(get_value(args, ('cmyk', 1, 2)), 0.8)
+        changed = set_value(args, ('cmyk', 1, 2), 0.5)
+        self.assertEqual(get_value(changed, ('cmyk', 1, 2)), 0.5)
+        # args is not changed
+        self.assertEqual(get_value(args, ('cmyk', 1, 2)), 0.8)
+        self.assertRaises(ValueError, get_value, args, ('nothing', 0))
+    
+    def test_apply_value(self):
+        model = make_model()
+        history = History(model)
+        apply_value(model, ('point', 0, 1, 1), 0.25)
+        self.assertEqual(model.curves[0].points_value[1], (0.5, 0.25))
+        history.undo()
+        self.assertEqual(model.curves[0].points_value[1], (0.5, 0.6))
+    
+    def test_get_bounds(self):
+        args = make_model().get_args()
+        self.assertEqual(get_bounds(args, ('cmyk', 0, 0)), (0, 1))
+        self.assertEqual(get_bounds(args, ('point', 0, 1, 1)), (0, 1))
+        self.assertEqual(get_bounds(args, ('point', 0, 0, 0)),
+                         (0, 0.5 - min_distance))
+        self.assertEqual(get_bounds(args, ('point', 0, 1, 0)),
+                         (min_distance, 0.52 - min_distance))
+        self.assertEqual(get_bounds(args, ('point', 0, 3, 0)),
+                         (0.52 + min_distance, 1))
+    
+    def assertValues(self, values, expected):
+        self.assertEqual(len(values), len(expected))
+        for value, expected_value in zip(values, expected):
+            self.assertAlmostEqual(value, expected_value)
+    
+    def test_get_sweep_values(self):
+        self.assertValues(get_sweep_values(0.5, 0.25, 3), [0.25, 0.5, 0.75])
+        self.assertValues(get_sweep_values(0.9, 0.2, 3), [0.7, 0.85, 1])
+        self.assertValues(get_sweep_values(0.5, 0.25, 3, 0.4, 0.6), [0.4, 0.5, 0.6])
+        # closer to the bound than min_distance
+        self.assertValues(get_sweep_values(0.5, 0.25, 3, 0.5005, 0.6),
+                          [0.5, 0.55, 0.6])
+    
+    def test_sweep_x_between_neighbours(self):
+        args = make_model().get_args()
+        parameter = ('point', 0, 1, 0)
+        values = get_sweep_values(get_value(args, parameter), 0.1, 9,
+                                  *get_bounds(args, parameter))
+        self.assertEqual(len(values), 9)
+        for value in values:
+            self.assertTrue(0 < value < 0.52)
+            inks = get_inks(set_value(args, parameter, value))
+            # the point keeps its place, the curve can be interpolated
+            self.assertEqual(inks[0].points_value[1][0], value)
+            get_device_n_table(*inks)
+    
+    def test_make_grid(self):
+        args = make_model().get_args()
+        grid = make_grid(args, (('cmyk', 1, 0), [0, 0.5]),
+                               (('point', 0, 1, 1), [0.1, 0.2, 0.3]))
+        self.assertEqual(len(grid), 2)
+        self.assertEqual([len(row) for row in grid], [3, 3])
+        self.assertEqual(get_value(grid[1][2], ('cmyk', 1, 0)), 0.5)
+        self.assertEqual(get_value(grid[1][2], ('point', 0, 1, 1)), 0.3)
+        self.assertEqual(len(make_grid(args, (('cmyk', 1, 0), [0, 1]))[0]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
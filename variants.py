@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright © 2013 by Lasse Fister <commander@graphicore.de>
+# 
+# This file is part of Multitoner.
+#
+# Multitoner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Multitoner is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Variants of a set of inks, to compare them side by side.
+
+The variants are made from the data of ModelCurves.get_args, so the
+model itself, its history and its subscribers are not touched.
+
+A parameter is one of:
+    ('point', curve index, point index, axis): axis 0 is x, 1 is y
+    ('cmyk', curve index, channel): channel 0 is cyan ... 3 is black
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import copy
+
+import numpy as np
+
+from model import ModelCurves, ModelInk
+
+__all__ = ['get_value', 'set_value', 'apply_value', 'get_bounds',
+           'get_sweep_values', 'make_grid', 'get_inks']
+
+# the smallest distance of the x value of a point to its neighbours, see
+# get_bounds
+min_distance = 0.001
+
+
+def _replace(values, index, value):
+    """ Return a tuple of values with value at index """
+    values = list(values)
+    values[index] = value
+    return tuple(values)
+
+
+def _get_key(parameter):
+    kind = parameter[0]
+    if kind not in ('point', 'cmyk'):
+        raise ValueError('Unknown parameter {0}'.format(kind))
+    return 'points' if kind == 'point' else 'cmyk'
+
+
+def get_value(args, parameter):
+    """ Return the value of parameter in args, a dict like
+    ModelCurves.get_args returns.
+    """
+    value = args['curves'][parameter[1]][_get_key(parameter)]
+    for index in parameter[2:]:
+        value = value[index]
+    return value
+
+
+def _set(curve_args, parameter, value):
+    """ Return the new value of curve_args[_get_key(parameter)] """
+    key = _get_key(parameter)
+    if key == 'cmyk':
+        return _replace(curve_args['cmyk'], parameter[2], value)
+    point_index, axis = parameter[2:]
+    points = list(curve_args['points'])
+    points[point_index] = _replace(points[point_index], axis, value)
+    return points
+
+
+def set_value(args, parameter, value):
+    """ Return a copy of args with value for parameter """
+    args = copy.deepcopy(args)
+    curve_args = args['curves'][parameter[1]]
+    curve_args[_get_key(parameter)] = _set(curve_args, parameter, value)
+    return args
+
+
+def apply_value(model, parameter, value):
+    """ Set value for parameter in model, an instance of ModelCurves,
+    i.e. to keep a variant. This is one step in the history of model.
+    """
+    curve = model.curves[parameter[1]]
+    setattr(curve, _get_key(parameter), _set(curve.get_args(), parameter, value))
+
+
+def get_bounds(args, parameter):
+    """ Return (low, high), the range of the values of parameter in args.
+    
+    All values are between 0 and 1. The x value of a point stays between
+    the x values of its neighbours, min_distance away from them. Otherwise
+    the points would change their order or two points would have the same
+    x value, which the interpolations can't handle.
+    """
+    if parameter[0] != 'point' or parameter[3] != 0:
+        return 0.0, 1.0
+    # sorted by x, see ModelCurve.points_value
+    points = args['curves'][parameter[1]]['points']
+    index = parameter[2]
+    low, high = 0.0, 1.0
+    if index > 0:
+        low = points[index - 1][0] + min_distance
+    if index < len(points) - 1:
+        high = points[index + 1][0] - min_distance
+    return low, high
+
+
+def get_sweep_values(center, spread, count, low=0.0, high=1.0):
+    """ Return count values from center - spread to center + spread, all
+    between low and high, see get_bounds. If center is closer to a bound
+    than min_distance, center is the limit on that side.
+    """
+    low = min(center, max(low, center - spread))
+    high = max(center, min(high, center + spread))
+    return [float(value) for value in np.linspace(low, high, count)]
+
+
+def make_grid(args, rows, columns=None):
+    """ Return a list of rows, each a list of args with the variants.
+    
+    rows: (parameter, values), each row has one of values
+    columns: (parameter, values), each column has one of values or None,
+             then there is just one column
+    """
+    row_parameter, row_values = rows
+    if columns is None:
+        columns = (None, [None])
+    column_parameter, column_values = columns
+    grid = []
+    for row_value in row_values:
+        row = []
+        row_args = set_value(args, row_parameter, row_value)
+        for column_value in column_values:
+            if column_parameter is None:
+                row.append(row_args)
+            else:
+                row.append(set_value(row_args, column_parameter, column_value))
+        grid.append(row)
+    return grid
+
+
+def get_inks(args):
+    """ Return the visible inks of args as instances of ModelInk """
+    # make_grid returns copies, so the lists can be used by the model
+    return ModelCurves(ChildModel=ModelInk, **args).visible_curves